@@ -0,0 +1,222 @@
+"""
+This file contains an in-memory stand-in for db.Database, so the benchmark
+needs no MySQL server. It implements the same methods with the same return
+types.
+"""
+
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from changes import diff_member_info
+from model import (
+    MemberChange,
+    MemberInfo,
+    UserInDB,
+    UserVenue,
+    VenuesTable,
+    VenueUsersTable,
+)
+
+
+class FakeDatabase:
+    """
+    An in-memory Database. All instances share the tables set up by seed().
+    """
+
+    _lock = threading.Lock()
+    _users: Dict[str, str] = {}
+    _venues: Dict[str, VenuesTable] = {}
+    _venue_users: Dict[Tuple[str, str], VenueUsersTable] = {}
+    _snapshots: Dict[Tuple[str, str], Tuple[datetime, MemberInfo]] = {}
+    _versions: Dict[str, int] = {}
+    _changes: Dict[str, List[MemberChange]] = {}
+
+    # Seconds added to every call to imitate a database round trip
+    latency = 0.0
+
+    @classmethod
+    def seed(
+        cls,
+        venue_urls: Dict[str, str],
+        users: int,
+        hashed_password: str,
+        latency: float = 0.0,
+    ):
+        """
+        Fill the tables with benchmark users who all have credentials for
+        every venue.
+
+        Parameters
+        ----------
+        venue_urls : Dict[str, str]
+            Base URL of each fake venue site keyed by venue (ie; 'CPE')
+        users : int
+            Number of sso users to create (bench-user-0, bench-user-1, ...).
+        hashed_password : str
+            The password hash stored for every user.
+        latency : float
+            Seconds added to every call.
+        """
+        cls.latency = latency
+        cls._venues = {
+            venue: VenuesTable(
+                venue=venue,
+                url=url,
+                icon=f"{venue.lower()}.png",
+                description=f"Benchmark {venue}",
+            )
+            for venue, url in venue_urls.items()
+        }
+        for index in range(users):
+            user_id = f"bench-user-{index}"
+            cls._users[user_id] = hashed_password
+            for venue in venue_urls:
+                cls._venue_users[(user_id, venue)] = VenueUsersTable(
+                    user_id=user_id,
+                    venue=venue,
+                    venue_user_id=f"{user_id}@example.com",
+                    venue_password="secret",
+                )
+
+    def _round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_venue_user_info(
+        self, user_id: str, venue: str
+    ) -> Optional[VenueUsersTable]:
+        self._round_trip()
+        return self._venue_users.get((user_id, venue))
+
+    def get_user_venue_plan(self, user_id: str) -> List[UserVenue]:
+        self._round_trip()
+        return [
+            UserVenue(
+                venue_info=venue_info,
+                user_info=self._venue_users.get((user_id, venue)),
+            )
+            for venue, venue_info in self._venues.items()
+        ] + [
+            UserVenue(
+                venue_info=VenuesTable(
+                    venue=venue, url="", icon="", description=""
+                ),
+                user_info=user_info,
+            )
+            for (owner, venue), user_info in self._venue_users.items()
+            if owner == user_id and venue not in self._venues
+        ]
+
+    def update_venue_user_info(self, data: VenueUsersTable) -> bool:
+        self._round_trip()
+        key = (data.user_id, data.venue)
+        with self._lock:
+            self._venue_users[key] = data
+            if self._snapshots.pop(key, None) is not None:
+                version = self._versions.get(data.user_id, 0) + 1
+                self._versions[data.user_id] = version
+                self._changes.setdefault(data.user_id, []).append(
+                    MemberChange(
+                        venue=data.venue,
+                        change="removed",
+                        version=version,
+                        changed_at=datetime.utcnow(),
+                    )
+                )
+        return True
+
+    def get_venue_info(self, venue: str = None) -> List[VenuesTable]:
+        self._round_trip()
+        if venue is None:
+            return list(self._venues.values())
+        return [self._venues[venue]] if venue in self._venues else []
+
+    def get_user(self, username: str) -> Optional[UserInDB]:
+        self._round_trip()
+        hashed_password = self._users.get(username)
+        if hashed_password is None:
+            return None
+        return UserInDB(username=username, hashed_password=hashed_password)
+
+    def create_user(self, username: str, password: str) -> bool:
+        self._round_trip()
+        with self._lock:
+            if username in self._users:
+                return False
+            self._users[username] = password
+        return True
+
+    def change_password(self, username: str, password: str) -> bool:
+        self._round_trip()
+        with self._lock:
+            self._users[username] = password
+        return True
+
+    def create_snapshot_tables(self):
+        pass
+
+    def save_member_snapshot(
+        self, user_id: str, member_info: MemberInfo
+    ) -> bool:
+        self._round_trip()
+        now = datetime.utcnow()
+        key = (user_id, member_info.venue)
+        with self._lock:
+            previous = self._snapshots.get(key)
+            changes = diff_member_info(
+                previous[1] if previous else None, member_info
+            )
+            self._snapshots[key] = (
+                now,
+                member_info.model_copy(update={"from_cache": False}),
+            )
+            if changes:
+                version = self._versions.get(user_id, 0) + 1
+                self._versions[user_id] = version
+                self._changes.setdefault(user_id, []).extend(
+                    change.model_copy(
+                        update={"version": version, "changed_at": now}
+                    )
+                    for change in changes
+                )
+        return True
+
+    def get_member_changes(
+        self, user_id: str, since: int = 0
+    ) -> Tuple[int, List[MemberChange]]:
+        self._round_trip()
+        with self._lock:
+            return self._versions.get(user_id, 0), [
+                change
+                for change in self._changes.get(user_id, [])
+                if change.version > since
+            ]
+
+    def get_member_snapshots(self, user_id: str) -> List[MemberInfo]:
+        self._round_trip()
+        now = datetime.utcnow()
+        with self._lock:
+            snapshots = list(self._snapshots.items())
+        return [
+            member_info.model_copy(
+                update={
+                    "from_cache": True,
+                    "cache_age": (now - refreshed_at).total_seconds(),
+                }
+            )
+            for key, (refreshed_at, member_info) in snapshots
+            if key[0] == user_id
+        ]
+
+    def get_snapshot_times(self) -> Dict[Tuple[str, str], datetime]:
+        self._round_trip()
+        return {
+            key: refreshed_at
+            for key, (refreshed_at, _) in list(self._snapshots.items())
+        }
+
+    def get_all_venue_users(self) -> List[Tuple[str, str]]:
+        self._round_trip()
+        return list(self._venue_users)
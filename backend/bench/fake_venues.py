@@ -0,0 +1,223 @@
+"""
+This file contains a local HTTP server imitating the CPE and BHA member pages
+the scrapers read, so the benchmark runs without network access.
+
+CPE lives under /cpe and BHA under /bha. Any user id is accepted with the
+password 'secret'; a session cookie keeps the user logged in.
+"""
+
+import html
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from http.cookies import SimpleCookie
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+PASSWORD = "secret"
+
+_PAGE = (
+    "<!DOCTYPE html><html><head><title>{title}</title></head>"
+    "<body>{body}</body></html>"
+)
+
+
+def _dogs(user: str, count: int):
+    """
+    Yield the fake dog records of a user.
+
+    Yields
+    ------
+    Tuple[str, str, str, int, str]
+        Member id, call name, breed, jump height and birth date (MM/DD/YYYY).
+    """
+    for index in range(count):
+        yield (
+            f"{zlib.crc32(user.encode()) % 100000:05d}{index:02d}",
+            f"Dog {index}",
+            "Border Collie",
+            4 + 4 * (index % 5),
+            f"{index % 12 + 1:02d}/15/20{10 + index % 10}",
+        )
+
+
+class VenueHandler(BaseHTTPRequestHandler):
+    """
+    Serves the fake CPE and BHA pages.
+    """
+
+    # Set by serve_venues
+    latency = 0.0
+    dogs = 5
+
+    def log_message(self, format, *args):
+        pass
+
+    def _session(self) -> Optional[str]:
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        return cookie["session"].value if "session" in cookie else None
+
+    def _send(self, body: str, title: str = "Venue"):
+        data = _PAGE.format(title=title, body=body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _redirect(
+        self, location: str, session: Optional[str] = None, path: str = "/"
+    ):
+        self.send_response(302)
+        self.send_header("Location", location)
+        if session is not None:
+            self.send_header(
+                "Set-Cookie", f"session={session}; Path={path}; HttpOnly"
+            )
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _form(self) -> dict:
+        length = int(self.headers.get("Content-Length", "0"))
+        fields = parse_qs(self.rfile.read(length).decode())
+        return {key: values[0] for key, values in fields.items()}
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        path = urlsplit(self.path).path
+        user = self._session()
+        if path in ("/cpe", "/cpe/"):
+            self._send(
+                '<form method="post" action="/cpe/login">'
+                '<input name="MemberIdOrEmailInput">'
+                '<input name="PasswordInput" type="password">'
+                '<input type="submit" value="Log In"></form>',
+                "CPE Login",
+            )
+        elif path == "/cpe/Member/Records":
+            if user is None:
+                return self._redirect("/cpe")
+            self._send(self._cpe_records(user), "CPE Records")
+        elif path == "/bha/register/login.php":
+            self._send(
+                '<form method="post" action="/bha/register/login.php">'
+                '<input name="user"><input name="pass" type="password">'
+                '<input type="submit" value="Login"></form>',
+                "BHA Login",
+            )
+        elif path.startswith("/bha/register/") and user is None:
+            self._redirect("/bha/register/login.php")
+        elif path == "/bha/register/barn_hunt_dog_register.php":
+            self._send("<p>Welcome</p>", "BHA Register")
+        elif path == "/bha/register/your_profile.php":
+            self._send(self._bha_profile(user), "BHA Profile")
+        elif path == "/bha/register/your_dogs.php":
+            self._send(self._bha_dogs(user), "BHA Dogs")
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        time.sleep(self.latency)
+        path = urlsplit(self.path).path
+        form = self._form()
+        if path == "/cpe/login":
+            if form.get("PasswordInput") != PASSWORD:
+                return self._redirect("/cpe")
+            self._redirect(
+                "/cpe/Member/Records?isViewingActiveDogs=True",
+                form.get("MemberIdOrEmailInput", ""),
+                "/cpe",
+            )
+        elif path == "/bha/register/login.php":
+            if form.get("pass") != PASSWORD:
+                return self._redirect("/bha/register/login.php")
+            self._redirect(
+                "/bha/register/barn_hunt_dog_register.php",
+                form.get("user", ""),
+                "/bha",
+            )
+        else:
+            self.send_error(404)
+
+    def _cpe_records(self, user: str) -> str:
+        name = html.escape(user)
+        rows = "".join(
+            "<tr>" + "".join(f"<td>{value}</td>" for value in dog) + "</tr>"
+            for dog in _dogs(user, self.dogs)
+        )
+        return (
+            '<div id="MemberInformation">'
+            '<div class="address">'
+            f"Member ID:12345<br>Primary:{name}<br>Secondary:<br>Address:<br>"
+            "1 Main St<br>Springfield, IL 62701</div>"
+            '<div class="contact-information">'
+            "Dues Paid Through:12/31/2030<br>Phone #1:555-0100<br>"
+            f"Phone #2:555-0101<br>Email:{name}</div></div>"
+            '<table id="DogList"><tr><th>Id</th><th>Name</th><th>Breed</th>'
+            f"<th>Height</th><th>DOB</th></tr>{rows}</table>"
+        )
+
+    def _bha_profile(self, user: str) -> str:
+        values = {
+            "login_email": user,
+            "login_firstname": "Bench",
+            "login_lastname": "User",
+            "login_addr1": "1 Main St",
+            "login_addr2": "",
+            "login_city": "Springfield",
+            "login_postal": "62701",
+            "login_phone": "555-0100",
+        }
+        inputs = "".join(
+            f'<input name="{name}" value="{html.escape(value)}">'
+            for name, value in values.items()
+        )
+        return (
+            f"<form>{inputs}<select name=\"login_state\">"
+            '<option value="IL" selected>IL</option></select></form>'
+        )
+
+    def _bha_dogs(self, user: str) -> str:
+        header = "".join(
+            f"<td>{column}</td>"
+            for column in (
+                "Barnhunt No", "Call Name", "Breed", "Height", "Birthdate",
+            )
+        )
+        rows = "".join(
+            "<tr>" + "".join(f"<td>{value}</td>" for value in dog) + "</tr>"
+            for dog in _dogs(user, self.dogs)
+        )
+        return f'<table class="data"><tr>{header}</tr>{rows}</table>'
+
+
+def serve_venues(
+    port: int = 0, latency: float = 0.0, dogs: int = 5
+) -> ThreadingHTTPServer:
+    """
+    Start the fake venue sites on a background thread.
+
+    Parameters
+    ----------
+    port : int
+        Port to listen on; 0 picks a free one.
+    latency : float
+        Seconds every response is delayed, to imitate a remote site.
+    dogs : int
+        Number of dogs listed for every member.
+
+    Returns
+    -------
+    ThreadingHTTPServer
+        The running server. Its server_address holds the chosen port.
+    """
+    handler = type(
+        "BenchVenueHandler",
+        (VenueHandler,),
+        {"latency": latency, "dogs": dogs},
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,441 @@
+"""
+Offline end-to-end load benchmark.
+
+Starts local imitations of the CPE and BHA sites, runs the backend against
+them with an in-memory database in a subprocess, and drives /token,
+/get-user-venues/ and /get-user-info/ from `--concurrency` clients. Prints
+throughput, p50/p95/p99 latency per endpoint and peak RSS as JSON. The
+server's RSS is sampled over its whole process tree (uvicorn and Chromium)
+while the load runs; that needs Linux's /proc.
+
+Usage (from the backend directory):
+
+    python bench/run.py --concurrency 8 --iterations 5 > before.json
+"""
+
+import argparse
+import json
+import math
+import os
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_venues import serve_venues  # noqa: E402
+
+# (endpoint, seconds, status)
+Sample = Tuple[str, float, int]
+
+
+def free_port() -> int:
+    """
+    Return a TCP port nobody is listening on.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of a list of values.
+
+    Parameters
+    ----------
+    values : List[float]
+        The values, in any order.
+    pct : float
+        The percentile (ie; 95)
+
+    Returns
+    -------
+    float
+        The value below which pct percent of the values fall.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def peak_rss_kb(who: int) -> int:
+    """
+    Peak resident set size in KiB as reported by getrusage.
+
+    Parameters
+    ----------
+    who : int
+        resource.RUSAGE_SELF or resource.RUSAGE_CHILDREN. The latter is the
+        largest single reaped child, not a process tree's total.
+    """
+    rss = resource.getrusage(who).ru_maxrss
+    # macOS reports bytes, Linux KiB
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def process_tree(root: int) -> List[int]:
+    """
+    Return a process and all its live descendants, read from /proc.
+
+    Parameters
+    ----------
+    root : int
+        The pid at the top of the tree.
+    """
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue  # Exited while we looked
+        # The command name may contain spaces; fields resume after ')'
+        ppid = int(stat[stat.rindex(")") + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+    tree = [root]
+    for pid in tree:
+        tree.extend(children.get(pid, []))
+    return tree
+
+
+def tree_rss_kb(root: int) -> Tuple[int, int]:
+    """
+    Sum VmRSS over a process tree. Pages shared between the processes are
+    counted once per process, so this is an upper bound.
+
+    Parameters
+    ----------
+    root : int
+        The pid at the top of the tree.
+
+    Returns
+    -------
+    Tuple[int, int]
+        The RSS in KiB and the number of processes.
+    """
+    total, count = 0, 0
+    for pid in process_tree(root):
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+                        count += 1
+                        break
+        except OSError:
+            continue
+    return total, count
+
+
+class TreeRssSampler:
+    """
+    Samples the RSS of a process tree in the background and keeps the peak.
+    """
+
+    def __init__(self, root: int, interval: float = 0.25):
+        self.root = root
+        self.interval = interval
+        self.peak_kb = 0
+        self.peak_processes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss_kb, processes = tree_rss_kb(self.root)
+            if rss_kb > self.peak_kb:
+                self.peak_kb, self.peak_processes = rss_kb, processes
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if os.path.isdir("/proc"):
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+class Client:
+    """
+    A minimal blocking client of the backend API.
+    """
+
+    def __init__(self, base_url: str, timeout: float):
+        self.base_url = base_url
+        self.timeout = timeout
+
+    def request(
+        self,
+        path: str,
+        data: Optional[bytes] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Tuple[int, float, bytes]:
+        """
+        POST to the API.
+
+        Returns
+        -------
+        Tuple[int, float, bytes]
+            The status code (0 on a connection error), the elapsed seconds
+            and the response body.
+        """
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=data,
+            headers=headers or {},
+            method="POST",
+        )
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as resp:
+                body = resp.read()
+                status = resp.status
+        except urllib.error.HTTPError as e:
+            body, status = e.read(), e.code
+        except (urllib.error.URLError, OSError):
+            body, status = b"", 0
+        return status, time.perf_counter() - start, body
+
+    def flow(
+        self, user_id: str, password: str, force_refresh: bool
+    ) -> Tuple[List[Sample], Counter]:
+        """
+        Log in and load the dashboard the way the frontend does.
+
+        Returns
+        -------
+        Tuple[List[Sample], Counter]
+            One sample per request made, and the number of venues per
+            (venue, status) reported by /get-user-info/.
+        """
+        samples = []
+        venue_status = Counter()
+        status, elapsed, body = self.request(
+            "/token",
+            urllib.parse.urlencode(
+                {"username": user_id, "password": password}
+            ).encode(),
+            {"Content-Type": "application/x-www-form-urlencoded"},
+        )
+        samples.append(("/token", elapsed, status))
+        if status != 200:
+            return samples, venue_status
+        token = json.loads(body)["access_token"]
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+        }
+        for path, query in (
+            ("/get-user-venues/", {"user_id": user_id}),
+            (
+                "/get-user-info/",
+                {"user_id": user_id, "force_refresh": force_refresh},
+            ),
+        ):
+            status, elapsed, body = self.request(
+                path, json.dumps(query).encode(), headers
+            )
+            samples.append((path, elapsed, status))
+        if status == 200:
+            for item in json.loads(body)["venue_status"]:
+                venue_status[(item["venue"], item["status"])] += 1
+        return samples, venue_status
+
+
+def summarize(samples: List[Sample], wall: float) -> dict:
+    """
+    Aggregate samples into throughput and latency percentiles.
+
+    Parameters
+    ----------
+    samples : List[Sample]
+        The samples to aggregate.
+    wall : float
+        Wall time of the measured run in seconds.
+
+    Returns
+    -------
+    dict
+        Request and error counts, requests per second and latency in ms.
+    """
+    latencies = [elapsed * 1000 for _, elapsed, _ in samples]
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for _, _, status in samples if status != 200),
+        "throughput_rps": round(len(samples) / wall, 3) if wall else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies), 3)
+        if latencies
+        else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(max(latencies, default=0.0), 3),
+    }
+
+
+def wait_until_ready(
+    process: subprocess.Popen, base_url: str, timeout: float
+) -> float:
+    """
+    Wait for the backend to answer requests.
+
+    Returns
+    -------
+    float
+        Seconds the backend took to start.
+    """
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(
+                f"backend exited during startup with code {process.returncode}"
+            )
+        try:
+            with urllib.request.urlopen(base_url + "/openapi.json", timeout=1):
+                return time.perf_counter() - start
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.1)
+    raise RuntimeError(f"backend did not start within {timeout}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Offline end-to-end load benchmark of the backend."
+    )
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--iterations", type=int, default=5, help="Login flows per client."
+    )
+    parser.add_argument(
+        "--users", type=int, default=10, help="Distinct sso users."
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=0, help="Unmeasured flows per user."
+    )
+    parser.add_argument(
+        "--force-refresh",
+        action="store_true",
+        help="Scrape the venues on every /get-user-info/ request.",
+    )
+    parser.add_argument(
+        "--venue-latency",
+        type=float,
+        default=0.05,
+        help="Seconds the fake venue sites delay each response.",
+    )
+    parser.add_argument("--dogs", type=int, default=5)
+    parser.add_argument(
+        "--db-latency",
+        type=float,
+        default=0.001,
+        help="Seconds the fake database adds to each call.",
+    )
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--output", help="Also write the JSON to this file.")
+    args = parser.parse_args()
+
+    password = "bench-password"
+    venues = serve_venues(latency=args.venue_latency, dogs=args.dogs)
+    venue_url = "http://127.0.0.1:%d" % venues.server_address[1]
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(BENCH_DIR, "server.py"),
+            "--port", str(port),
+            "--venue-url", venue_url,
+            "--users", str(args.users),
+            "--password", password,
+            "--db-latency", str(args.db_latency),
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+    sampler = TreeRssSampler(server.pid)
+    sampler.start()
+    try:
+        startup = wait_until_ready(server, base_url, args.startup_timeout)
+        client = Client(base_url, args.timeout)
+        for index in range(args.users * args.warmup):
+            client.flow(f"bench-user-{index % args.users}", password, False)
+
+        samples: List[Sample] = []
+        venue_status = Counter()
+        lock = threading.Lock()
+
+        def worker(worker_index: int):
+            for iteration in range(args.iterations):
+                user = worker_index * args.iterations + iteration
+                result, statuses = client.flow(
+                    f"bench-user-{user % args.users}",
+                    password,
+                    args.force_refresh,
+                )
+                with lock:
+                    samples.extend(result)
+                    venue_status.update(statuses)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(worker, range(args.concurrency)))
+        wall = time.perf_counter() - start
+    finally:
+        sampler.stop()
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+        venues.shutdown()
+
+    endpoints = sorted({endpoint for endpoint, _, _ in samples})
+    report = {
+        "config": vars(args),
+        "startup_seconds": round(startup, 3),
+        "wall_seconds": round(wall, 3),
+        "overall": summarize(samples, wall),
+        "endpoints": {
+            endpoint: summarize(
+                [sample for sample in samples if sample[0] == endpoint], wall
+            )
+            for endpoint in endpoints
+        },
+        # Scrape failures still answer 200, so count the per-venue outcomes
+        "venue_status": {
+            f"{venue}:{status}": count
+            for (venue, status), count in sorted(venue_status.items())
+        },
+        # Sum over the server's process tree; None without /proc
+        "peak_rss_kb": {
+            "server": sampler.peak_kb or None,
+            "harness": peak_rss_kb(resource.RUSAGE_SELF),
+        },
+        "server_processes_at_peak": sampler.peak_processes or None,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
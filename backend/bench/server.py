@@ -0,0 +1,49 @@
+"""
+This file runs the backend against the fake venue sites and FakeDatabase. It
+is started as a subprocess by run.py.
+"""
+
+import argparse
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "src"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--venue-url", required=True)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--password", default="bench-password")
+    parser.add_argument("--db-latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    # Read at import time by the backend modules
+    os.environ.setdefault("JWT_SECRET_KEY", "bench-secret")
+    os.environ.setdefault("SNAPSHOT_REFRESH_ENABLED", "false")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    import db
+    from fake_db import FakeDatabase
+
+    # Must happen before endpoint is imported, as it binds db.Database
+    db.Database = FakeDatabase
+
+    import uvicorn
+    from auth import hash_password
+
+    FakeDatabase.seed(
+        {"CPE": f"{args.venue_url}/cpe", "BHA": f"{args.venue_url}/bha"},
+        args.users,
+        hash_password(args.password),
+        args.db_latency,
+    )
+    uvicorn.run(
+        "endpoint:app", host="127.0.0.1", port=args.port, log_level="warning"
+    )
+
+
+if __name__ == "__main__":
+    main()
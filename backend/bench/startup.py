@@ -0,0 +1,183 @@
+"""
+Cold start benchmark.
+
+Imports the backend in fresh interpreters and reports the import time, the
+resident set size once imported, and the slowest modules as JSON. Exits with
+status 1 when the median import time or RSS is over budget, so it can gate a
+CI job.
+
+Usage (from the backend directory):
+
+    python bench/startup.py --runs 5 --max-import-seconds 1.5 --max-rss-mb 120
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), "src")
+
+# Runs in the child: import the app and report what it cost
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import endpoint
+elapsed = time.perf_counter() - start
+rss_kb = 0
+try:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss_kb = int(line.split()[1])
+except OSError:
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss_kb //= 1024
+print(json.dumps({
+    "import_seconds": elapsed,
+    "rss_kb": rss_kb,
+    "modules": len(sys.modules),
+    "playwright": "playwright.async_api" in sys.modules,
+}))
+"""
+
+# Modules that should only be imported on first use
+DEFERRED_MODULES = ("playwright",)
+
+
+def probe(importtime: bool) -> Tuple[dict, str]:
+    """
+    Import the backend in a fresh interpreter.
+
+    Parameters
+    ----------
+    importtime : bool
+        True to run the interpreter with -X importtime.
+
+    Returns
+    -------
+    Tuple[dict, str]
+        The measurements printed by the child and its stderr.
+    """
+    env = dict(os.environ)
+    env.setdefault("JWT_SECRET_KEY", "bench-secret")
+    env.setdefault("LOG_LEVEL", "WARNING")
+    env["PYTHONPATH"] = SRC_DIR
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    result = subprocess.run(
+        command + ["-c", PROBE],
+        cwd=SRC_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_modules(importtime: str, count: int) -> List[Dict[str, object]]:
+    """
+    The imports made directly by endpoint with the largest cumulative time.
+
+    Parameters
+    ----------
+    importtime : str
+        The stderr of an interpreter run with -X importtime.
+    count : int
+        How many modules to return.
+
+    Returns
+    -------
+    List[Dict[str, object]]
+        Module name and cumulative milliseconds, slowest first.
+    """
+    modules = []
+    for line in importtime.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # The header
+        # Each level of nesting is indented by two more spaces
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth != 1:
+            continue
+        modules.append(
+            {
+                "module": name.strip(),
+                "cumulative_ms": round(int(cumulative) / 1000, 3),
+            }
+        )
+    modules.sort(key=lambda module: module["cumulative_ms"], reverse=True)
+    return modules[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Import time and RSS budget check of the backend."
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--max-import-seconds",
+        type=float,
+        default=float(os.environ.get("STARTUP_MAX_IMPORT_SECONDS", "1.5")),
+    )
+    parser.add_argument(
+        "--max-rss-mb",
+        type=float,
+        default=float(os.environ.get("STARTUP_MAX_RSS_MB", "120")),
+    )
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--output", help="Also write the JSON to this file.")
+    args = parser.parse_args()
+
+    runs = [probe(importtime=False)[0] for _ in range(args.runs)]
+    _, importtime = probe(importtime=True)
+
+    import_seconds = statistics.median(run["import_seconds"] for run in runs)
+    rss_mb = statistics.median(run["rss_kb"] for run in runs) / 1024
+    failures = []
+    if import_seconds > args.max_import_seconds:
+        failures.append(
+            f"import took {import_seconds:.3f}s, "
+            + f"budget {args.max_import_seconds}s"
+        )
+    if rss_mb > args.max_rss_mb:
+        failures.append(
+            f"RSS is {rss_mb:.1f} MB, budget {args.max_rss_mb} MB"
+        )
+    eager = [
+        name for name in DEFERRED_MODULES if any(run[name] for run in runs)
+    ]
+    if eager:
+        failures.append(f"imported at startup: {', '.join(eager)}")
+
+    report = {
+        "config": vars(args),
+        "import_seconds": round(import_seconds, 4),
+        "import_seconds_runs": [
+            round(run["import_seconds"], 4) for run in runs
+        ],
+        "rss_mb": round(rss_mb, 1),
+        "modules_loaded": runs[-1]["modules"],
+        "slowest_imports": slowest_modules(importtime, args.top),
+        "passed": not failures,
+        "failures": failures,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+This file contains the admission control of browser scrapes: a global and
+per-venue limit on scrapes running at once, and a bounded first-come queue
+with a deadline for the rest. Scrapes that cannot be admitted fail fast with
+503 and a Retry-After estimate instead of piling Chromium contexts onto the
+host.
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional, Tuple
+
+from common import parse_venue_values, worker_share
+from fastapi import HTTPException, status
+from log import get_logger
+from metrics import SCRAPE_ADMISSIONS_TOTAL, SCRAPE_QUEUE_WAIT_SECONDS
+
+logger = get_logger("admission")
+
+
+class AdmissionController:
+    """
+    Admits scrapes while both the global and the venue's limit allow, and
+    queues the rest in arrival order. A queued scrape is admitted as soon as
+    a slot it can use frees up, so a venue at its own limit does not hold up
+    the other venues.
+    """
+
+    def __init__(
+        self,
+        limit: Optional[int] = None,
+        venue_limits: Optional[Dict[str, int]] = None,
+        max_queue: Optional[int] = None,
+        deadline: Optional[float] = None,
+    ):
+        """
+        Constructor for the AdmissionController class.
+
+        Parameters
+        ----------
+        limit : Optional[int]
+            Scrapes running at once across all venues in this process, which
+            sizes its browser pool. Defaults to the SCRAPE_CONCURRENCY
+            environment variable or 8.
+        venue_limits : Optional[Dict[str, int]]
+            Scrapes running at once per venue in this process. Defaults to
+            the SCRAPE_VENUE_LIMITS environment variable (ie;
+            'CPE=4,BHA=2'), which gives the limits for the whole host and is
+            split between the WEB_CONCURRENCY workers; venues not listed are
+            only bound by the global limit.
+        max_queue : Optional[int]
+            Scrapes that may wait for a slot. Defaults to the
+            SCRAPE_QUEUE_SIZE environment variable or 32.
+        deadline : Optional[float]
+            Seconds a scrape may wait for a slot. Defaults to the
+            SCRAPE_QUEUE_TIMEOUT environment variable or 20.
+        """
+        self.limit = limit or int(os.environ.get("SCRAPE_CONCURRENCY", "8"))
+        self.venue_limits = venue_limits or {
+            venue: worker_share(int(value))
+            for venue, value in parse_venue_values(
+                os.environ.get("SCRAPE_VENUE_LIMITS", "")
+            ).items()
+        }
+        self.max_queue = max_queue or int(
+            os.environ.get("SCRAPE_QUEUE_SIZE", "32")
+        )
+        self.deadline = deadline or float(
+            os.environ.get("SCRAPE_QUEUE_TIMEOUT", "20")
+        )
+        self.active = 0
+        self.venue_active: Dict[str, int] = {}
+        self.rejected = 0
+        self.expired = 0
+        self._queue: Deque[Tuple[str, asyncio.Future]] = deque()
+        # Moving average of scrape durations, for Retry-After
+        self._scrape_seconds = 10.0
+
+    def _can_run(self, venue: str) -> bool:
+        return self.active < self.limit and self.venue_active.get(
+            venue, 0
+        ) < self.venue_limits.get(venue, self.limit)
+
+    def _acquire(self, venue: str):
+        self.active += 1
+        self.venue_active[venue] = self.venue_active.get(venue, 0) + 1
+
+    def _release(self, venue: str):
+        self.active -= 1
+        self.venue_active[venue] -= 1
+        # Hand the freed slot to the oldest waiter that can use it
+        for waiter in list(self._queue):
+            waiter_venue, future = waiter
+            if self.active >= self.limit:
+                break
+            if self._can_run(waiter_venue):
+                self._queue.remove(waiter)
+                self._acquire(waiter_venue)
+                future.set_result(None)
+
+    def retry_after(self) -> int:
+        """
+        Estimate the seconds until a new scrape could be admitted.
+
+        Returns
+        -------
+        int
+            The time to drain the queue at the current scrape rate, at
+            least 1.
+        """
+        batches = (len(self._queue) + 1) / self.limit
+        return max(1, math.ceil(batches * self._scrape_seconds))
+
+    def _refuse(self, venue: str, reason: str) -> HTTPException:
+        SCRAPE_ADMISSIONS_TOTAL.inc(venue=venue, result=reason)
+        retry_after = self.retry_after()
+        logger.warning(
+            "scrape not admitted",
+            extra={
+                "venue": venue,
+                "reason": reason,
+                "active": self.active,
+                "queued": len(self._queue),
+                "retry_after": retry_after,
+            },
+        )
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Too many {venue} requests in progress, "
+            + f"retry in {retry_after}s",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+    async def _wait(self, venue: str):
+        """
+        Wait in the queue until a slot is handed over.
+
+        Raises
+        ------
+        HTTPException
+            With status 503 if the queue is full or the deadline passes.
+        """
+        if len(self._queue) >= self.max_queue:
+            self.rejected += 1
+            raise self._refuse(venue, "rejected")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((venue, future))
+        try:
+            await asyncio.wait({future}, timeout=self.deadline)
+        except asyncio.CancelledError:
+            if future.done():
+                self._release(venue)  # Admitted as the caller went away
+            else:
+                self._queue.remove((venue, future))
+                future.cancel()
+            raise
+        if not future.done():
+            self._queue.remove((venue, future))
+            future.cancel()
+            self.expired += 1
+            raise self._refuse(venue, "expired")
+
+    @asynccontextmanager
+    async def slot(self, venue: str) -> AsyncIterator[float]:
+        """
+        Hold one of the scrape slots for a venue.
+
+        Parameters
+        ----------
+        venue : str
+            The venue to scrape (ie; 'CPE')
+
+        Yields
+        ------
+        float
+            Seconds spent waiting for the slot.
+
+        Raises
+        ------
+        HTTPException
+            With status 503 and a Retry-After header if the scrape could not
+            be admitted.
+        """
+        start = time.perf_counter()
+        outcome = "cancelled"
+        try:
+            if self._can_run(venue):
+                self._acquire(venue)
+            else:
+                await self._wait(venue)
+            outcome = "ok"
+        except HTTPException:
+            outcome = "refused"
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            SCRAPE_QUEUE_WAIT_SECONDS.observe(
+                waited, venue=venue, outcome=outcome
+            )
+        SCRAPE_ADMISSIONS_TOTAL.inc(venue=venue, result="admitted")
+
+        admitted = time.perf_counter()
+        try:
+            yield waited
+        finally:
+            self._scrape_seconds += 0.2 * (
+                time.perf_counter() - admitted - self._scrape_seconds
+            )
+            self._release(venue)
+
+    def stats(self) -> dict:
+        """
+        Return basic information about admission.
+
+        Returns
+        -------
+        dict
+            Limits, scrapes running and queued, and scrapes refused.
+        """
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": len(self._queue),
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "expired": self.expired,
+        }
+
+
+SCRAPE_ADMISSION = AdmissionController()
@@ -0,0 +1,373 @@
+"""
+This file contains authentication support for the endpoints: password hashing
+on a bounded process pool so pbkdf2 never blocks the event loop, and issuing
+and verifying JWT access tokens.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from common import get_secret
+from fastapi import Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer
+from jose import JWTError, jwt
+from log import get_logger
+from passlib.context import CryptContext
+
+logger = get_logger("auth")
+
+pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+
+# For demonstration, replace with a secure secret key
+SECRET_KEY = get_secret("JWT_SECRET_KEY")
+ALGORITHM = "HS256"
+
+# Lifetime of the access tokens issued by /token
+ACCESS_TOKEN_EXPIRE_MINUTES = float(
+    os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
+)
+
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_password(plain_password, hashed_password):
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class PasswordHasher:
+    """
+    Runs password hashing and verification on a dedicated process pool.
+
+    At most `workers` operations run at once; up to `max_queue` more wait
+    for a worker. Further requests are turned away with a 503 so a login
+    storm degrades into quick rejections instead of an unresponsive API.
+    """
+
+    def __init__(
+        self, workers: Optional[int] = None, max_queue: Optional[int] = None
+    ):
+        """
+        Constructor for the PasswordHasher class.
+
+        Parameters
+        ----------
+        workers : Optional[int]
+            Number of hashing processes. Defaults to the PASSWORD_HASH_WORKERS
+            environment variable or the number of CPUs.
+        max_queue : Optional[int]
+            Number of operations allowed to wait for a worker. Defaults to the
+            PASSWORD_HASH_MAX_QUEUE environment variable or 64.
+        """
+        self.workers = workers or int(
+            os.environ.get("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2))
+        )
+        self.max_queue = max_queue or int(
+            os.environ.get("PASSWORD_HASH_MAX_QUEUE", "64")
+        )
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._stats = {
+            "queued": 0,
+            "running": 0,
+            "completed": 0,
+            "rejected": 0,
+            "broken": 0,
+        }
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """
+        Return the process pool, creating it on first use and after a worker
+        died.
+
+        Returns
+        -------
+        ProcessPoolExecutor
+            The hashing process pool.
+        """
+        if self._executor is None:
+            # Spawn rather than fork; the server process runs threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def _unavailable(self, detail: str) -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=detail,
+            headers={"Retry-After": "1"},
+        )
+
+    async def _run(self, fn, *args):
+        """
+        Run fn(*args) on the process pool, subject to the queue limit.
+
+        Returns
+        -------
+        Any
+            Whatever fn returns.
+
+        Raises
+        ------
+        HTTPException
+            With status 503 if the wait queue is full or a hashing process
+            died while running fn.
+        """
+        # One semaphore for the hasher's lifetime, so replacing a broken
+        # pool never raises the cap on concurrent operations
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        if self._stats["queued"] >= self.max_queue:
+            self._stats["rejected"] += 1
+            raise self._unavailable(
+                "Too many authentication requests, try again shortly"
+            )
+        self._stats["queued"] += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._stats["queued"] -= 1
+        self._stats["running"] += 1
+        executor = None
+        try:
+            executor = self._get_executor()
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, fn, *args)
+        except BrokenProcessPool as e:
+            # A worker died; the next request starts a fresh pool. Requests
+            # that shared the broken one must not discard its replacement.
+            self._stats["broken"] += 1
+            if executor is not None and self._executor is executor:
+                logger.error(
+                    "password hashing pool broke", extra={"error": str(e)}
+                )
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            raise self._unavailable(
+                "Authentication is temporarily unavailable, try again shortly"
+            )
+        finally:
+            self._stats["running"] -= 1
+            self._stats["completed"] += 1
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        """
+        Hash a password.
+
+        Parameters
+        ----------
+        password : str
+            The plain text password.
+
+        Returns
+        -------
+        str
+            The password hash.
+        """
+        return await self._run(hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """
+        Check a password against its hash.
+
+        Parameters
+        ----------
+        plain_password : str
+            The plain text password.
+        hashed_password : str
+            The stored password hash.
+
+        Returns
+        -------
+        bool
+            True if the password matches, False otherwise.
+        """
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return the hashing queue counters.
+
+        Returns
+        -------
+        Dict[str, int]
+            Operations waiting for a worker (queue depth), running, completed,
+            rejected and failed on a broken pool.
+        """
+        return dict(self._stats, workers=self.workers)
+
+    def shutdown(self):
+        """
+        Stop the hashing processes.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+PASSWORD_HASHER = PasswordHasher()
+
+
+class TokenCache:
+    """
+    A bounded LRU of access tokens that have already been verified, mapping
+    each token to its subject until the token expires.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None):
+        """
+        Constructor for the TokenCache class.
+
+        Parameters
+        ----------
+        max_entries : Optional[int]
+            Number of tokens kept before the least recently used one is
+            dropped. Defaults to the TOKEN_CACHE_MAX_ENTRIES environment
+            variable or 10000.
+        """
+        self.max_entries = max_entries or int(
+            os.environ.get("TOKEN_CACHE_MAX_ENTRIES", "10000")
+        )
+        # token -> (sub, exp)
+        self._tokens: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[str]:
+        """
+        Return the subject of a previously verified, unexpired token.
+
+        Parameters
+        ----------
+        token : str
+            The encoded access token.
+
+        Returns
+        -------
+        Optional[str]
+            The token's subject, or None if the token is not cached.
+        """
+        with self._lock:
+            entry = self._tokens.get(token)
+            if entry is None:
+                return None
+            sub, exp = entry
+            if exp <= time.time():
+                del self._tokens[token]
+                return None
+            self._tokens.move_to_end(token)
+            return sub
+
+    def put(self, token: str, sub: str, exp: float):
+        """
+        Remember a verified token until it expires.
+
+        Parameters
+        ----------
+        token : str
+            The encoded access token.
+        sub : str
+            The token's subject.
+        exp : float
+            Epoch seconds at which the token expires.
+        """
+        with self._lock:
+            self._tokens[token] = (sub, exp)
+            self._tokens.move_to_end(token)
+            while len(self._tokens) > self.max_entries:
+                self._tokens.popitem(last=False)
+
+
+TOKEN_CACHE = TokenCache()
+
+
+def create_access_token(data: dict) -> str:
+    """
+    Issue an access token that expires after ACCESS_TOKEN_EXPIRE_MINUTES.
+
+    Parameters
+    ----------
+    data : dict
+        The claims to encode (ie; {"sub": username})
+
+    Returns
+    -------
+    str
+        The encoded JWT.
+    """
+    to_encode = data.copy()
+    expire = datetime.now(timezone.utc) + timedelta(
+        minutes=ACCESS_TOKEN_EXPIRE_MINUTES
+    )
+    to_encode["exp"] = expire
+    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return encoded_jwt
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> str:
+    """
+    FastAPI dependency that authenticates the bearer token of a request.
+
+    Parameters
+    ----------
+    token : str
+        The bearer token.
+
+    Returns
+    -------
+    str
+        The sso user id the token was issued to.
+
+    Raises
+    ------
+    HTTPException
+        With status 401 if the token is invalid, expired or has no subject.
+    """
+    sub = TOKEN_CACHE.get(token)
+    if sub is not None:
+        return sub
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    sub = payload.get("sub")
+    exp = payload.get("exp")
+    if sub is None or exp is None:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    TOKEN_CACHE.put(token, sub, exp)
+    return sub
+
+
+def check_user(current_user: str, user_id: str):
+    """
+    Make sure an authenticated user only acts on their own data.
+
+    Parameters
+    ----------
+    current_user : str
+        The sso user id from the access token.
+    user_id : str
+        The sso user id named in the request.
+
+    Raises
+    ------
+    HTTPException
+        With status 403 if the two differ.
+    """
+    if current_user != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Not allowed to access user={user_id}",
+        )
@@ -0,0 +1,254 @@
+"""
+This file contains a process wide pool of warm Chromium browsers used by the
+venue scrapers.
+"""
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, AsyncIterator, List, Optional
+
+from log import get_logger
+
+# Playwright is imported when the pool starts so the API starts without it
+if TYPE_CHECKING:
+    from playwright.async_api import Browser, BrowserContext, Playwright
+
+logger = get_logger("browser_pool")
+
+
+class BrowserPool:
+    """
+    A fixed size pool of warm Chromium browsers.
+
+    Each call to context() is handed a fresh, isolated BrowserContext from one
+    of the pooled browsers, so a scrape only pays for a new context instead of
+    a whole browser process. A single browser serves several contexts at once.
+    """
+
+    def __init__(
+        self,
+        size: Optional[int] = None,
+        contexts_per_browser: Optional[int] = None,
+        health_check_interval: Optional[float] = None,
+    ):
+        """
+        Constructor for the BrowserPool class.
+
+        Parameters
+        ----------
+        size : Optional[int]
+            Number of browsers to keep warm. Defaults to the BROWSER_POOL_SIZE
+            environment variable or 2.
+        contexts_per_browser : Optional[int]
+            Number of scrapes a single browser may run at once. Defaults to the
+            BROWSER_CONTEXTS_PER_BROWSER environment variable or 8.
+        health_check_interval : Optional[float]
+            Seconds between browser health checks. Defaults to the
+            BROWSER_HEALTH_CHECK_INTERVAL environment variable or 30.
+        """
+        self.size = size or int(os.environ.get("BROWSER_POOL_SIZE", "2"))
+        self.contexts_per_browser = contexts_per_browser or int(
+            os.environ.get("BROWSER_CONTEXTS_PER_BROWSER", "8")
+        )
+        self.health_check_interval = health_check_interval or float(
+            os.environ.get("BROWSER_HEALTH_CHECK_INTERVAL", "30")
+        )
+        self.restarts = 0
+        self._playwright: Optional["Playwright"] = None
+        self._browsers: List[Optional["Browser"]] = []
+        self._active: List[int] = []
+        # One lock per browser, so relaunching a crashed browser only holds
+        # up the scrapes waiting for that browser
+        self._locks: List[asyncio.Lock] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._health_task: Optional[asyncio.Task] = None
+        self._started: Optional[asyncio.Future] = None
+
+    async def _launch(self, index: int):
+        """
+        Launch (or relaunch) the browser at the given position in the pool.
+
+        Parameters
+        ----------
+        index : int
+            Position of the browser in the pool.
+        """
+        assert self._playwright is not None, "the pool has not started"
+        browser = self._browsers[index]
+        if browser is not None:
+            try:
+                await browser.close()
+            except Exception:
+                pass  # The browser is already gone; nothing to clean up
+        self._browsers[index] = await self._playwright.chromium.launch(
+            headless=True
+        )
+
+    async def _ensure_browser(self, index: int) -> "Browser":
+        """
+        Return the browser at the given position, restarting it if it has
+        crashed or been disconnected.
+
+        Parameters
+        ----------
+        index : int
+            Position of the browser in the pool.
+
+        Returns
+        -------
+        Browser
+            A connected browser.
+        """
+        browser = self._browsers[index]
+        if browser is not None and browser.is_connected():
+            return browser
+        async with self._locks[index]:
+            # Another scrape may have relaunched it while this one waited
+            browser = self._browsers[index]
+            if browser is None or not browser.is_connected():
+                logger.warning("restarting browser", extra={"index": index})
+                self.restarts += 1
+                await self._launch(index)
+                browser = self._browsers[index]
+            assert browser is not None
+            return browser
+
+    async def _health_check(self):
+        """
+        Periodically restart any browser that is no longer connected.
+        """
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            for index in range(self.size):
+                try:
+                    await self._ensure_browser(index)
+                except Exception as e:
+                    logger.error(
+                        "browser health check failed",
+                        extra={"index": index, "error": str(e)},
+                    )
+
+    async def start(self):
+        """
+        Launch the pooled browsers and the health check task. Concurrent
+        callers all wait on the same startup.
+        """
+        self.warm()
+        await self._started
+
+    def warm(self):
+        """
+        Start the pool in the background, so the browsers launch while the
+        API already serves requests. Scrapes wait for the startup in
+        context().
+        """
+        if self._started is None:
+            self._started = asyncio.ensure_future(self._start())
+            self._started.add_done_callback(self._log_start_failure)
+
+    def _log_start_failure(self, started: asyncio.Future):
+        if not started.cancelled() and started.exception() is not None:
+            logger.error(
+                "could not start the browser pool",
+                extra={"error": str(started.exception())},
+            )
+            # Let the next scrape try again
+            self._started = None
+
+    async def _start(self):
+        """
+        Launch the pooled browsers and the health check task.
+        """
+        self._locks = [asyncio.Lock() for _ in range(self.size)]
+        self._slots = asyncio.Semaphore(self.size * self.contexts_per_browser)
+        from playwright.async_api import async_playwright
+
+        self._playwright = await async_playwright().start()
+        self._browsers = [None] * self.size
+        self._active = [0] * self.size
+        for index in range(self.size):
+            try:
+                await self._launch(index)
+            except Exception as e:
+                # The health check or the next scrape will retry the launch
+                logger.error(
+                    "could not launch browser",
+                    extra={"index": index, "error": str(e)},
+                )
+        self._health_task = asyncio.create_task(self._health_check())
+
+    async def stop(self):
+        """
+        Stop the health check task and close every pooled browser.
+        """
+        if self._started is None:
+            return
+        try:
+            await self._started
+        except Exception:
+            self._started = None
+            return  # Nothing was started
+        if self._health_task is not None:
+            self._health_task.cancel()
+        for browser in self._browsers:
+            if browser is not None:
+                try:
+                    await browser.close()
+                except Exception:
+                    pass  # Shutting down; the browser may already be gone
+        if self._playwright is not None:
+            await self._playwright.stop()
+        self._playwright = None
+        self._browsers = []
+        self._started = None
+
+    @asynccontextmanager
+    async def context(self, **kwargs) -> AsyncIterator["BrowserContext"]:
+        """
+        Borrow a fresh BrowserContext from the least busy pooled browser. The
+        context is closed when the block exits.
+
+        Parameters
+        ----------
+        **kwargs
+            Passed through to Browser.new_context (ie; storage_state).
+
+        Yields
+        ------
+        BrowserContext
+            An isolated browser context.
+        """
+        await self.start()
+        assert self._slots is not None
+        async with self._slots:
+            index = self._active.index(min(self._active))
+            self._active[index] += 1
+            try:
+                browser = await self._ensure_browser(index)
+                context = await browser.new_context(**kwargs)
+                try:
+                    yield context
+                finally:
+                    await context.close()
+            finally:
+                self._active[index] -= 1
+
+    def stats(self) -> dict:
+        """
+        Return basic information about the pool.
+
+        Returns
+        -------
+        dict
+            Pool size, scrapes in flight per browser and browser restarts.
+        """
+        return {
+            "size": self.size,
+            "contexts_per_browser": self.contexts_per_browser,
+            "active": list(self._active),
+            "restarts": self.restarts,
+        }
+
+
+BROWSER_POOL = BrowserPool()
@@ -0,0 +1,352 @@
+"""
+This file contains in-process caches of scraped venue member information and
+of the venues reference table.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from conditional import member_info_digest
+from db import Database
+from log import get_logger
+from metrics import CACHE_LOOKUPS_TOTAL, SCRAPE_FLIGHTS_TOTAL
+from model import MemberInfo, VenuesTable
+
+CacheKey = Tuple[str, str]
+
+logger = get_logger("cache")
+
+
+class _Flight:
+    """
+    A scrape in flight and the number of callers waiting on it.
+    """
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent scrapes of the same (user_id, venue): while one is
+    in flight, later callers wait on its result instead of starting another.
+    The scrape is cancelled only when every caller waiting on it is.
+    """
+
+    def __init__(self):
+        self._flights: Dict[CacheKey, _Flight] = {}
+
+    def _forget(self, key: CacheKey, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def do(
+        self, key: CacheKey, fetch: Callable[[], Awaitable[MemberInfo]]
+    ) -> MemberInfo:
+        """
+        Run fetch for a key, or join the run already in flight for it.
+
+        Parameters
+        ----------
+        key : CacheKey
+            The (user_id, venue) pair.
+        fetch : Callable[[], Awaitable[MemberInfo]]
+            Scrapes the venue.
+
+        Returns
+        -------
+        MemberInfo
+            The result of the shared scrape.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(fetch()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            SCRAPE_FLIGHTS_TOTAL.inc(venue=key[1], result="executed")
+        else:
+            SCRAPE_FLIGHTS_TOTAL.inc(venue=key[1], result="coalesced")
+
+        flight.waiters += 1
+        try:
+            # Shielded so one caller timing out does not fail the others
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+
+class MemberInfoCache:
+    """
+    A bounded LRU cache of MemberInfo keyed by (user_id, venue).
+
+    Entries younger than the TTL are served as is. Entries past the TTL but
+    within the stale window are served immediately while a background scrape
+    refreshes them. Older entries are scraped in the request path. Concurrent
+    scrapes of the same key are coalesced into one.
+    """
+
+    def __init__(
+        self,
+        ttl: Optional[float] = None,
+        stale_ttl: Optional[float] = None,
+        max_entries: Optional[int] = None,
+    ):
+        """
+        Constructor for the MemberInfoCache class.
+
+        Parameters
+        ----------
+        ttl : Optional[float]
+            Seconds an entry is fresh. Defaults to the MEMBER_INFO_CACHE_TTL
+            environment variable or 3600.
+        stale_ttl : Optional[float]
+            Seconds past the TTL a stale entry may still be served while it is
+            refreshed. Defaults to the MEMBER_INFO_CACHE_STALE_TTL environment
+            variable or 86400.
+        max_entries : Optional[int]
+            Number of entries kept before the least recently used one is
+            evicted. Defaults to the MEMBER_INFO_CACHE_MAX_ENTRIES environment
+            variable or 1000.
+        """
+        self.ttl = ttl or float(os.environ.get("MEMBER_INFO_CACHE_TTL", "3600"))
+        self.stale_ttl = stale_ttl or float(
+            os.environ.get("MEMBER_INFO_CACHE_STALE_TTL", "86400")
+        )
+        self.max_entries = max_entries or int(
+            os.environ.get("MEMBER_INFO_CACHE_MAX_ENTRIES", "1000")
+        )
+        # (user_id, venue) -> (stored_at, member_info)
+        self._entries: OrderedDict = OrderedDict()
+        # Bumped on invalidation so in-flight refreshes do not store old data
+        self._generations: Dict[CacheKey, int] = {}
+        self._refreshing: Set[CacheKey] = set()
+        # Background refreshes still running; the event loop only keeps weak
+        # references to tasks
+        self._refresh_tasks: Set["asyncio.Task[None]"] = set()
+        self._flights = SingleFlight()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key: CacheKey) -> Optional[Tuple[float, MemberInfo]]:
+        """
+        Return the entry for a key, marking it as recently used.
+
+        Parameters
+        ----------
+        key : CacheKey
+            The (user_id, venue) pair.
+
+        Returns
+        -------
+        Optional[Tuple[float, MemberInfo]]
+            The time the entry was stored and its value, or None if there is
+            no entry.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _store(self, key: CacheKey, member_info: MemberInfo, generation: int):
+        """
+        Store an entry unless the key was invalidated since the scrape began.
+
+        Parameters
+        ----------
+        key : CacheKey
+            The (user_id, venue) pair.
+        member_info : MemberInfo
+            The freshly scraped value.
+        generation : int
+            The key's generation when the scrape began.
+        """
+        with self._lock:
+            if self._generations.get(key, 0) != generation:
+                return
+            # Digest once here, so cache hits need no serialization for ETags
+            member_info_digest(member_info)
+            self._entries[key] = (time.time(), member_info)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def _refresh(
+        self,
+        key: CacheKey,
+        fetch: Callable[[], Awaitable[MemberInfo]],
+        generation: int,
+    ):
+        """
+        Re-scrape a stale entry in the background.
+
+        Parameters
+        ----------
+        key : CacheKey
+            The (user_id, venue) pair.
+        fetch : Callable[[], Awaitable[MemberInfo]]
+            Scrapes the venue.
+        generation : int
+            The key's generation when the refresh was scheduled.
+        """
+        try:
+            self._store(key, await self._flights.do(key, fetch), generation)
+        except Exception as e:
+            logger.error(
+                "background refresh failed",
+                extra={"user_id": key[0], "venue": key[1], "error": str(e)},
+            )
+        finally:
+            self._refreshing.discard(key)
+
+    async def get(
+        self, user_id: str, venue: str, fetch: Callable[[], Awaitable[MemberInfo]]
+    ) -> MemberInfo:
+        """
+        Return the member information for a user and venue, scraping it with
+        fetch when there is no usable cached copy.
+
+        Parameters
+        ----------
+        user_id : str
+            The sso user id.
+        venue : str
+            The venue (ie; 'CPE')
+        fetch : Callable[[], Awaitable[MemberInfo]]
+            Scrapes the venue.
+
+        Returns
+        -------
+        MemberInfo
+            The member information, with from_cache and cache_age describing
+            where it came from.
+        """
+        key = (user_id, venue)
+        generation = self._generations.get(key, 0)
+        entry = self._lookup(key)
+        if entry is not None:
+            stored_at, member_info = entry
+            age = time.time() - stored_at
+            if age < self.ttl + self.stale_ttl:
+                stale = age >= self.ttl
+                CACHE_LOOKUPS_TOTAL.inc(
+                    venue=venue, result="stale" if stale else "hit"
+                )
+                if stale and key not in self._refreshing:
+                    self._refreshing.add(key)
+                    task = asyncio.create_task(
+                        self._refresh(key, fetch, generation)
+                    )
+                    self._refresh_tasks.add(task)
+                    task.add_done_callback(self._refresh_tasks.discard)
+                return member_info.model_copy(
+                    update={"from_cache": True, "cache_age": age}
+                )
+
+        CACHE_LOOKUPS_TOTAL.inc(venue=venue, result="miss")
+        member_info = await self._flights.do(key, fetch)
+        self._store(key, member_info, generation)
+        return member_info
+
+    def invalidate(self, user_id: str, venue: str):
+        """
+        Drop the entry for a user and venue.
+
+        Parameters
+        ----------
+        user_id : str
+            The sso user id.
+        venue : str
+            The venue (ie; 'CPE')
+        """
+        key = (user_id, venue)
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self._entries.pop(key, None)
+
+
+MEMBER_INFO_CACHE = MemberInfoCache()
+
+
+class VenueCache:
+    """
+    A read-through cache of the venues reference table.
+
+    The whole table is loaded at once and kept for the TTL, so looking up a
+    venue is a dictionary hit rather than a database round trip. The API
+    never writes the venues table; rows changed in the database are picked
+    up when the TTL runs out.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[], List[VenuesTable]],
+        ttl: Optional[float] = None,
+    ):
+        """
+        Constructor for the VenueCache class.
+
+        Parameters
+        ----------
+        load : Callable[[], List[VenuesTable]]
+            Reads every row of the venues table.
+        ttl : Optional[float]
+            Seconds the table is kept before it is read again. Defaults to the
+            VENUE_CACHE_TTL environment variable or 3600.
+        """
+        self._load = load
+        self.ttl = ttl or float(os.environ.get("VENUE_CACHE_TTL", "3600"))
+        self._venues: Optional[Dict[str, VenuesTable]] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, VenuesTable]:
+        """
+        Read the venues table into the cache.
+
+        Returns
+        -------
+        Dict[str, VenuesTable]
+            The venues keyed by name.
+        """
+        venues = {row.venue: row for row in self._load()}
+        with self._lock:
+            self._venues = venues
+            self._loaded_at = time.monotonic()
+        return venues
+
+    def get(self, venue: Optional[str] = None) -> List[VenuesTable]:
+        """
+        Return information for a given venue, or for every venue. Mirrors
+        Database.get_venue_info.
+
+        Parameters
+        ----------
+        venue : Optional[str]
+            The venue to look up (ie; 'CPE'), or None for all venues.
+
+        Returns
+        -------
+        List[VenuesTable]
+            The matching rows from the venues table.
+        """
+        with self._lock:
+            venues = self._venues
+            if time.monotonic() - self._loaded_at >= self.ttl:
+                venues = None
+        if venues is None:
+            venues = self.load()
+        if venue is None:
+            return list(venues.values())
+        return [venues[venue]] if venue in venues else []
+
+
+VENUE_CACHE = VenueCache(lambda: Database().get_venue_info())
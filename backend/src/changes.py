@@ -0,0 +1,111 @@
+"""
+This file contains the structural diff of a user's member information for a
+venue between two scrapes: handler fields that changed, dogs added or
+removed, and dog fields that changed. The changes are what the database
+records in place of a full snapshot, and what /get-user-info-changes/
+returns to clients.
+"""
+
+from typing import Dict, List, Optional
+
+from model import DogInfo, MemberChange, MemberInfo
+
+# Fields of the handler and of each dog that are compared between scrapes
+MEMBER_FIELDS = ("handler_member_id", "handler", "address", "phone", "email")
+DOG_FIELDS = ("call_name", "breed", "jump_height", "dob")
+
+
+def _value(value) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+def diff_member_info(
+    old: Optional[MemberInfo], new: MemberInfo
+) -> List[MemberChange]:
+    """
+    Compare two scrapes of a user's member information for a venue.
+
+    Parameters
+    ----------
+    old : Optional[MemberInfo]
+        The previous scrape, or None if the venue was never scraped for the
+        user. Every field of new is then reported as added.
+    new : MemberInfo
+        The fresh scrape.
+
+    Returns
+    -------
+    List[MemberChange]
+        One change per handler field that changed, then one per dog added,
+        removed or with a changed field, in dog_member_id order; empty if
+        nothing changed. Versions are assigned when the changes are saved.
+    """
+    venue = new.venue
+    changes = []
+    for field in MEMBER_FIELDS:
+        old_value = None if old is None else _value(getattr(old, field))
+        new_value = _value(getattr(new, field))
+        if old is None or old_value != new_value:
+            changes.append(
+                MemberChange(
+                    venue=venue,
+                    change="added" if old is None else "changed",
+                    field=field,
+                    old=old_value,
+                    new=new_value,
+                )
+            )
+
+    old_dogs: Dict[str, DogInfo] = (
+        {} if old is None else {d.dog_member_id: d for d in old.dog_info}
+    )
+    new_dogs = {dog.dog_member_id: dog for dog in new.dog_info}
+    for dog_member_id in sorted(old_dogs.keys() | new_dogs.keys()):
+        old_dog = old_dogs.get(dog_member_id)
+        new_dog = new_dogs.get(dog_member_id)
+        if old_dog is None or new_dog is None:
+            # Whole dogs are carried as JSON
+            changes.append(
+                MemberChange(
+                    venue=venue,
+                    change="added" if old_dog is None else "removed",
+                    dog_member_id=dog_member_id,
+                    old=None if old_dog is None else old_dog.model_dump_json(),
+                    new=None if new_dog is None else new_dog.model_dump_json(),
+                )
+            )
+            continue
+        for field in DOG_FIELDS:
+            old_value = _value(getattr(old_dog, field))
+            new_value = _value(getattr(new_dog, field))
+            if old_value != new_value:
+                changes.append(
+                    MemberChange(
+                        venue=venue,
+                        change="changed",
+                        dog_member_id=dog_member_id,
+                        field=field,
+                        old=old_value,
+                        new=new_value,
+                    )
+                )
+    return changes
+
+
+def changed_dogs(changes: List[MemberChange]) -> List[str]:
+    """
+    Return the dogs whose stored rows a set of changes touches.
+
+    Parameters
+    ----------
+    changes : List[MemberChange]
+        Changes from diff_member_info.
+
+    Returns
+    -------
+    List[str]
+        The dog_member_id of every dog added, removed or changed.
+    """
+    return sorted(
+        {change.dog_member_id for change in changes if change.dog_member_id}
+    )
@@ -1,5 +1,5 @@
 import os
-from typing import Union
+from typing import Dict, Union
 
 
 def get_secret(key: str) -> Union[str, None]:
@@ -23,3 +23,57 @@ def get_secret(key: str) -> Union[str, None]:
             return f.read().strip()
     # Fall back to environment variable
     return os.environ.get(key)
+
+
+def parse_venue_values(value: str) -> Dict[str, float]:
+    """
+    Parse a setting that gives a number per venue.
+
+    Parameters
+    ----------
+    value : str
+        Comma separated venue=number pairs (ie; 'CPE=21600,BHA=43200')
+
+    Returns
+    -------
+    Dict[str, float]
+        The numbers keyed by venue.
+    """
+    values = {}
+    for item in value.split(","):
+        if "=" in item:
+            venue, number = item.split("=", 1)
+            values[venue.strip()] = float(number)
+    return values
+
+
+def worker_count() -> int:
+    """
+    Return how many server processes share the host's limits.
+
+    Returns
+    -------
+    int
+        The WEB_CONCURRENCY environment variable, which serve.py sets before
+        forking its workers, or 1.
+    """
+    return max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+
+
+def worker_share(total: int) -> int:
+    """
+    Split a limit that applies to the whole host between the server
+    processes. Every process gets at least 1, so with more workers than the
+    limit allows the host total is the number of workers.
+
+    Parameters
+    ----------
+    total : int
+        The limit for the host.
+
+    Returns
+    -------
+    int
+        The limit for one process.
+    """
+    return max(1, total // worker_count())
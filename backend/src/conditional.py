@@ -0,0 +1,134 @@
+"""
+This file contains the conditional response helpers of the API: weak ETags
+derived from the content of member and venue payloads, 304 Not Modified for
+a matching If-None-Match, JSON encoding with pydantic's compiled serializer,
+and gzip for everything but streamed responses.
+"""
+
+import hashlib
+from typing import Callable, Iterable, Sequence
+
+from fastapi import Request
+from fastapi.responses import Response
+from metrics import CONDITIONAL_RESPONSES_TOTAL
+from model import MemberInfo
+from starlette.middleware.gzip import GZipMiddleware as _GZipMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Fields that change between two copies of the same data
+_VOLATILE_FIELDS = {"from_cache", "cache_age"}
+
+
+def member_info_digest(member_info: MemberInfo) -> str:
+    """
+    Return a digest of a venue's member information, ignoring where it was
+    served from. Computed once per object and kept on it, so copies handed
+    out by the member info cache are never serialized again for it.
+
+    Parameters
+    ----------
+    member_info : MemberInfo
+        The member information.
+
+    Returns
+    -------
+    str
+        A hex digest of the content.
+    """
+    if member_info._digest is None:
+        member_info._digest = hashlib.sha256(
+            member_info.model_dump_json(exclude=_VOLATILE_FIELDS).encode()
+        ).hexdigest()
+    return member_info._digest
+
+
+def make_etag(parts: Iterable[str]) -> str:
+    """
+    Combine content digests into a weak ETag; weak because the body also
+    carries timings that may differ between equivalent responses.
+
+    Parameters
+    ----------
+    parts : Iterable[str]
+        The digests or stable values the response is made of.
+
+    Returns
+    -------
+    str
+        The ETag header value (ie; 'W/"3f2a..."')
+    """
+    digest = hashlib.sha256("\n".join(parts).encode()).hexdigest()
+    return f'W/"{digest[:32]}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    Check a request's If-None-Match header against an ETag, using the weak
+    comparison RFC 9110 prescribes for it.
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(
+        candidate.strip().removeprefix("W/") == opaque
+        for candidate in header.split(",")
+    )
+
+
+def conditional_response(
+    request: Request, endpoint: str, etag: str, render: Callable[[], bytes]
+) -> Response:
+    """
+    Answer 304 Not Modified if the client already has the content, else the
+    rendered JSON body. Either way the ETag is sent.
+
+    Parameters
+    ----------
+    request : Request
+        The incoming request.
+    endpoint : str
+        The endpoint name for the metrics (ie; 'get-user-info')
+    etag : str
+        The ETag of the content.
+    render : Callable[[], bytes]
+        Encodes the body; only called if it is sent.
+
+    Returns
+    -------
+    Response
+        The 304 or 200 response.
+    """
+    # The client must revalidate every time, as venue data changes silently
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request, etag):
+        CONDITIONAL_RESPONSES_TOTAL.inc(endpoint=endpoint, result="not_modified")
+        return Response(status_code=304, headers=headers)
+    CONDITIONAL_RESPONSES_TOTAL.inc(endpoint=endpoint, result="modified")
+    return Response(
+        content=render(), media_type="application/json", headers=headers
+    )
+
+
+class GZipMiddleware(_GZipMiddleware):
+    """
+    Starlette's GZipMiddleware, skipping streamed endpoints: their events
+    would sit in the compressor's buffer instead of reaching the client.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1000,
+        excluded_paths: Sequence[str] = (),
+    ):
+        super().__init__(app, minimum_size=minimum_size)
+        self.excluded_paths = frozenset(excluded_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and scope["path"] in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
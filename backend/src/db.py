@@ -3,55 +3,255 @@ This file contains an implementation of a singleton class for database access.
 """
 
 import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import pymysql
+from changes import MEMBER_FIELDS, changed_dogs, diff_member_info
 from common import get_secret
-from model import UserInDB, VenuesTable, VenueUsersTable
-from typing import List
-
-
-class Database:
+from log import get_logger
+from metrics import DB_QUERY_SECONDS, MEMBER_CHANGES_TOTAL
+from model import (
+    DogInfo,
+    MemberChange,
+    MemberInfo,
+    UserInDB,
+    UserVenue,
+    VenuesTable,
+    VenueUsersTable,
+)
+
+logger = get_logger("db")
+
+
+class ConnectionPool:
     """
-    Singleton class for database access.
+    A thread-safe, bounded pool of MySQL connections.
+
+    Connections are borrowed with connection() and returned when the block
+    exits. Each checkout pings the connection and replaces it if it has gone
+    away or has been idle for longer than the recycle time.
     """
 
-    _instance = None
+    def __init__(
+        self,
+        size: Optional[int] = None,
+        recycle: Optional[float] = None,
+        timeout: Optional[float] = None,
+    ):
+        """
+        Constructor for the ConnectionPool class.
 
-    # def __new__(cls, *args, **kwargs):
-    #     """
-    #     This method is executed when a new instance is instantiated.
-    #     """
-    #     if cls._instance is None:
-    #         cls._instance = super().__new__(cls)
-    #     return cls._instance
+        Parameters
+        ----------
+        size : Optional[int]
+            Maximum number of open connections. Defaults to the DB_POOL_SIZE
+            environment variable or 10.
+        recycle : Optional[float]
+            Seconds a connection may sit idle before it is replaced. Defaults
+            to the DB_POOL_RECYCLE environment variable or 300.
+        timeout : Optional[float]
+            Seconds to wait for a free connection. Defaults to the
+            DB_POOL_TIMEOUT environment variable or 30.
+        """
+        self.size = size or int(os.environ.get("DB_POOL_SIZE", "10"))
+        self.recycle = recycle or float(os.environ.get("DB_POOL_RECYCLE", "300"))
+        self.timeout = timeout or float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+        self.mysql_user = os.environ.get("MYSQL_USER")
+        self.mysql_passwd = get_secret("MYSQL_PASSWORD")
+        self.mysql_database = os.environ.get("MYSQL_DATABASE")
+        # Most recently returned connections are reused first, so the rest
+        # age out and get recycled
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._stats = {
+            "created": 0,
+            "recycled": 0,
+            "discarded": 0,
+            "in_use": 0,
+            "timeouts": 0,
+        }
+
+    def _count(self, key: str, amount: int = 1):
+        """
+        Update one of the pool counters.
 
-    def __init__(self):
+        Parameters
+        ----------
+        key : str
+            The counter to update.
+        amount : int
+            The amount to add.
         """
-        Constructor for the Database class.
+        with self._lock:
+            self._stats[key] += amount
+
+    def _connect(self) -> pymysql.connections.Connection:
+        """
+        Open a new connection to the MySQL database.
+
+        Returns
+        -------
+        pymysql.connections.Connection
+            The new connection.
 
         Raises
         ------
         e
             Will rethrow any exceptions encountered connecting to the database.
         """
-        # if not hasattr(self, "_initialized"):  # Prevent re-initialization
-        self.mysql_user = os.environ.get("MYSQL_USER")
-        self.mysql_passwd = get_secret("MYSQL_PASSWORD")
-        self.mysql_database = os.environ.get("MYSQL_DATABASE")
         try:
-            # Establish a connection to the MySQL database
-            self.connection = pymysql.connect(
+            # Reads must not hold a transaction (and its snapshot) open while
+            # the connection sits in the pool
+            connection = pymysql.connect(
                 host="host.docker.internal",
-                #host="localhost",
+                # host="localhost",
                 user=self.mysql_user,
                 password=self.mysql_passwd,
                 database=self.mysql_database,
+                autocommit=True,
             )
-        #    setattr(self, "_initialized", True)
         except Exception as e:
-            print(f"Error unexpected exception in Database::__init__. e={e}")
+            logger.error(
+                "could not connect to the database", extra={"error": str(e)}
+            )
             raise e
+        self._count("created")
+        return connection
+
+    def _close(self, connection: pymysql.connections.Connection):
+        """
+        Close a connection, ignoring errors from connections that are gone.
+
+        Parameters
+        ----------
+        connection : pymysql.connections.Connection
+            The connection to close.
+        """
+        try:
+            connection.close()
+        except Exception:
+            pass  # Already closed by the server
+
+    def _checkout(self) -> pymysql.connections.Connection:
+        """
+        Take an idle connection (validating it) or open a new one.
+
+        Returns
+        -------
+        pymysql.connections.Connection
+            A live connection.
+        """
+        while True:
+            try:
+                connection, returned_at = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - returned_at > self.recycle:
+                self._count("recycled")
+                self._close(connection)
+                continue
+            try:
+                connection.ping(reconnect=False)
+                return connection
+            except Exception:
+                self._count("discarded")
+                self._close(connection)
+
+    @contextmanager
+    def connection(self) -> Iterator[pymysql.connections.Connection]:
+        """
+        Borrow a connection for the duration of the block.
+
+        Yields
+        ------
+        pymysql.connections.Connection
+            A live connection. It is returned to the pool when the block exits,
+            or closed if the block raised.
+
+        Raises
+        ------
+        TimeoutError
+            If no connection becomes free within the pool timeout.
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            self._count("timeouts")
+            raise TimeoutError("Timed out waiting for a database connection")
+        try:
+            connection = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+        self._count("in_use")
+        try:
+            yield connection
+        except BaseException:
+            self._count("discarded")
+            self._close(connection)
+            raise
+        else:
+            self._idle.put((connection, time.monotonic()))
+        finally:
+            self._count("in_use", -1)
+            self._slots.release()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return the pool counters.
+
+        Returns
+        -------
+        Dict[str, int]
+            Pool size, idle and in use connections, and how many connections
+            were created, recycled, discarded or timed out waiting.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["size"] = self.size
+        stats["idle"] = self._idle.qsize()
+        return stats
+
+
+_POOL: Optional[ConnectionPool] = None
+_POOL_LOCK = threading.Lock()
+
 
+def get_pool() -> ConnectionPool:
+    """
+    Return the process wide connection pool, creating it on first use.
+
+    Returns
+    -------
+    ConnectionPool
+        The connection pool.
+    """
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ConnectionPool()
+        return _POOL
+
+
+class Database:
+    """
+    Database access backed by the process wide connection pool.
+
+    Creating a Database is cheap; every method borrows a pooled connection
+    for the duration of its queries.
+    """
+
+    def __init__(self):
+        """
+        Constructor for the Database class.
+        """
+        self.pool = get_pool()
+
+    @DB_QUERY_SECONDS.time(method="get_venue_user_info")
     def get_venue_user_info(self, user_id: str, venue: str) -> VenueUsersTable:
         """
         Get user information for a particular venue.
@@ -68,18 +268,15 @@ class Database:
         VenueUsersTable
             A row from the venue_users table.
         """
-        print("IN get_venue_user_info")
         user_info = None
         # Create a cursor object to execute SQL queries
-        with self.connection.cursor() as cursor:
+        with self.pool.connection() as connection, connection.cursor() as cursor:
             # Execute an SQL query
             sql = (
-                f"SELECT * FROM venue_users WHERE user_id='{user_id}' "
-                + f"AND venue='{venue}' LIMIT 1"
+                "SELECT * FROM venue_users WHERE user_id=%s "
+                + "AND venue=%s LIMIT 1"
             )
-
-            print(f"SQL={sql}")
-            cursor.execute(sql)
+            cursor.execute(sql, (user_id, venue))
 
             # Fetch all results
             results = cursor.fetchall()
@@ -90,12 +287,17 @@ class Database:
                     venue_user_id=results[0][2],
                     venue_password=results[0][3],
                 )
-        print(f"OUT get_venue_user_info. user_info={user_info}")
+        logger.debug(
+            "get_venue_user_info",
+            extra={"user_id": user_id, "venue": venue, "found": bool(user_info)},
+        )
         return user_info
 
-    def get_user_venues(self, user_id: str) -> List[VenueUsersTable]:
+    @DB_QUERY_SECONDS.time(method="get_user_venue_plan")
+    def get_user_venue_plan(self, user_id: str) -> List[UserVenue]:
         """
-        Get user information for all venues.
+        Get every venue together with the user's credentials for it, in a
+        single round trip.
 
         Parameters
         ----------
@@ -104,40 +306,51 @@ class Database:
 
         Returns
         -------
-        List[VenueUsersTable]
-            Rows from the venue_users table.
+        List[UserVenue]
+            One entry per row of the venues table, plus one per credential
+            row of a venue missing from it (with an empty url, icon and
+            description). user_info is None for venues the user has no
+            credentials for.
         """
-        print("IN get_user_venues")
-        user_info = None
-        # Create a cursor object to execute SQL queries
-        with self.connection.cursor() as cursor:
-            # Execute an SQL query
-            sql = (
-                f"SELECT * FROM venue_users WHERE user_id='{user_id}'"
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            # MySQL has no FULL JOIN; the second SELECT adds the credentials
+            # the first one cannot match to a venue
+            cursor.execute(
+                "SELECT v.venue, v.url, v.icon, v.description, vu.user_id, "
+                + "vu.venue_user_id, vu.venue_password FROM venues v "
+                + "LEFT JOIN venue_users vu "
+                + "ON vu.venue = v.venue AND vu.user_id = %s "
+                + "UNION ALL "
+                + "SELECT vu.venue, '', '', '', vu.user_id, vu.venue_user_id, "
+                + "vu.venue_password FROM venue_users vu "
+                + "LEFT JOIN venues v ON v.venue = vu.venue "
+                + "WHERE vu.user_id = %s AND v.venue IS NULL",
+                (user_id, user_id),
             )
-
-            print(f"SQL={sql}")
-            cursor.execute(sql)
-
-            user_info_list = []
-            # Fetch all results
-            results = cursor.fetchall()
-            for row in results:
-                print(f"row={row}")
-                user_info = VenueUsersTable(
-                    user_id=row[0],
-                    venue=row[1],
-                    venue_user_id=row[2],
-                    venue_password=row[3],
+            return [
+                UserVenue(
+                    venue_info=VenuesTable(
+                        venue=row[0], url=row[1], icon=row[2], description=row[3]
+                    ),
+                    user_info=(
+                        VenueUsersTable(
+                            user_id=row[4],
+                            venue=row[0],
+                            venue_user_id=row[5],
+                            venue_password=row[6],
+                        )
+                        if row[4] is not None
+                        else None
+                    ),
                 )
-                user_info_list.append(user_info)
+                for row in cursor.fetchall()
+            ]
 
-        print(f"OUT get_user_venues. user_info_list={user_info_list}")
-        return user_info_list
-    
+    @DB_QUERY_SECONDS.time(method="update_venue_user_info")
     def update_venue_user_info(self, data: VenueUsersTable) -> bool:
         """
-        Updates the venue_users table 
+        Updates the venue_users table and drops the snapshot scraped with the
+        previous credentials, recording the venue's data as removed.
 
         Parameters
         ----------
@@ -149,32 +362,60 @@ class Database:
         bool
             True is returned if the update was successful, False otherwise.
         """
-        print("IN update_venue_user_info")
         user_id = data.user_id
         venue = data.venue
         venue_user_id = data.venue_user_id
         venue_password = data.venue_password
 
         # Create a cursor object to execute SQL queries
-        with self.connection.cursor() as cursor:
+        with self.pool.connection() as connection, connection.cursor() as cursor:
             retval = True
+            removed = False
             try:
-                # Execute an SQL query
+                # The credentials and the snapshot change together
+                connection.begin()
                 sql = (
                     "REPLACE INTO venue_users (user_id, venue, venue_user_id, "
-                    + "venue_password) "
-                    + f"VALUES ('{user_id}', '{venue}', '{venue_user_id}', "
-                    + f"'{venue_password}');"
+                    + "venue_password) VALUES (%s, %s, %s, %s)"
+                )
+                cursor.execute(
+                    sql, (user_id, venue, venue_user_id, venue_password)
                 )
-                print(f"SQL={sql}")
-                cursor.execute(sql)
-                self.connection.commit()
+                cursor.execute(
+                    "DELETE FROM dog_snapshots WHERE user_id=%s AND venue=%s",
+                    (user_id, venue),
+                )
+                removed = bool(
+                    cursor.execute(
+                        "DELETE FROM member_snapshots "
+                        + "WHERE user_id=%s AND venue=%s",
+                        (user_id, venue),
+                    )
+                )
+                if removed:
+                    self._record_changes(
+                        cursor,
+                        user_id,
+                        [MemberChange(venue=venue, change="removed")],
+                        datetime.utcnow(),
+                    )
+                connection.commit()
             except Exception as e:
-                print(f"Error: user creation error e={e}")
+                logger.error(
+                    "could not update venue user info",
+                    extra={"user_id": user_id, "venue": venue, "error": str(e)},
+                )
+                connection.rollback()
                 retval = False
-        print(f"OUT update_venue_user_info. retval={retval}")
+        if retval and removed:
+            MEMBER_CHANGES_TOTAL.inc(venue=venue, change="removed")
+        logger.debug(
+            "update_venue_user_info",
+            extra={"user_id": user_id, "venue": venue, "retval": retval},
+        )
         return retval
 
+    @DB_QUERY_SECONDS.time(method="get_venue_info")
     def get_venue_info(self, venue: str = None) -> List[VenuesTable]:
         """
         Return information for a given venue.
@@ -191,17 +432,27 @@ class Database:
         """
         venue_info = []
         # Create a cursor object to execute SQL queries
-        with self.connection.cursor() as cursor:
+        with self.pool.connection() as connection, connection.cursor() as cursor:
             # Execute an SQL query
-            sql = f"SELECT * FROM venues WHERE venue='{venue}' LIMIT 1" if venue else "SELECT * FROM venues"
-            cursor.execute(sql)
+            if venue:
+                cursor.execute(
+                    "SELECT * FROM venues WHERE venue=%s LIMIT 1", (venue,)
+                )
+            else:
+                cursor.execute("SELECT * FROM venues")
 
             # Fetch all results
             results = cursor.fetchall()
-            venue_info = [VenuesTable(venue=row[0], url=row[1], icon=row[2], description=row[3]) for row in results]
+            venue_info = [
+                VenuesTable(
+                    venue=row[0], url=row[1], icon=row[2], description=row[3]
+                )
+                for row in results
+            ]
 
         return venue_info
 
+    @DB_QUERY_SECONDS.time(method="get_user")
     def get_user(self, username: str) -> UserInDB:
         """
         Return a row of information about a user.
@@ -218,10 +469,10 @@ class Database:
         """
         user_in_db = None
         # Create a cursor object to execute SQL queries
-        with self.connection.cursor() as cursor:
+        with self.pool.connection() as connection, connection.cursor() as cursor:
             # Execute an SQL query
-            sql = f"SELECT * FROM users WHERE user_id='{username}' LIMIT 1"
-            cursor.execute(sql)
+            sql = "SELECT * FROM users WHERE user_id=%s LIMIT 1"
+            cursor.execute(sql, (username,))
 
             # Fetch all results
             results = cursor.fetchall()
@@ -232,6 +483,7 @@ class Database:
 
         return user_in_db
 
+    @DB_QUERY_SECONDS.time(method="create_user")
     def create_user(self, username: str, password: str) -> bool:
         """
         Create an sso user entry.
@@ -249,22 +501,23 @@ class Database:
             True is returned if the user is created successfully, False otherwise.
         """
         # Create a cursor object to execute SQL queries
-        with self.connection.cursor() as cursor:
+        with self.pool.connection() as connection, connection.cursor() as cursor:
             retval = True
             try:
                 # Execute an SQL query
-                sql = (
-                    "INSERT INTO users (user_id, password) "
-                    + f"VALUES ('{username}', '{password}');"
-                )
-                cursor.execute(sql)
-                self.connection.commit()
+                sql = "INSERT INTO users (user_id, password) VALUES (%s, %s)"
+                cursor.execute(sql, (username, password))
+                connection.commit()
             except Exception as e:
-                print(f"Error: user creation error e={e}")
+                logger.error(
+                    "could not create user",
+                    extra={"user_id": username, "error": str(e)},
+                )
                 retval = False
 
         return retval
 
+    @DB_QUERY_SECONDS.time(method="change_password")
     def change_password(self, username: str, password: str) -> bool:
         """
         Change the password associate with an sso user id.
@@ -272,28 +525,416 @@ class Database:
         Parameters
         ----------
         username : str
-            The sso user id 
+            The sso user id
         password : str
             The new password value
 
         Returns
         -------
         bool
-            True is returned if the password is updated successfully, False otherwise.
+            True is returned if the password is updated successfully, False
+            otherwise.
         """
         # Create a cursor object to execute SQL queries
-        with self.connection.cursor() as cursor:
+        with self.pool.connection() as connection, connection.cursor() as cursor:
             retval = True
             try:
                 # Execute an SQL query
-                sql = (
-                    f"UPDATE users SET password='{password}' "
-                    + f"WHERE user_id='{username}';"
-                )
-                cursor.execute(sql)
-                self.connection.commit()
+                sql = "UPDATE users SET password=%s WHERE user_id=%s"
+                cursor.execute(sql, (password, username))
+                connection.commit()
             except Exception as e:
-                print(f"Error: user creation error e={e}")
+                logger.error(
+                    "could not change password",
+                    extra={"user_id": username, "error": str(e)},
+                )
                 retval = False
 
         return retval
+
+    @DB_QUERY_SECONDS.time(method="create_snapshot_tables")
+    def create_snapshot_tables(self):
+        """
+        Create the tables holding the last scraped member and dog information,
+        and the changes between scrapes, if they do not exist yet.
+        """
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS member_snapshots ("
+                + "user_id VARCHAR(255) NOT NULL, "
+                + "venue VARCHAR(64) NOT NULL, "
+                + "handler_member_id VARCHAR(255), "
+                + "handler VARCHAR(255), "
+                + "address TEXT, "
+                + "phone VARCHAR(64), "
+                + "email VARCHAR(255), "
+                + "refreshed_at DATETIME NOT NULL, "
+                + "PRIMARY KEY (user_id, venue))"
+            )
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS dog_snapshots ("
+                + "user_id VARCHAR(255) NOT NULL, "
+                + "venue VARCHAR(64) NOT NULL, "
+                + "dog_member_id VARCHAR(255) NOT NULL, "
+                + "call_name VARCHAR(255), "
+                + "breed VARCHAR(255), "
+                + "jump_height INT, "
+                + "dob DATE, "
+                + "PRIMARY KEY (user_id, venue, dog_member_id))"
+            )
+            # The last change version of each user
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS member_versions ("
+                + "user_id VARCHAR(255) NOT NULL, "
+                + "version INT NOT NULL, "
+                + "PRIMARY KEY (user_id))"
+            )
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS member_changes ("
+                + "id BIGINT NOT NULL AUTO_INCREMENT, "
+                + "user_id VARCHAR(255) NOT NULL, "
+                + "version INT NOT NULL, "
+                + "venue VARCHAR(64) NOT NULL, "
+                + "change_type VARCHAR(16) NOT NULL, "
+                + "dog_member_id VARCHAR(255), "
+                + "field_name VARCHAR(64), "
+                + "old_value TEXT, "
+                + "new_value TEXT, "
+                + "changed_at DATETIME NOT NULL, "
+                + "PRIMARY KEY (id), "
+                + "KEY user_version (user_id, version))"
+            )
+
+    def _record_changes(
+        self, cursor, user_id: str, changes: List[MemberChange], now: datetime
+    ) -> int:
+        """
+        Append changes to a user's member information under a new version,
+        inside the caller's transaction.
+
+        Parameters
+        ----------
+        cursor : pymysql.cursors.Cursor
+            A cursor of the connection holding the transaction.
+        user_id : str
+            The sso user id.
+        changes : List[MemberChange]
+            The changes.
+        now : datetime
+            UTC time of the changes.
+
+        Returns
+        -------
+        int
+            The version the changes were recorded under.
+        """
+        # All changes of a save share one version. The version row stays
+        # locked until commit, so a user's versions become visible in order.
+        cursor.execute(
+            "INSERT INTO member_versions (user_id, version) VALUES (%s, 1) "
+            + "ON DUPLICATE KEY UPDATE version = version + 1",
+            (user_id,),
+        )
+        cursor.execute(
+            "SELECT version FROM member_versions WHERE user_id=%s", (user_id,)
+        )
+        version = cursor.fetchone()[0]
+        cursor.executemany(
+            "INSERT INTO member_changes (user_id, version, venue, "
+            + "change_type, dog_member_id, field_name, old_value, new_value, "
+            + "changed_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+            [
+                (
+                    user_id,
+                    version,
+                    change.venue,
+                    change.change,
+                    change.dog_member_id,
+                    change.field,
+                    change.old,
+                    change.new,
+                    now,
+                )
+                for change in changes
+            ],
+        )
+        return version
+
+    @DB_QUERY_SECONDS.time(method="save_member_snapshot")
+    def save_member_snapshot(self, user_id: str, member_info: MemberInfo) -> bool:
+        """
+        Update the stored snapshot of a user's member information for a venue
+        and record how it changed since the last scrape. Only the member row
+        and the dog rows that changed are written; an unchanged scrape only
+        moves refreshed_at.
+
+        Parameters
+        ----------
+        user_id : str
+            The sso user id.
+        member_info : MemberInfo
+            Freshly scraped member information.
+
+        Returns
+        -------
+        bool
+            True is returned if the snapshot was saved, False otherwise.
+        """
+        venue = member_info.venue
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            try:
+                # Locking the member row makes concurrent saves of the same
+                # venue diff against each other's result
+                connection.begin()
+                cursor.execute(
+                    "SELECT handler_member_id, handler, address, phone, email "
+                    + "FROM member_snapshots WHERE user_id=%s AND venue=%s "
+                    + "FOR UPDATE",
+                    (user_id, venue),
+                )
+                row = cursor.fetchone()
+                previous = None
+                if row is not None:
+                    cursor.execute(
+                        "SELECT dog_member_id, call_name, breed, jump_height, "
+                        + "dob FROM dog_snapshots "
+                        + "WHERE user_id=%s AND venue=%s",
+                        (user_id, venue),
+                    )
+                    previous = member_info.model_copy(
+                        update={
+                            **dict(zip(MEMBER_FIELDS, row)),
+                            "dog_info": [
+                                DogInfo(
+                                    dog_member_id=dog[0],
+                                    call_name=dog[1],
+                                    breed=dog[2],
+                                    jump_height=dog[3],
+                                    dob=dog[4],
+                                )
+                                for dog in cursor.fetchall()
+                            ],
+                        }
+                    )
+                changes = diff_member_info(previous, member_info)
+
+                now = datetime.utcnow()
+                if not changes:
+                    cursor.execute(
+                        "UPDATE member_snapshots SET refreshed_at=%s "
+                        + "WHERE user_id=%s AND venue=%s",
+                        (now, user_id, venue),
+                    )
+                    connection.commit()
+                    return True
+
+                cursor.execute(
+                    "REPLACE INTO member_snapshots (user_id, venue, "
+                    + "handler_member_id, handler, address, phone, email, "
+                    + "refreshed_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+                    (
+                        user_id,
+                        venue,
+                        member_info.handler_member_id,
+                        member_info.handler,
+                        member_info.address,
+                        member_info.phone,
+                        member_info.email,
+                        now,
+                    ),
+                )
+                dogs = changed_dogs(changes)
+                cursor.executemany(
+                    "DELETE FROM dog_snapshots WHERE user_id=%s AND venue=%s "
+                    + "AND dog_member_id=%s",
+                    [(user_id, venue, dog_id) for dog_id in dogs],
+                )
+                cursor.executemany(
+                    "INSERT INTO dog_snapshots (user_id, venue, dog_member_id, "
+                    + "call_name, breed, jump_height, dob) "
+                    + "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                    [
+                        (
+                            user_id,
+                            venue,
+                            dog.dog_member_id,
+                            dog.call_name,
+                            dog.breed,
+                            dog.jump_height,
+                            dog.dob,
+                        )
+                        for dog in member_info.dog_info
+                        if dog.dog_member_id in dogs
+                    ],
+                )
+
+                version = self._record_changes(cursor, user_id, changes, now)
+                connection.commit()
+            except Exception as e:
+                logger.error(
+                    "could not save member snapshot",
+                    extra={
+                        "user_id": user_id,
+                        "venue": member_info.venue,
+                        "error": str(e),
+                    },
+                )
+                connection.rollback()
+                return False
+
+        for change in changes:
+            MEMBER_CHANGES_TOTAL.inc(venue=venue, change=change.change)
+        logger.info(
+            "member info changed",
+            extra={
+                "user_id": user_id,
+                "venue": venue,
+                "version": version,
+                "changes": len(changes),
+            },
+        )
+        return True
+
+    @DB_QUERY_SECONDS.time(method="get_member_snapshots")
+    def get_member_snapshots(self, user_id: str) -> List[MemberInfo]:
+        """
+        Return the stored snapshots of a user's member information.
+
+        Parameters
+        ----------
+        user_id : str
+            The sso user id.
+
+        Returns
+        -------
+        List[MemberInfo]
+            One entry per venue with a snapshot. cache_age is the number of
+            seconds since the snapshot was taken.
+        """
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT venue, dog_member_id, call_name, breed, jump_height, dob "
+                + "FROM dog_snapshots WHERE user_id=%s",
+                (user_id,),
+            )
+            dog_info: Dict[str, List[DogInfo]] = {}
+            for row in cursor.fetchall():
+                dog_info.setdefault(row[0], []).append(
+                    DogInfo(
+                        dog_member_id=row[1],
+                        call_name=row[2],
+                        breed=row[3],
+                        jump_height=row[4],
+                        dob=row[5],
+                    )
+                )
+
+            cursor.execute(
+                "SELECT s.venue, v.icon, v.description, s.handler_member_id, "
+                + "s.handler, s.address, s.phone, s.email, s.refreshed_at "
+                + "FROM member_snapshots s JOIN venues v ON v.venue = s.venue "
+                + "WHERE s.user_id=%s",
+                (user_id,),
+            )
+            now = datetime.utcnow()
+            member_info_list = [
+                MemberInfo(
+                    venue=row[0],
+                    icon=row[1],
+                    description=row[2],
+                    handler_member_id=row[3],
+                    handler=row[4],
+                    address=row[5],
+                    phone=row[6],
+                    email=row[7],
+                    dog_info=dog_info.get(row[0], []),
+                    from_cache=True,
+                    cache_age=(now - row[8]).total_seconds(),
+                )
+                for row in cursor.fetchall()
+            ]
+
+        return member_info_list
+
+    @DB_QUERY_SECONDS.time(method="get_member_changes")
+    def get_member_changes(
+        self, user_id: str, since: int = 0
+    ) -> Tuple[int, List[MemberChange]]:
+        """
+        Return the changes to a user's member information after a version.
+
+        Parameters
+        ----------
+        user_id : str
+            The sso user id.
+        since : int
+            The last version the client has seen; 0 for every change.
+
+        Returns
+        -------
+        Tuple[int, List[MemberChange]]
+            The user's latest version (0 if nothing was recorded) and the
+            changes with a version above since and up to it, oldest first.
+        """
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            # Read the version first, so changes committed in between are
+            # left for the next call instead of being returned twice
+            cursor.execute(
+                "SELECT version FROM member_versions WHERE user_id=%s",
+                (user_id,),
+            )
+            row = cursor.fetchone()
+            version = row[0] if row else 0
+            cursor.execute(
+                "SELECT version, venue, change_type, dog_member_id, "
+                + "field_name, old_value, new_value, changed_at "
+                + "FROM member_changes "
+                + "WHERE user_id=%s AND version>%s AND version<=%s "
+                + "ORDER BY version, id",
+                (user_id, since, version),
+            )
+            changes = [
+                MemberChange(
+                    version=row[0],
+                    venue=row[1],
+                    change=row[2],
+                    dog_member_id=row[3],
+                    field=row[4],
+                    old=row[5],
+                    new=row[6],
+                    changed_at=row[7],
+                )
+                for row in cursor.fetchall()
+            ]
+
+        return version, changes
+
+    @DB_QUERY_SECONDS.time(method="get_snapshot_times")
+    def get_snapshot_times(self) -> Dict[Tuple[str, str], datetime]:
+        """
+        Return when each stored snapshot was taken.
+
+        Returns
+        -------
+        Dict[Tuple[str, str], datetime]
+            UTC refresh time keyed by (user_id, venue).
+        """
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT user_id, venue, refreshed_at FROM member_snapshots"
+            )
+            return {(row[0], row[1]): row[2] for row in cursor.fetchall()}
+
+    @DB_QUERY_SECONDS.time(method="get_all_venue_users")
+    def get_all_venue_users(self) -> List[Tuple[str, str]]:
+        """
+        Return every (user_id, venue) pair with stored venue credentials.
+
+        Returns
+        -------
+        List[Tuple[str, str]]
+            The keys of the venue_users table.
+        """
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute("SELECT user_id, venue FROM venue_users")
+            return [(row[0], row[1]) for row in cursor.fetchall()]
@@ -1,44 +1,119 @@
 # system
-import re
-import pandas as pd
-import bonobo
-from datetime import datetime
-from typing import List, Any, Dict, Generator, Tuple
-
-from common import get_secret
-from db import Database
-from pydantic import BaseModel
-from fastapi import Depends, FastAPI, HTTPException, status
+import asyncio
+import hashlib
+import os
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from functools import partial
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from admission import SCRAPE_ADMISSION
+from auth import (
+    PASSWORD_HASHER,
+    check_user,
+    create_access_token,
+    get_current_user,
+)
+from browser_pool import BROWSER_POOL
+from cache import MEMBER_INFO_CACHE, VENUE_CACHE
+from conditional import (
+    GZipMiddleware,
+    conditional_response,
+    make_etag,
+    member_info_digest,
+)
+from db import Database, get_pool
+from fastapi import Depends, FastAPI, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import JWTError, jwt
+from fastapi.responses import Response, StreamingResponse
+from fastapi.security import OAuth2PasswordRequestForm
+from http_scraper import ExtractionError, HttpSession
+from intercept import ScrapeInterceptor
+from log import configure_logging, get_logger, shutdown_logging
+from metrics import (
+    AUTH_REQUEST_SECONDS,
+    CONTENT_TYPE,
+    REGISTRY,
+    SCRAPE_FALLBACKS_TOTAL,
+    SCRAPE_STAGE_SECONDS,
+    VENUE_QUERY_SECONDS,
+    Stats,
+)
 
 # local
 from model import (  # noqa
+    ChangesQuery,
     InfoQuery,
-    DogInfo,
+    MemberChangesResponse,
     MemberInfo,
     Token,
+    UserInfoEvent,
+    UserInfoResponse,
+    UserVenue,
     VenueQuery,
+    VenuesTable,
+    VenueStatus,
     VenueUsersTable,
-    ChainType
 )
-from passlib.context import CryptContext
-
-# frameworks
-from playwright.sync_api import sync_playwright
+from pydantic import TypeAdapter
+from scheduler import RefreshScheduler
+from session_store import SESSION_STORE
+from venues import VENUE_ADAPTERS, VenueAdapter
 
-app = FastAPI()
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+configure_logging()
+logger = get_logger("endpoint")
 
-# For demonstration, replace with a secure secret key
-SECRET_KEY = get_secret("JWT_SECRET_KEY")
-ALGORITHM = "HS256"
 
-# Global data
-KV_STORE: Dict[ChainType, Any] = {}  # Key-Value storage for the transform results
-PARAM_DICT: Dict[str, Any] = {}  # Key-Value storage to pass params
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start warming the browser pool and the snapshot refresh scheduler, and
+    stop them on shutdown once pending snapshot writes finish. The browsers
+    launch in the background so the API is ready before Chromium is.
+    """
+    configure_logging()
+    BROWSER_POOL.warm()
+    try:
+        await run_in_threadpool(lambda: Database().create_snapshot_tables())
+        await run_in_threadpool(VENUE_CACHE.load)
+    except Exception as e:
+        logger.error("could not prepare the database", extra={"error": str(e)})
+    if SNAPSHOT_REFRESH_ENABLED:
+        REFRESH_SCHEDULER.start()
+    yield
+    await REFRESH_SCHEDULER.stop()
+    # Let scraped results already in hand reach the database
+    await asyncio.gather(*SNAPSHOT_WRITES)
+    PASSWORD_HASHER.shutdown()
+    await BROWSER_POOL.stop()
+    shutdown_logging()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Encodes /get-user-venues/ responses with pydantic's compiled serializer
+VENUE_USERS_JSON = TypeAdapter(List[VenueUsersTable])
+
+# Seconds a single venue scrape may take before /get-user-info/ gives up on it
+VENUE_QUERY_TIMEOUT = float(os.environ.get("VENUE_QUERY_TIMEOUT", "60"))
+
+# Abort unneeded requests of browser scrapes and cache their static assets
+SCRAPE_INTERCEPT = os.environ.get("SCRAPE_INTERCEPT", "true").lower() == "true"
+
+# Keep the member snapshot tables refreshed in the background
+SNAPSHOT_REFRESH_ENABLED = (
+    os.environ.get("SNAPSHOT_REFRESH_ENABLED", "true").lower() == "true"
+)
 
 origins = ["*"]
 
@@ -48,34 +123,34 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
+)
+# Compress bodies of at least GZIP_MINIMUM_SIZE bytes, except the stream
+app.add_middleware(
+    GZipMiddleware,
+    minimum_size=int(os.environ.get("GZIP_MINIMUM_SIZE", "1000")),
+    excluded_paths=["/get-user-info-stream/"],
 )
-
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-
-def create_access_token(data: dict):
-    to_encode = data.copy()
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
 
 
 @app.post("/create-account")
+@AUTH_REQUEST_SECONDS.time(endpoint="create-account")
 async def create_account(
     form_data: OAuth2PasswordRequestForm = Depends(),
 ) -> bool:
     db = Database()
-    print(f"IN create_account username={form_data.username}")
-    user = db.get_user(form_data.username)
+    logger.info("create_account", extra={"user_id": form_data.username})
+    user = await run_in_threadpool(db.get_user, form_data.username)
     if user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"User {form_data.username} already exists",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    hashed_password = pwd_context.hash(form_data.password)
-    result = db.create_user(form_data.username, hashed_password)
+    hashed_password = await PASSWORD_HASHER.hash(form_data.password)
+    result = await run_in_threadpool(
+        db.create_user, form_data.username, hashed_password
+    )
     if not result:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -86,20 +161,23 @@ async def create_account(
 
 
 @app.post("/change-password")
+@AUTH_REQUEST_SECONDS.time(endpoint="change-password")
 async def change_password(
     form_data: OAuth2PasswordRequestForm = Depends(),
 ) -> bool:
     db = Database()
-    print(f"IN change_password username={form_data.username}")
-    user = db.get_user(form_data.username)
+    logger.info("change_password", extra={"user_id": form_data.username})
+    user = await run_in_threadpool(db.get_user, form_data.username)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"user {form_data.username} does not exist",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    hashed_password = pwd_context.hash(form_data.password)
-    result = db.change_password(form_data.username, hashed_password)
+    hashed_password = await PASSWORD_HASHER.hash(form_data.password)
+    result = await run_in_threadpool(
+        db.change_password, form_data.username, hashed_password
+    )
     if not result:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -110,12 +188,15 @@ async def change_password(
 
 
 @app.post("/token", response_model=Token)
+@AUTH_REQUEST_SECONDS.time(endpoint="token")
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
 ):
     db = Database()
-    user = db.get_user(form_data.username)
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    user = await run_in_threadpool(db.get_user, form_data.username)
+    if not user or not await PASSWORD_HASHER.verify(
+        form_data.password, user.hashed_password
+    ):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -125,147 +206,138 @@ async def login_for_access_token(
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-@app.post("/get-cpe-info/")
-def get_cpe_info(
-    query: InfoQuery, token: str = Depends(oauth2_scheme)
-) -> MemberInfo:
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = query.user_id
-        sub = payload.get("sub")
-        if sub is None:
-            raise HTTPException(status_code=401, detail="Invalid credentials")
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid credentials")
-    return process_cpe_info_query(user_id)
-
-def process_cpe_info_query(user_id: str) -> MemberInfo:
+def load_venue_info(
+    user_id: str, venue: str
+) -> Tuple[VenueUsersTable, VenuesTable]:
+    """
+    Load the credentials and venue row needed to scrape a venue.
+
+    Parameters
+    ----------
+    user_id : str
+        The sso user id.
+    venue : str
+        The venue to scrape (ie; 'CPE')
+
+    Returns
+    -------
+    Tuple[VenueUsersTable, VenuesTable]
+        The user's venue credentials and the venue's row from the venues table.
+    """
     db = Database()
-    user_info = db.get_venue_user_info(user_id, "CPE")
+    user_info = db.get_venue_user_info(user_id, venue)
     if not user_info:
         raise HTTPException(
-            status_code=404, detail=f"No user={user_id} for venue=CPE"
+            status_code=404, detail=f"No user={user_id} for venue={venue}"
         )
 
-    venue_info = db.get_venue_info("CPE")[0]
+    venue_info = VENUE_CACHE.get(venue)
     if not venue_info:
-        raise HTTPException(status_code=404, detail="No venue=CPE found")
+        raise HTTPException(status_code=404, detail=f"No venue={venue} found")
 
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        page = browser.new_page()
+    return user_info, venue_info[0]
 
-        try:
-            page.goto(venue_info.url)
-            page.fill(
-                "input[name='MemberIdOrEmailInput']", user_info.venue_user_id
-            )
-            page.fill("input[name='PasswordInput']", user_info.venue_password)
-            page.locator('input[type="submit"]').click()
-            page.wait_for_url(
-                f"{venue_info.url}/Member/Records?isViewingActiveDogs=True"
-            )
-        except TimeoutError:
-            detail = (
-                "Processing error for venue=CPE and "
-                + f"user={user_info.venue_user_id}"
-            )
-            raise HTTPException(status_code=500, detail=detail)
-
-        handler, handler_member_id, address, phone, email = (
-            None,
-            None,
-            None,
-            None,
-            None,
-        )
-        address_div_locator = page.locator("#MemberInformation .address")
-        address_pattern = re.compile(
-            r"Member ID:(\d+)\n"  # member_id
-            r"Primary:(.+)\n"  # handler
-            r"Secondary:(.*)\n"  # secondary
-            r"Address:\n"  # address
-            r"(.*)",
-            re.DOTALL,
-        )
-        match = address_pattern.match(address_div_locator.inner_text())
-        if match:
-            handler_member_id, handler, _, address = match.groups()
-        contact_div_locator = page.locator(
-            "#MemberInformation .contact-information"
-        )
-        contact_pattern = re.compile(
-            r"Dues Paid Through:(.+)\n"  # info
-            r"Phone [#]{1}1:(.+)\n"  # phone_1
-            r"Phone [#]{1}2:(.+)\n"
-            r"Email:(.+)"
+
+async def scrape_venue(
+    user_id: str,
+    venue: str,
+    scraper: Callable[..., Awaitable[MemberInfo]],
+    user_venue: Optional[UserVenue] = None,
+) -> MemberInfo:
+    """
+    Scrape a venue for a user on a pooled browser, reusing the user's stored
+    venue session when there is one. The scrape first waits for an admission
+    slot (see admission.py), and requests the scraper does not need are
+    aborted (see intercept.py).
+
+    Parameters
+    ----------
+    user_id : str
+        The sso user id.
+    venue : str
+        The venue to scrape (ie; 'CPE')
+    scraper : Callable[..., Awaitable[MemberInfo]]
+        The venue's scraper (ie; scrape_cpe_info)
+    user_venue : Optional[UserVenue]
+        The venue row and credentials, if the caller already fetched them.
+
+    Returns
+    -------
+    MemberInfo
+        The handler and dog information found on the venue.
+
+    Raises
+    ------
+    HTTPException
+        With status 503 and a Retry-After header if the scrape was not
+        admitted.
+    """
+    if user_venue is not None and user_venue.user_info is not None:
+        user_info, venue_info = user_venue.user_info, user_venue.venue_info
+    else:
+        user_info, venue_info = await run_in_threadpool(
+            load_venue_info, user_id, venue
         )
-        match = contact_pattern.match(contact_div_locator.inner_text())
-        if match:
-            _, phone, _, email = match.groups()
-
-        table_data = []
-        div_locator = page.locator("#DogList")
-        rows = div_locator.locator("tr").all()
-        for row in rows:
-            row_data = []
-            # Get all cells in the current row
-            cells = row.locator("td").all()  # Use 'th' for header cells if needed
-
-            for cell in cells:
-                cell_text = cell.inner_text()
-                row_data.append(cell_text)
-            if len(row_data) >= 5:
-                table_data.append(
-                    (
-                        handler_member_id,
-                        row_data[0],
-                        row_data[1],
-                        row_data[2],
-                        row_data[3],
-                        row_data[4],
-                    )
-                )
-
-        dog_info_list = [
-            DogInfo(
-                dog_member_id=item[1],
-                call_name=item[2],
-                breed=item[3],
-                jump_height=int(
-                    item[4] if item[4] != "Needs Measurement" else "-1"
-                ),
-                dob=datetime.strptime(item[5], "%m/%d/%Y"),
+    storage_state = SESSION_STORE.get(user_id, venue)
+    async with AsyncExitStack() as stack:
+        # Queue time is reported by dogsports_scrape_queue_wait_seconds
+        await stack.enter_async_context(SCRAPE_ADMISSION.slot(venue))
+        with SCRAPE_STAGE_SECONDS.time(venue=venue, stage="browser"):
+            context = await stack.enter_async_context(
+                BROWSER_POOL.context(storage_state=storage_state)
             )
-            for item in table_data
-        ]
-        member_info = MemberInfo(
-            venue=venue_info.venue,
-            icon=venue_info.icon,
-            description=venue_info.description,
-            handler_member_id=handler_member_id,
-            handler=handler,
-            phone=phone,
-            email=email,
-            address=address,
-            dog_info=dog_info_list,
-        )
-        return member_info
+        interceptor = None
+        if SCRAPE_INTERCEPT:
+            interceptor = ScrapeInterceptor(venue, venue_info.url)
+            await interceptor.install(context)
+        try:
+            member_info = await scraper(
+                context, user_info, venue_info, resume=storage_state is not None
+            )
+        except Exception:
+            SESSION_STORE.invalidate(user_id, venue)
+            raise
+        finally:
+            if interceptor is not None:
+                interceptor.report()
+        SESSION_STORE.put(user_id, venue, await context.storage_state())
+    return member_info
+
+
+@app.post("/get-cpe-info/", response_model=MemberInfo)
+async def get_cpe_info(
+    query: InfoQuery,
+    request: Request,
+    current_user: str = Depends(get_current_user),
+) -> Response:
+    check_user(current_user, query.user_id)
+    user_id: str = query.user_id
+    member_info = await process_venue_query("CPE", user_id)
+    return member_info_response(request, "get-cpe-info", member_info)
+
+
+def member_info_response(
+    request: Request, endpoint: str, member_info: MemberInfo
+) -> Response:
+    """
+    Answer with one venue's member information, or 304 if the client's copy
+    has the same content.
+    """
+    return conditional_response(
+        request,
+        endpoint,
+        make_etag([member_info_digest(member_info)]),
+        lambda: member_info.model_dump_json().encode(),
+    )
 
 
 @app.post("/get-venue-user-info/")
 def get_venue_user_info(
-    query: VenueQuery, token: str = Depends(oauth2_scheme)
+    query: VenueQuery, current_user: str = Depends(get_current_user)
 ) -> VenueUsersTable:
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = query.user_id
-        venue: str = query.venue
-        sub = payload.get("sub")
-        if sub is None:
-            raise HTTPException(status_code=401, detail="Invalid credentials")
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid credentials")
+    check_user(current_user, query.user_id)
+    user_id: str = query.user_id
+    venue: str = query.venue
 
     db = Database()
     retval = db.get_venue_user_info(user_id, venue)
@@ -277,48 +349,59 @@ def get_venue_user_info(
 
     return retval
 
-@app.post("/get-user-venues/")
+
+@app.post("/get-user-venues/", response_model=List[VenueUsersTable])
 def get_user_venues(
-    query: InfoQuery, token: str = Depends(oauth2_scheme)
-) -> List[VenueUsersTable]:
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = query.user_id
-        sub = payload.get("sub")
-        if sub is None:
-            raise HTTPException(status_code=401, detail="Invalid credentials")
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid credentials")
+    query: InfoQuery,
+    request: Request,
+    current_user: str = Depends(get_current_user),
+) -> Response:
+    check_user(current_user, query.user_id)
+    user_id: str = query.user_id
 
     db = Database()
-    user_venues = db.get_user_venues(user_id)
+    plan = db.get_user_venue_plan(user_id)
+    user_venues = [row.user_info for row in plan if row.user_info is not None]
     if not user_venues:
-        detail = (
-            "No venue user info found for " + f"user_id={user_id}"
-        )
+        detail = "No venue user info found for " + f"user_id={user_id}"
         raise HTTPException(status_code=404, detail=detail)
 
-    user_venue_set = set([user_venue.venue for user_venue in user_venues])
-    system_venue_set = set([system_venue.venue for system_venue in db.get_venue_info()])
-    working_set = system_venue_set.difference(user_venue_set)
-    for venue in working_set:
-        user_venues.append(VenueUsersTable(user_id=user_id, venue=venue, venue_user_id=None, venue_password=None))
-    return user_venues
+    for row in plan:
+        if row.user_info is None:
+            user_venues.append(
+                VenueUsersTable(user_id=user_id, venue=row.venue_info.venue)
+            )
+    body = VENUE_USERS_JSON.dump_json(user_venues)
+    return conditional_response(
+        request,
+        "get-user-venues",
+        make_etag([hashlib.sha256(body).hexdigest()]),
+        lambda: body,
+    )
+
+
+@app.post("/get-user-info-changes/")
+def get_user_info_changes(
+    query: ChangesQuery, current_user: str = Depends(get_current_user)
+) -> MemberChangesResponse:
+    """
+    Return the changes to a user's member information since the version a
+    client last saw. A client starting out passes 0 and then the returned
+    version; a returned version below since means the changes were reset
+    and the client should reload /get-user-info/.
+    """
+    check_user(current_user, query.user_id)
+    version, changes = Database().get_member_changes(query.user_id, query.since)
+    return MemberChangesResponse(version=version, changes=changes)
+
 
 @app.post("/update-venue-user-info/")
 def update_venue_user_info(
-    data: VenueUsersTable, token: str = Depends(oauth2_scheme)
+    data: VenueUsersTable, current_user: str = Depends(get_current_user)
 ) -> bool:
-    print("IN update_venue_user_info")
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        sub = payload.get("sub")
-        if sub is None:
-            raise HTTPException(status_code=401, detail="Invalid credentials")
-        user_id = data.user_id
-        venue = data.venue
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid credentials")
+    check_user(current_user, data.user_id)
+    user_id = data.user_id
+    venue = data.venue
 
     db = Database()
     retval = db.update_venue_user_info(data)
@@ -327,225 +410,450 @@ def update_venue_user_info(
             "No venue user info found for " + f"user_id={user_id}; venue={venue}"
         )
         raise HTTPException(status_code=404, detail=detail)
-    print(f"OUT update_venue_user_info; retval={retval}")
+    # Sessions and results from the old credentials must not be reused; the
+    # database dropped the snapshot along with the credential update
+    SESSION_STORE.invalidate(user_id, venue)
+    MEMBER_INFO_CACHE.invalidate(user_id, venue)
+    logger.info(
+        "update_venue_user_info", extra={"user_id": user_id, "venue": venue}
+    )
     return retval
 
 
-@app.post("/get-bha-info/")
-def get_bha_info(
-    query: InfoQuery, token: str = Depends(oauth2_scheme)
+@app.post("/get-bha-info/", response_model=MemberInfo)
+async def get_bha_info(
+    query: InfoQuery,
+    request: Request,
+    current_user: str = Depends(get_current_user),
+) -> Response:
+    check_user(current_user, query.user_id)
+    user_id: str = query.user_id
+
+    member_info = await process_venue_query("BHA", user_id)
+    return member_info_response(request, "get-bha-info", member_info)
+
+
+async def process_venue_query(
+    venue: str, user_id: str, user_venue: Optional[UserVenue] = None
 ) -> MemberInfo:
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = query.user_id
-        sub = payload.get("sub")
-        if sub is None:
-            raise HTTPException(status_code=401, detail="Invalid credentials")
-        
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid credentials")
-
-    return process_bha_info_query(user_id)
-
-def process_bha_info_query(user_id: str) -> MemberInfo:
-    db = Database()
-    user_info = db.get_venue_user_info(user_id, "BHA")
-    if not user_info:
-        raise HTTPException(
-            status_code=404, detail=f"No user={user_id} for venue=BHA"
+    """
+    Return a user's member information for a venue from the cache, scraping
+    it with the venue's adapter when there is no usable cached copy.
+
+    Parameters
+    ----------
+    venue : str
+        A venue in VENUE_ADAPTERS (ie; 'CPE')
+    user_id : str
+        The sso user id.
+    user_venue : Optional[UserVenue]
+        The venue row and credentials, if the caller already fetched them.
+
+    Returns
+    -------
+    MemberInfo
+        The handler and dog information found on the venue.
+    """
+    with VENUE_QUERY_SECONDS.time(venue=venue):
+        return await MEMBER_INFO_CACHE.get(
+            user_id,
+            venue,
+            partial(
+                scrape_member_info, VENUE_ADAPTERS[venue], user_id, user_venue
+            ),
         )
 
-    venue_info = db.get_venue_info("BHA")[0]
-    if not venue_info:
-        raise HTTPException(status_code=404, detail="No venue=BHA found")
 
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        page = browser.new_page()
+async def scrape_member_info(
+    adapter: VenueAdapter,
+    user_id: str,
+    user_venue: Optional[UserVenue] = None,
+) -> MemberInfo:
+    """
+    Scrape a venue for a user once its rate limit allows, with the adapter's
+    browserless engine if it has one, falling back to a pooled browser if
+    the venue cannot be reached or its pages cannot be parsed. Both engines
+    resume and store the user's venue session in SESSION_STORE.
 
-        try:
-            page.goto(f"{venue_info.url}/register/login.php")
-            page.fill(
-                "input[name='user']", user_info.venue_user_id
+    Parameters
+    ----------
+    adapter : VenueAdapter
+        The venue's adapter.
+    user_id : str
+        The sso user id.
+    user_venue : Optional[UserVenue]
+        The venue row and credentials, if the caller already fetched them.
+
+    Returns
+    -------
+    MemberInfo
+        The handler and dog information found on the venue.
+    """
+    venue = adapter.venue
+    await adapter.throttle()
+    if adapter.http_scraper is not None:
+        if user_venue is None or user_venue.user_info is None:
+            user_info, venue_info = await run_in_threadpool(
+                load_venue_info, user_id, venue
             )
-            page.fill("input[name='pass']", user_info.venue_password)
-            page.locator('input[type="submit"]').click()
-            page.wait_for_url(
-                f"{venue_info.url}/register/barn_hunt_dog_register.php"
+            user_venue = UserVenue(venue_info=venue_info, user_info=user_info)
+        storage_state = SESSION_STORE.get(user_id, venue)
+        session = HttpSession(storage_state=storage_state)
+        try:
+            member_info = await run_in_threadpool(
+                adapter.http_scraper,
+                session,
+                user_venue.user_info,
+                user_venue.venue_info,
+                resume=storage_state is not None,
             )
-            page.goto(f"{venue_info.url}/register/your_profile.php")
-
-            input_element = page.locator("[name='login_email']")
-            handler_member_id = input_element.get_attribute('value')
-            email = handler_member_id
-
-            input_element = page.locator("[name='login_firstname']")
-            firstname =  input_element.get_attribute('value')
-
-            input_element = page.locator("[name='login_lastname']")
-            lastname =  input_element.get_attribute('value')
-
-            input_element = page.locator("[name='login_addr1']")
-            addr1 = input_element.get_attribute('value')
-
-            input_element = page.locator("[name='login_addr2']")
-            addr2 = input_element.get_attribute('value')
-
-            input_element = page.locator("[name='login_city']")
-            city = input_element.get_attribute('value')
-
-            input_element = page.locator("[name='login_postal']")
-            zipcode = input_element.get_attribute('value')
-
-            input_element = page.locator("[name='login_phone']")
-            phone = input_element.get_attribute('value')
-
-            select_element = page.locator("[name='login_state']")
-            state = select_element.evaluate("select => select.value")
-
-            address = f"{addr1}\n{addr2}\n{city}, {state} {zipcode}"
-
-
-            page.goto(f"{venue_info.url}/register/your_dogs.php")
-            table_locator = page.locator("table.data")
-            rows = table_locator.locator("tr").all()
-            columns = []
-            table_data = []
-            for index, row in enumerate(rows):
-                # Get all cells in the current row
-                cells = row.locator("td").all()  # Use 'th' for header cells if needed
-
-                if index == 0:
-                    columns = [cell.inner_text() for cell in cells]
-                else:
-                    table_data.append([cell.inner_text() for cell in cells])
-            dogs_df = pd.DataFrame(table_data, columns=columns)
-            print(dogs_df)
-            dog_info = []
-            for index, row in dogs_df.iterrows():
-                info = DogInfo(dog_member_id=row['Barnhunt No'], 
-                               call_name=row['Call Name'], 
-                               breed=row['Breed'], 
-                               jump_height=int(float(row['Height'])), 
-                               dob=datetime.strptime(row['Birthdate'], "%m/%d/%Y"))
-                dog_info.append(info)
-
-            member_info = MemberInfo(
-                venue=venue_info.venue,
-                icon=venue_info.icon,
-                description=venue_info.description,
-                handler_member_id=handler_member_id,
-                handler=f"{firstname} {lastname}",
-                phone=phone,
-                email=email,
-                address=address,
-                dog_info=dog_info,
+        except ExtractionError as e:
+            SESSION_STORE.invalidate(user_id, venue)
+            SCRAPE_FALLBACKS_TOTAL.inc(venue=venue)
+            logger.warning(
+                "falling back to the browser",
+                extra={"user_id": user_id, "venue": venue, "error": str(e)},
             )
-            print(member_info)
+        except Exception:
+            SESSION_STORE.invalidate(user_id, venue)
+            raise
+        else:
+            SESSION_STORE.put(user_id, venue, session.storage_state())
             return member_info
-    
-        except TimeoutError:
-            detail = (
-                "Processing error for venue=BHA and "
-                + f"user={user_info.venue_user_id}"
-            )
-            raise HTTPException(status_code=500, detail=detail)
+        finally:
+            session.close()
+    return await scrape_venue(user_id, venue, adapter.browser_scraper, user_venue)
 
-        
-        return None
 
-
-def store_results(key: ChainType, data: BaseModel):
+async def query_venue(
+    venue: str, user_id: str, user_venue: Optional[UserVenue] = None
+) -> Tuple[Optional[MemberInfo], VenueStatus]:
     """
-    Store transform results for final processing.
+    Scrape one venue for a user, bounded by VENUE_QUERY_TIMEOUT.
 
     Parameters
     ----------
-    key : str
-        The type of data (channel_data or comment_thread_data)
-    df : pd.DataFrame
-        The dataframe output by the transform function.
+    venue : str
+        The venue to scrape (ie; 'CPE')
+    user_id : str
+        The sso user id.
+    user_venue : Optional[UserVenue]
+        The venue row and credentials, if the caller already fetched them.
+
+    Returns
+    -------
+    Tuple[Optional[MemberInfo], VenueStatus]
+        The scraped information (None on failure) and the outcome of the
+        scrape.
+    """
+    start = time.perf_counter()
+    member_info, status, error = None, "ok", None
+    try:
+        member_info = await asyncio.wait_for(
+            process_venue_query(venue, user_id, user_venue),
+            VENUE_QUERY_TIMEOUT,
+        )
+    except asyncio.TimeoutError:
+        status, error = "timeout", f"No response within {VENUE_QUERY_TIMEOUT}s"
+    except HTTPException as e:
+        # 503 means the scrape was not admitted; the client should retry
+        status = "busy" if e.status_code == 503 else "error"
+        error = e.detail
+    except Exception as e:
+        logger.exception(
+            "unexpected exception scraping venue",
+            extra={"user_id": user_id, "venue": venue},
+        )
+        status, error = "error", str(e)
+    venue_status = VenueStatus(
+        venue=venue,
+        status=status,
+        elapsed=time.perf_counter() - start,
+        error=error,
+    )
+    return member_info, venue_status
+
+
+class UserInfoPlan:
+    """
+    The venues of a /get-user-info/ request: which are answered from
+    snapshots, which must be scraped and which are not supported.
     """
-    global KV_STORE
-    print(f"IN store_results {key}")
-    KV_STORE[key] = data
 
-def extract_cpe_info() -> Generator[Tuple[ChainType, MemberInfo], None, None]:
+    def __init__(
+        self,
+        user_venues: Dict[str, UserVenue],
+        snapshots: Dict[str, MemberInfo],
+    ):
+        self.user_venues = user_venues
+        self.snapshots = snapshots
+        self.venues = list(user_venues)
+        self.live_venues = [
+            venue
+            for venue in self.venues
+            if venue in VENUE_ADAPTERS and venue not in snapshots
+        ]
+
+    def snapshot_results(self) -> List[Tuple[MemberInfo, VenueStatus]]:
+        return [
+            (
+                self.snapshots[venue],
+                VenueStatus(venue=venue, status="snapshot", elapsed=0.0),
+            )
+            for venue in self.venues
+            if venue in self.snapshots
+        ]
+
+    def unsupported_status(self) -> List[VenueStatus]:
+        return [
+            VenueStatus(venue=venue, status="unsupported", elapsed=0.0)
+            for venue in self.venues
+            if venue not in VENUE_ADAPTERS
+        ]
+
+
+async def plan_user_info(query: InfoQuery) -> UserInfoPlan:
     """
-    Search for videos that match a query string.
+    Look up a user's venues and, unless a refresh is forced, their stored
+    snapshots. Snapshots older than the refresh scheduler would let them
+    get, which it has missed or is not running to renew, are scraped again
+    instead of served.
 
     Parameters
     ----------
-    query : str
-        The query string used in the "q" parameter.
+    query : InfoQuery
+        The /get-user-info/ request.
 
-    Yields
-    ------
-    Generator[list[tuple[str, str]], None, None]
-        A list of tuple pairs (video_id, channel_id)
+    Returns
+    -------
+    UserInfoPlan
+        The venues to answer and how.
     """
-    cpe_info = process_cpe_info_query(PARAM_DICT['user_id'])
-    yield (ChainType.CPE_DATA, cpe_info)
+    user_id = query.user_id
+    db = Database()
+    user_venues = {
+        row.venue_info.venue: row
+        for row in await run_in_threadpool(db.get_user_venue_plan, user_id)
+        if row.user_info is not None
+    }
+    snapshots = {}
+    if not query.force_refresh:
+        snapshots = {
+            member_info.venue: member_info
+            for member_info in await run_in_threadpool(
+                db.get_member_snapshots, user_id
+            )
+            if member_info.cache_age
+            <= REFRESH_SCHEDULER.max_age(member_info.venue)
+        }
+    plan = UserInfoPlan(user_venues, snapshots)
+    if query.force_refresh:
+        for venue in plan.live_venues:
+            MEMBER_INFO_CACHE.invalidate(user_id, venue)
+    return plan
 
-def extract_bha_info() -> Generator[Tuple[ChainType, MemberInfo], None, None]:
+
+# Snapshot writes still running. The event loop only keeps weak references
+# to tasks, so a write nobody holds on to could be collected mid-flight.
+SNAPSHOT_WRITES: Set["asyncio.Task[None]"] = set()
+
+
+async def write_snapshot(user_id: str, member_info: MemberInfo):
+    """
+    Store freshly scraped member info as the user's snapshot, logging any
+    failure since no request waits for the result.
+    """
+    try:
+        await run_in_threadpool(
+            Database().save_member_snapshot, user_id, member_info
+        )
+    except Exception as e:
+        logger.error(
+            "could not save snapshot",
+            extra={
+                "user_id": user_id,
+                "venue": member_info.venue,
+                "error": str(e),
+            },
+        )
+
+
+def save_snapshot(user_id: str, member_info: Optional[MemberInfo]):
+    """
+    Store freshly scraped member info as the user's snapshot in the
+    background, and tell the refresh scheduler it is fresh.
+    """
+    if member_info is not None and not member_info.from_cache:
+        REFRESH_SCHEDULER.refreshed(user_id, member_info.venue)
+        task = asyncio.create_task(write_snapshot(user_id, member_info))
+        SNAPSHOT_WRITES.add(task)
+        task.add_done_callback(SNAPSHOT_WRITES.discard)
+
+
+@app.post("/get-user-info/", response_model=UserInfoResponse)
+async def get_user_info(
+    query: InfoQuery,
+    request: Request,
+    current_user: str = Depends(get_current_user),
+) -> Response:
+    check_user(current_user, query.user_id)
+    user_id: str = query.user_id
+    plan = await plan_user_info(query)
+    results = await asyncio.gather(
+        *[
+            query_venue(venue, user_id, plan.user_venues[venue])
+            for venue in plan.live_venues
+        ]
+    )
+    for member_info, _ in results:
+        save_snapshot(user_id, member_info)
+
+    results = plan.snapshot_results() + list(results)
+    response = UserInfoResponse(
+        member_info=[info for info, _ in results if info is not None],
+        venue_status=[status for _, status in results]
+        + plan.unsupported_status(),
+    )
+    # Timings, the snapshot/live source and the order venues finished in do
+    # not change what is shown
+    etag = make_etag(
+        sorted(member_info_digest(info) for info in response.member_info)
+        + sorted(f"{item.venue}:{item.error}" for item in response.venue_status)
+    )
+    return conditional_response(
+        request,
+        "get-user-info",
+        etag,
+        lambda: response.model_dump_json().encode(),
+    )
+
+
+async def stream_user_info(
+    user_id: str, plan: UserInfoPlan
+) -> AsyncIterator[bytes]:
     """
-    Search for videos that match a query string.
+    Yield one NDJSON 'venue' event per venue as soon as it is ready, then a
+    'summary' event with the status of every venue.
 
     Parameters
     ----------
-    query : str
-        The query string used in the "q" parameter.
+    user_id : str
+        The sso user id.
+    plan : UserInfoPlan
+        The user's venues.
 
     Yields
     ------
-    Generator[list[tuple[str, str]], None, None]
-        A list of tuple pairs (video_id, channel_id)
+    bytes
+        A UserInfoEvent as a line of JSON.
     """
-    bha_info = process_bha_info_query(PARAM_DICT['user_id'])
-    yield (ChainType.BHA_DATA, bha_info)
-
-@app.post("/get-user-info/")
-def get_user_info(
-    query: InfoQuery, token: str = Depends(oauth2_scheme)
-) -> List[MemberInfo]:
-    global KV_STORE
-    member_info_list = []
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = query.user_id
-        sub = payload.get("sub")
-        if sub is None:
-            raise HTTPException(status_code=401, detail="Invalid credentials")
-        
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid credentials")
-    db = Database()
-    user_info_list = db.get_user_venues(user_id)
-    
-    
-    graph = bonobo.Graph()
-    graph.add_chain(store_results, _input=None)
-
-    venues = [user_info.venue for user_info in user_info_list]
-    PARAM_DICT['user_id'] = user_id
-    if 'CPE' in venues:
-        graph.add_chain(
-            extract_cpe_info,
-            store_results,
+    start = time.perf_counter()
+    venue_status = []
+
+    def event(**kwargs) -> bytes:
+        return UserInfoEvent(**kwargs).model_dump_json().encode() + b"\n"
+
+    for snapshot_info, snapshot_status in plan.snapshot_results():
+        venue_status.append(snapshot_status)
+        yield event(
+            event="venue",
+            member_info=snapshot_info,
+            venue_status=[snapshot_status],
         )
-    if 'BHA' in venues:
-        graph.add_chain(
-            extract_bha_info,
-            store_results,
+
+    tasks = [
+        asyncio.ensure_future(
+            query_venue(venue, user_id, plan.user_venues[venue])
         )
-    bonobo.run(graph)
+        for venue in plan.live_venues
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            member_info, live_status = await next_done
+            save_snapshot(user_id, member_info)
+            venue_status.append(live_status)
+            yield event(
+                event="venue",
+                member_info=member_info,
+                venue_status=[live_status],
+            )
+    finally:
+        # The client went away; stop scraping for it
+        for task in tasks:
+            task.cancel()
+
+    yield event(
+        event="summary",
+        venue_status=venue_status + plan.unsupported_status(),
+        elapsed=time.perf_counter() - start,
+    )
+
+
+@app.post("/get-user-info-stream/")
+async def get_user_info_stream(
+    query: InfoQuery, current_user: str = Depends(get_current_user)
+) -> StreamingResponse:
+    """
+    Like /get-user-info/, but streams newline delimited JSON so the first
+    venue can be shown without waiting for the slowest.
+    """
+    check_user(current_user, query.user_id)
+    plan = await plan_user_info(query)
+    return StreamingResponse(
+        stream_user_info(query.user_id, plan),
+        media_type="application/x-ndjson",
+    )
+
+
+async def refresh_snapshot(user_id: str, venue: str):
+    """
+    Scrape a venue for a user and store the result as the user's snapshot.
+    Called by the background refresh scheduler.
+
+    Parameters
+    ----------
+    user_id : str
+        The sso user id.
+    venue : str
+        The venue to scrape (ie; 'CPE')
+    """
+    if venue not in VENUE_ADAPTERS:
+        return
+    MEMBER_INFO_CACHE.invalidate(user_id, venue)
+    member_info = await process_venue_query(venue, user_id)
+    await run_in_threadpool(
+        lambda: Database().save_member_snapshot(user_id, member_info)
+    )
+
+
+REFRESH_SCHEDULER = RefreshScheduler(refresh_snapshot)
+
+REGISTRY.register(
+    Stats(
+        "dogsports_db_pool",
+        "Database connection pool",
+        lambda: get_pool().stats(),
+    )
+)
+REGISTRY.register(
+    Stats(
+        "dogsports_password_hasher",
+        "Password hashing pool",
+        PASSWORD_HASHER.stats,
+    )
+)
+REGISTRY.register(
+    Stats("dogsports_browser_pool", "Browser pool", BROWSER_POOL.stats)
+)
+REGISTRY.register(
+    Stats(
+        "dogsports_scrape_admission",
+        "Browser scrape admission",
+        SCRAPE_ADMISSION.stats,
+    )
+)
 
-    for k, v in KV_STORE.items():
-        member_info_list.append(v)
-    
-    KV_STORE = {}
-    return member_info_list
 
-if __name__ == "__main__":
-    query = InfoQuery(user_id="sdimig")
-    get_bha_info(query)
+@app.get("/metrics")
+def metrics() -> Response:
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
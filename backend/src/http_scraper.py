@@ -0,0 +1,499 @@
+"""
+This file contains the browserless extraction engine for BHA. The BHA member
+pages are plain PHP forms and tables that need no JavaScript, so they are
+fetched with a keep-alive HTTP connection and a cookie jar and read with an
+HTML parser, at a fraction of the memory and time of a Chromium page. The
+cookie jar converts to and from Playwright storage state, so both engines
+share the sessions kept in the session store.
+"""
+
+import http.client
+import os
+from datetime import datetime
+from html.parser import HTMLParser
+from http.client import HTTPConnection
+from http.cookiejar import Cookie, CookieJar
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urljoin, urlsplit
+from urllib.request import Request
+
+from fastapi import HTTPException
+from metrics import SCRAPE_STAGE_SECONDS
+from model import DogInfo, MemberInfo, VenuesTable, VenueUsersTable
+
+if TYPE_CHECKING:
+    from playwright.async_api import StorageState
+
+# Seconds to wait for each BHA response
+BHA_HTTP_TIMEOUT = float(os.environ.get("BHA_HTTP_TIMEOUT", "15"))
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) dog-sports-sso"
+
+# Fields read from your_profile.php
+BHA_PROFILE_FIELDS = (
+    "login_email",
+    "login_firstname",
+    "login_lastname",
+    "login_addr1",
+    "login_addr2",
+    "login_city",
+    "login_postal",
+    "login_phone",
+    "login_state",
+)
+
+# Columns read from the table.data on your_dogs.php
+BHA_DOG_COLUMNS = ("Barnhunt No", "Call Name", "Breed", "Height", "Birthdate")
+
+
+class ExtractionError(Exception):
+    """
+    Raised when a page does not look the way the lightweight engine expects,
+    so the caller can fall back to the browser.
+    """
+
+
+class PageParser(HTMLParser):
+    """
+    Collects the form fields, the submit button and the rows of the tables
+    with a given class from an HTML page.
+    """
+
+    def __init__(self, table_class: Optional[str] = None):
+        """
+        Constructor for the PageParser class.
+
+        Parameters
+        ----------
+        table_class : Optional[str]
+            Class of the tables whose rows are collected (ie; 'data')
+        """
+        super().__init__(convert_charrefs=True)
+        self.table_class = table_class
+        # name -> value of inputs and selects, first occurrence wins
+        self.fields: Dict[str, Optional[str]] = {}
+        self.hidden: Dict[str, str] = {}
+        self.submit: Optional[Tuple[str, str]] = None
+        self.form_action: Optional[str] = None
+        self.rows: List[List[str]] = []
+        self._select: Optional[str] = None
+        self._first_option: Optional[str] = None
+        self._option: Optional[Dict[str, Optional[str]]] = None
+        self._table_depth = 0
+        self._cell: Optional[List[str]] = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "form" and self.form_action is None:
+            self.form_action = attrs.get("action") or ""
+        elif tag == "input":
+            name = attrs.get("name")
+            kind = (attrs.get("type") or "text").lower()
+            if kind == "submit":
+                if name and self.submit is None:
+                    self.submit = (name, attrs.get("value") or "")
+            elif name and name not in self.fields:
+                self.fields[name] = attrs.get("value")
+                if kind == "hidden":
+                    self.hidden[name] = attrs.get("value") or ""
+        elif tag == "select":
+            self._select = attrs.get("name")
+            self._first_option = None
+        elif tag == "option" and self._select is not None:
+            self._option = {"value": attrs.get("value"), "text": ""}
+            if "selected" in attrs:
+                self._option["selected"] = "selected"
+        elif tag == "table":
+            classes = (attrs.get("class") or "").split()
+            if self._table_depth or self.table_class in classes:
+                self._table_depth += 1
+        elif self._table_depth:
+            if tag == "tr":
+                self.rows.append([])
+            elif tag == "td" and self.rows:
+                self._cell = []
+
+    def handle_endtag(self, tag):
+        if tag == "option" and self._option is not None:
+            option, self._option = self._option, None
+            value = option["value"]
+            if value is None:
+                value = option["text"].strip()
+            if self._first_option is None:
+                self._first_option = value
+            if option.get("selected") and self._select not in self.fields:
+                self.fields[self._select] = value
+        elif tag == "select" and self._select is not None:
+            if self._select not in self.fields:
+                self.fields[self._select] = self._first_option
+            self._select = None
+        elif tag == "table" and self._table_depth:
+            self._table_depth -= 1
+        elif tag == "td" and self._cell is not None:
+            self.rows[-1].append("".join(self._cell).strip())
+            self._cell = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+        if self._option is not None:
+            self._option["text"] += data
+
+
+class HttpSession:
+    """
+    A cookie-aware HTTP client that keeps one connection alive per host and
+    follows redirects.
+    """
+
+    def __init__(
+        self,
+        timeout: float = BHA_HTTP_TIMEOUT,
+        storage_state: Optional["StorageState"] = None,
+    ):
+        """
+        Constructor for the HttpSession class.
+
+        Parameters
+        ----------
+        timeout : float
+            Seconds to wait for each response.
+        storage_state : Optional[StorageState]
+            A stored session to resume, as returned by storage_state() or
+            BrowserContext.storage_state().
+        """
+        self.timeout = timeout
+        self.cookies = CookieJar()
+        # localStorage of a browser session, handed back untouched
+        self._origins: List[Any] = []
+        # (scheme, netloc) -> open connection
+        self._connections: Dict[Tuple[str, str], HTTPConnection] = {}
+        if storage_state is not None:
+            self._origins = storage_state.get("origins", [])
+            for cookie in storage_state.get("cookies", []):
+                domain = cookie["domain"]
+                # Session cookies report an expiry of -1
+                expires = cookie.get("expires", -1)
+                self.cookies.set_cookie(
+                    Cookie(
+                        version=0,
+                        name=cookie["name"],
+                        value=cookie["value"],
+                        port=None,
+                        port_specified=False,
+                        domain=domain,
+                        domain_specified=domain.startswith("."),
+                        domain_initial_dot=domain.startswith("."),
+                        path=cookie.get("path", "/"),
+                        path_specified=True,
+                        secure=cookie.get("secure", False),
+                        expires=int(expires) if expires > 0 else None,
+                        discard=expires <= 0,
+                        comment=None,
+                        comment_url=None,
+                        rest=({"HttpOnly": ""} if cookie.get("httpOnly") else {}),
+                    )
+                )
+
+    def storage_state(self) -> "StorageState":
+        """
+        Return the session in the form of BrowserContext.storage_state(), so
+        it can be stored and resumed by either engine.
+
+        Returns
+        -------
+        StorageState
+            The cookies and the localStorage the session was created with.
+        """
+        return {
+            "cookies": [
+                {
+                    "name": cookie.name,
+                    "value": cookie.value or "",
+                    "domain": cookie.domain,
+                    "path": cookie.path,
+                    "expires": (
+                        float(cookie.expires)
+                        if cookie.expires is not None
+                        else -1
+                    ),
+                    "httpOnly": cookie.has_nonstandard_attr("HttpOnly"),
+                    "secure": bool(cookie.secure),
+                    "sameSite": "Lax",
+                }
+                for cookie in self.cookies
+            ],
+            "origins": self._origins,
+        }
+
+    def _connection(self, scheme: str, netloc: str) -> HTTPConnection:
+        key = (scheme, netloc)
+        if key not in self._connections:
+            cls = (
+                http.client.HTTPSConnection
+                if scheme == "https"
+                else http.client.HTTPConnection
+            )
+            self._connections[key] = cls(netloc, timeout=self.timeout)
+        return self._connections[key]
+
+    def request(
+        self,
+        url: str,
+        form: Optional[Dict[str, str]] = None,
+        redirects: int = 5,
+    ) -> Tuple[str, str]:
+        """
+        GET a URL, or POST a form to it, following redirects.
+
+        Parameters
+        ----------
+        url : str
+            The absolute URL.
+        form : Optional[Dict[str, str]]
+            Form fields to POST, or None for a GET.
+        redirects : int
+            Maximum number of redirects to follow.
+
+        Returns
+        -------
+        Tuple[str, str]
+            The final URL and the decoded response body.
+
+        Raises
+        ------
+        ExtractionError
+            On a network error, an error status or too many redirects.
+        """
+        for _ in range(redirects + 1):
+            parts = urlsplit(url)
+            body = urlencode(form).encode() if form is not None else None
+            cookie_request = Request(url)
+            self.cookies.add_cookie_header(cookie_request)
+            headers = {"User-Agent": USER_AGENT, "Connection": "keep-alive"}
+            headers.update(cookie_request.unredirected_hdrs)
+            if body is not None:
+                headers["Content-Type"] = "application/x-www-form-urlencoded"
+            path = parts.path or "/"
+            if parts.query:
+                path += "?" + parts.query
+
+            method = "POST" if body is not None else "GET"
+            connection = self._connection(parts.scheme, parts.netloc)
+            try:
+                try:
+                    connection.request(method, path, body, headers)
+                    response = connection.getresponse()
+                except (
+                    http.client.RemoteDisconnected,
+                    ConnectionResetError,
+                    BrokenPipeError,
+                ):
+                    # The server may have closed the idle keep-alive
+                    # connection. Only a GET is safe to send again; a POST
+                    # such as the login may already have been acted on.
+                    connection.close()
+                    if body is not None:
+                        raise
+                    connection.request(method, path, body, headers)
+                    response = connection.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                # Timeouts, refused connections and broken responses leave
+                # the browser to try
+                connection.close()
+                raise ExtractionError(f"{method} {path} failed: {e!r}")
+            self.cookies.extract_cookies(response, cookie_request)
+
+            if response.status in (301, 302, 303, 307, 308):
+                url = urljoin(url, response.getheader("Location", ""))
+                if response.status in (301, 302, 303):
+                    form = None
+                continue
+            if response.status != 200:
+                raise ExtractionError(f"HTTP {response.status} from {path}")
+            charset = response.headers.get_content_charset() or "utf-8"
+            return url, data.decode(charset, errors="replace")
+        raise ExtractionError(f"Too many redirects from {url}")
+
+    def close(self):
+        for connection in self._connections.values():
+            connection.close()
+        self._connections.clear()
+
+
+def parse_page(html: str, table_class: Optional[str] = None) -> PageParser:
+    """
+    Parse an HTML page.
+
+    Parameters
+    ----------
+    html : str
+        The page source.
+    table_class : Optional[str]
+        Class of the tables whose rows are collected.
+
+    Returns
+    -------
+    PageParser
+        The parser holding the page's fields and table rows.
+    """
+    parser = PageParser(table_class)
+    parser.feed(html)
+    parser.close()
+    return parser
+
+
+def build_bha_member_info(
+    venue_info: VenuesTable,
+    profile: Dict[str, Optional[str]],
+    rows: List[List[str]],
+) -> MemberInfo:
+    """
+    Build the BHA MemberInfo from the profile form and the dog table. Shared
+    by the HTTP and the Playwright engines.
+
+    Parameters
+    ----------
+    venue_info : VenuesTable
+        The BHA row from the venues table.
+    profile : Dict[str, Optional[str]]
+        The values of BHA_PROFILE_FIELDS on your_profile.php.
+    rows : List[List[str]]
+        The cell texts of the dog table; the first row holds the column names.
+
+    Returns
+    -------
+    MemberInfo
+        The handler and dog information found on BHA.
+    """
+    columns = rows[0] if rows else []
+    dog_info = []
+    for cells in rows[1:]:
+        if not cells:
+            continue
+        row = dict(zip(columns, cells))
+        dog_info.append(
+            DogInfo(
+                dog_member_id=row["Barnhunt No"],
+                call_name=row["Call Name"],
+                breed=row["Breed"],
+                jump_height=int(float(row["Height"])),
+                dob=datetime.strptime(row["Birthdate"], "%m/%d/%Y"),
+            )
+        )
+
+    address = (
+        f"{profile['login_addr1']}\n{profile['login_addr2']}\n"
+        + f"{profile['login_city']}, {profile['login_state']} "
+        + f"{profile['login_postal']}"
+    )
+    return MemberInfo(
+        venue=venue_info.venue,
+        icon=venue_info.icon,
+        description=venue_info.description,
+        handler_member_id=profile["login_email"],
+        handler=f"{profile['login_firstname']} {profile['login_lastname']}",
+        phone=profile["login_phone"],
+        email=profile["login_email"],
+        address=address,
+        dog_info=dog_info,
+    )
+
+
+def scrape_bha_info_http(
+    session: HttpSession,
+    user_info: VenueUsersTable,
+    venue_info: VenuesTable,
+    resume: bool = False,
+) -> MemberInfo:
+    """
+    Log in to BHA and scrape the member profile and dog records without a
+    browser. Blocking; run it on a worker thread.
+
+    Parameters
+    ----------
+    session : HttpSession
+        The HTTP session to scrape with. It holds the BHA session cookies
+        afterwards.
+    user_info : VenueUsersTable
+        The user's BHA credentials.
+    venue_info : VenuesTable
+        The BHA row from the venues table.
+    resume : bool
+        True if the session was created from a stored session, in which case
+        the login form is skipped unless BHA rejects the session.
+
+    Returns
+    -------
+    MemberInfo
+        The handler and dog information found on BHA.
+
+    Raises
+    ------
+    HTTPException
+        With status 500 if BHA rejected the credentials.
+    ExtractionError
+        If BHA could not be reached or the login or either page did not look
+        as expected.
+    """
+    venue = venue_info.venue
+    base = venue_info.url.rstrip("/")
+    profile_url = f"{base}/register/your_profile.php"
+    fields = None
+    if resume:
+        with SCRAPE_STAGE_SECONDS.time(venue=venue, stage="http_profile"):
+            url, html = session.request(profile_url)
+            fields = parse_page(html).fields
+        if url.split("?")[0] != profile_url or "pass" in fields:
+            # The stored session expired: BHA redirected to, or showed, its
+            # login form. Log in afresh.
+            session.cookies.clear()
+            fields = None
+
+    if fields is None:
+        with SCRAPE_STAGE_SECONDS.time(venue=venue, stage="http_login"):
+            login_url, html = session.request(f"{base}/register/login.php")
+            login_form = parse_page(html)
+            if not {"user", "pass"} <= set(login_form.fields):
+                raise ExtractionError("No login form on login.php")
+            form = dict(login_form.hidden)
+            form["user"] = user_info.venue_user_id
+            form["pass"] = user_info.venue_password
+            if login_form.submit is not None:
+                form.setdefault(*login_form.submit)
+            url, _ = session.request(
+                urljoin(login_url, login_form.form_action or login_url), form
+            )
+            path = urlsplit(url).path
+            if path.endswith("/register/login.php"):
+                # Back on the login form: the credentials were rejected, and
+                # the browser would fare no better
+                detail = (
+                    "Processing error for venue=BHA and "
+                    + f"user={user_info.venue_user_id}"
+                )
+                raise HTTPException(status_code=500, detail=detail)
+            if not path.endswith("/register/barn_hunt_dog_register.php"):
+                raise ExtractionError(f"Unexpected page after login: {path}")
+
+        with SCRAPE_STAGE_SECONDS.time(venue=venue, stage="http_profile"):
+            _, html = session.request(profile_url)
+            fields = parse_page(html).fields
+
+    missing = [name for name in BHA_PROFILE_FIELDS if name not in fields]
+    if missing:
+        raise ExtractionError(f"Profile fields missing: {missing}")
+    profile = {name: fields[name] for name in BHA_PROFILE_FIELDS}
+
+    with SCRAPE_STAGE_SECONDS.time(venue=venue, stage="http_table"):
+        _, html = session.request(f"{base}/register/your_dogs.php")
+        rows = parse_page(html, "data").rows
+        if not rows or not set(BHA_DOG_COLUMNS) <= set(rows[0]):
+            raise ExtractionError("No dog table on your_dogs.php")
+
+    with SCRAPE_STAGE_SECONDS.time(venue=venue, stage="http_model"):
+        try:
+            return build_bha_member_info(venue_info, profile, rows)
+        except (KeyError, ValueError) as e:
+            raise ExtractionError(f"Unexpected dog record: {e}")
@@ -0,0 +1,442 @@
+"""
+This file contains the network interception policy of the browser scrapes.
+The scrapers only read text and input values, so images, fonts, media and
+third-party hosts are aborted, and the static assets that remain are served
+from a disk cache shared by every scrape.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+from typing import TYPE_CHECKING, Dict, FrozenSet, Optional, Tuple
+from urllib.parse import urlsplit
+
+from fastapi.concurrency import run_in_threadpool
+from log import get_logger
+from metrics import SCRAPE_BYTES_TOTAL, SCRAPE_REQUESTS_TOTAL
+
+if TYPE_CHECKING:
+    from playwright.async_api import BrowserContext, Route
+
+logger = get_logger("intercept")
+
+# Response headers that no longer apply to a body replayed from the cache
+_HOP_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+
+
+def _venue_setting(name: str, venue: str, default: str) -> str:
+    """
+    Read a setting that may be overridden per venue, ie; SCRAPE_BLOCK_TYPES
+    or SCRAPE_BLOCK_TYPES_CPE.
+    """
+    return os.environ.get(f"{name}_{venue}", os.environ.get(name, default))
+
+
+def _split(value: str) -> FrozenSet[str]:
+    return frozenset(item.strip() for item in value.split(",") if item.strip())
+
+
+class InterceptPolicy:
+    """
+    What a venue's scrape may download.
+    """
+
+    def __init__(
+        self,
+        block_types: FrozenSet[str],
+        cache_types: FrozenSet[str],
+        allow_hosts: FrozenSet[str],
+        block_third_party: bool,
+        domain: Optional[str] = None,
+    ):
+        """
+        Constructor for the InterceptPolicy class.
+
+        Parameters
+        ----------
+        block_types : FrozenSet[str]
+            Playwright resource types that are aborted (ie; 'image')
+        cache_types : FrozenSet[str]
+            Resource types served through the disk cache (ie; 'stylesheet')
+        allow_hosts : FrozenSet[str]
+            Hosts outside the venue's domain that may still be contacted.
+        block_third_party : bool
+            True to abort subresources from hosts outside the venue's domain.
+        domain : Optional[str]
+            The venue's registrable domain (ie; 'barnhunt.com'), whose
+            subdomains are all first party. Defaults to the exact host of
+            the venue's URL.
+        """
+        self.block_types = block_types
+        self.cache_types = cache_types
+        self.allow_hosts = allow_hosts
+        self.block_third_party = block_third_party
+        self.domain = domain
+
+    @classmethod
+    def for_venue(cls, venue: str) -> "InterceptPolicy":
+        """
+        Build a venue's policy from the environment.
+
+        Each setting can be given for all venues or for one venue by adding
+        the venue as a suffix (ie; SCRAPE_BLOCK_TYPES_CPE).
+
+        SCRAPE_BLOCK_TYPES defaults to 'image,media,font,manifest,texttrack'.
+        SCRAPE_CACHE_TYPES defaults to 'stylesheet,script'.
+        SCRAPE_ALLOW_HOSTS defaults to no extra hosts.
+        SCRAPE_BLOCK_THIRD_PARTY defaults to 'true'.
+        SCRAPE_FIRST_PARTY_DOMAIN defaults to the host of the venue's URL.
+
+        Parameters
+        ----------
+        venue : str
+            The venue (ie; 'CPE')
+
+        Returns
+        -------
+        InterceptPolicy
+            The venue's policy.
+        """
+        return cls(
+            block_types=_split(
+                _venue_setting(
+                    "SCRAPE_BLOCK_TYPES",
+                    venue,
+                    "image,media,font,manifest,texttrack",
+                )
+            ),
+            cache_types=_split(
+                _venue_setting("SCRAPE_CACHE_TYPES", venue, "stylesheet,script")
+            ),
+            allow_hosts=_split(_venue_setting("SCRAPE_ALLOW_HOSTS", venue, "")),
+            block_third_party=_venue_setting(
+                "SCRAPE_BLOCK_THIRD_PARTY", venue, "true"
+            ).lower()
+            == "true",
+            domain=_venue_setting("SCRAPE_FIRST_PARTY_DOMAIN", venue, "") or None,
+        )
+
+
+class AssetCache:
+    """
+    A disk cache of static asset responses shared by all scrapes and worker
+    processes. Each entry is a body file and a JSON metadata file named after
+    the hash of the URL.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        ttl: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+    ):
+        """
+        Constructor for the AssetCache class.
+
+        Parameters
+        ----------
+        directory : Optional[str]
+            Where entries are stored. Defaults to the SCRAPE_ASSET_CACHE_DIR
+            environment variable or dog-sports-sso-assets in the temp dir.
+        ttl : Optional[float]
+            Seconds an entry is kept when the response has no max-age.
+            Defaults to the SCRAPE_ASSET_CACHE_TTL environment variable or
+            86400.
+        max_bytes : Optional[int]
+            Size above which the oldest entries are removed. Defaults to the
+            SCRAPE_ASSET_CACHE_MAX_BYTES environment variable or 100 MB.
+        """
+        self.directory = directory or os.environ.get(
+            "SCRAPE_ASSET_CACHE_DIR",
+            os.path.join(tempfile.gettempdir(), "dog-sports-sso-assets"),
+        )
+        self.ttl = ttl or float(os.environ.get("SCRAPE_ASSET_CACHE_TTL", "86400"))
+        self.max_bytes = max_bytes or int(
+            os.environ.get("SCRAPE_ASSET_CACHE_MAX_BYTES", str(100 * 2**20))
+        )
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, url: str) -> str:
+        return os.path.join(
+            self.directory, hashlib.sha256(url.encode()).hexdigest()
+        )
+
+    def get(self, url: str) -> Optional[Tuple[int, Dict[str, str], bytes]]:
+        """
+        Return a cached response.
+
+        Parameters
+        ----------
+        url : str
+            The asset URL.
+
+        Returns
+        -------
+        Optional[Tuple[int, Dict[str, str], bytes]]
+            The status, headers and body, or None if there is no fresh entry.
+        """
+        path = self._path(url)
+        try:
+            with open(path + ".json") as f:
+                meta = json.load(f)
+            if meta["expires"] <= time.time():
+                return None
+            with open(path, "rb") as f:
+                return meta["status"], meta["headers"], f.read()
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(
+        self, url: str, status: int, headers: Dict[str, str], body: bytes
+    ) -> bool:
+        """
+        Store a response if its headers allow it.
+
+        Parameters
+        ----------
+        url : str
+            The asset URL.
+        status : int
+            The response status.
+        headers : Dict[str, str]
+            The response headers, with lower case names.
+        body : bytes
+            The decoded response body.
+
+        Returns
+        -------
+        bool
+            True if the response was stored.
+        """
+        cache_control = headers.get("cache-control", "").lower()
+        if (
+            status != 200
+            or "set-cookie" in headers
+            or "no-store" in cache_control
+            or "private" in cache_control
+        ):
+            return False
+        ttl = self.ttl
+        for directive in cache_control.split(","):
+            name, _, value = directive.strip().partition("=")
+            if name == "max-age" and value.isdigit():
+                ttl = float(value)
+        if ttl <= 0:
+            return False
+
+        path = self._path(url)
+        meta = {
+            "url": url,
+            "status": status,
+            "expires": time.time() + ttl,
+            "headers": {
+                name: value
+                for name, value in headers.items()
+                if name not in _HOP_HEADERS
+            },
+        }
+        try:
+            # Write then rename, so concurrent readers never see half an entry.
+            # Every writer gets its own temp file; scrapes of one process
+            # store assets from several threads at once.
+            for suffix, data in (
+                ("", body),
+                (".json", json.dumps(meta).encode()),
+            ):
+                with tempfile.NamedTemporaryFile(
+                    dir=self.directory, suffix=".tmp", delete=False
+                ) as f:
+                    tmp = f.name
+                    try:
+                        f.write(data)
+                    except OSError:
+                        f.close()
+                        os.remove(tmp)
+                        raise
+                os.replace(tmp, path + suffix)
+            self._evict()
+        except OSError as e:
+            logger.warning(
+                "could not store asset", extra={"url": url, "error": str(e)}
+            )
+            return False
+        return True
+
+    def _evict(self):
+        """
+        Remove the oldest entries while the cache is over max_bytes.
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json") or entry.name.endswith(".tmp"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for name in (path, path + ".json"):
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
+            total -= size
+
+
+_ASSET_CACHE: Optional[AssetCache] = None
+
+
+def get_asset_cache() -> AssetCache:
+    """
+    Return the process wide asset cache, creating it on first use.
+    """
+    global _ASSET_CACHE
+    if _ASSET_CACHE is None:
+        _ASSET_CACHE = AssetCache()
+    return _ASSET_CACHE
+
+
+class ScrapeInterceptor:
+    """
+    Applies a venue's InterceptPolicy to every request of a browser context
+    and keeps the tally of one scrape.
+    """
+
+    def __init__(
+        self,
+        venue: str,
+        venue_url: str,
+        policy: Optional[InterceptPolicy] = None,
+        cache: Optional[AssetCache] = None,
+    ):
+        """
+        Constructor for the ScrapeInterceptor class.
+
+        Parameters
+        ----------
+        venue : str
+            The venue (ie; 'CPE')
+        venue_url : str
+            The venue's base URL; its host is the first party unless the
+            policy names the venue's domain.
+        policy : Optional[InterceptPolicy]
+            Defaults to the venue's policy from the environment.
+        cache : Optional[AssetCache]
+            Defaults to the process wide asset cache.
+        """
+        self.venue = venue
+        self.policy = policy or InterceptPolicy.for_venue(venue)
+        # The last two labels of a host are not its registrable domain on
+        # hosts like www.example.co.uk, so sibling subdomains are only
+        # allowed when the policy names the domain
+        self.domain = (
+            self.policy.domain or urlsplit(venue_url).hostname or ""
+        ).lower()
+        self.cache = cache or get_asset_cache()
+        self.stats = {
+            "blocked": 0,
+            "cached": 0,
+            "fetched": 0,
+            "passed": 0,
+            "bytes_cached": 0,
+            "bytes_fetched": 0,
+        }
+
+    def _first_party(self, host: str) -> bool:
+        return (
+            host == self.domain
+            or host.endswith("." + self.domain)
+            or host in self.policy.allow_hosts
+        )
+
+    async def install(self, context: "BrowserContext"):
+        """
+        Start intercepting the requests of a browser context.
+
+        Parameters
+        ----------
+        context : BrowserContext
+            The context the scrape runs in.
+        """
+        await context.route("**/*", self._handle)
+
+    async def _handle(self, route: "Route"):
+        from playwright.async_api import Error
+
+        request = route.request
+        kind = request.resource_type
+        host = urlsplit(request.url).hostname or ""
+        # Never block navigations; a login may pass through another host
+        if kind != "document" and (
+            kind in self.policy.block_types
+            or (self.policy.block_third_party and not self._first_party(host))
+        ):
+            self.stats["blocked"] += 1
+            await route.abort("blockedbyclient")
+            return
+
+        if kind not in self.policy.cache_types or request.method != "GET":
+            self.stats["passed"] += 1
+            await route.continue_()
+            return
+
+        cached = await run_in_threadpool(self.cache.get, request.url)
+        if cached is not None:
+            status, headers, body = cached
+            self.stats["cached"] += 1
+            self.stats["bytes_cached"] += len(body)
+            await route.fulfill(status=status, headers=headers, body=body)
+            return
+
+        try:
+            response = await route.fetch()
+            body = await response.body()
+        except Error:
+            self.stats["blocked"] += 1
+            await route.abort("failed")
+            return
+        self.stats["fetched"] += 1
+        self.stats["bytes_fetched"] += len(body)
+        await run_in_threadpool(
+            self.cache.put,
+            request.url,
+            response.status,
+            response.headers,
+            body,
+        )
+        await route.fulfill(response=response, body=body)
+
+    def report(self) -> Dict[str, int]:
+        """
+        Record the scrape's tally in the metrics and the log.
+
+        Returns
+        -------
+        Dict[str, int]
+            Requests blocked, served from the cache, fetched for the cache and
+            passed through, and the bytes served from the cache (saved) and
+            fetched.
+        """
+        for action in ("blocked", "cached", "fetched", "passed"):
+            if self.stats[action]:
+                SCRAPE_REQUESTS_TOTAL.inc(
+                    self.stats[action], venue=self.venue, action=action
+                )
+        SCRAPE_BYTES_TOTAL.inc(
+            self.stats["bytes_cached"], venue=self.venue, source="cache"
+        )
+        SCRAPE_BYTES_TOTAL.inc(
+            self.stats["bytes_fetched"], venue=self.venue, source="network"
+        )
+        logger.debug(
+            "scrape network summary",
+            extra=dict(self.stats, venue=self.venue),
+        )
+        return dict(self.stats)
@@ -0,0 +1,211 @@
+"""
+This file contains the logging setup for the backend: JSON lines written by a
+background thread, with per-module levels, sampling of chatty records and
+redaction of credentials.
+"""
+
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from typing import Dict, Optional
+
+# Attributes every LogRecord has; anything else was passed through extra=
+_RECORD_ATTRIBUTES = set(
+    logging.LogRecord("", 0, "", 0, "", None, None).__dict__
+) | {"message", "asctime", "taskName"}
+
+# Substrings of field names whose values never reach the log
+_SENSITIVE = ("password", "secret", "token", "storage_state")
+
+_LISTENER: Optional[logging.handlers.QueueListener] = None
+
+
+def parse_levels(value: str) -> Dict[str, str]:
+    """
+    Parse per-module settings.
+
+    Parameters
+    ----------
+    value : str
+        Comma separated module=setting pairs (ie; 'db=DEBUG,scraper=WARNING')
+
+    Returns
+    -------
+    Dict[str, str]
+        The setting keyed by module name.
+    """
+    settings = {}
+    for item in value.split(","):
+        if "=" in item:
+            module, setting = item.split("=", 1)
+            settings[module.strip()] = setting.strip()
+    return settings
+
+
+def redact(fields: dict) -> dict:
+    """
+    Mask the values of credential-like fields.
+
+    Parameters
+    ----------
+    fields : dict
+        Structured fields of a log record.
+
+    Returns
+    -------
+    dict
+        The fields with sensitive values replaced by '***'.
+    """
+    return {
+        key: "***" if any(word in key.lower() for word in _SENSITIVE) else value
+        for key, value in fields.items()
+    }
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through only a fraction of the records below WARNING for the
+    configured modules. Warnings and errors are always kept.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        """
+        Constructor for the SamplingFilter class.
+
+        Parameters
+        ----------
+        rates : Dict[str, float]
+            Fraction of records kept, keyed by module name.
+        """
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.name.rpartition(".")[2])
+        return rate is None or random.random() < rate
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that keeps the extra= fields and the traceback of a record
+    instead of flattening everything into the message.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object per line, including any fields passed
+    with extra=.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(
+            redact(
+                {
+                    key: value
+                    for key, value in record.__dict__.items()
+                    if key not in _RECORD_ATTRIBUTES
+                }
+            )
+        )
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(
+    level: Optional[str] = None,
+    levels: Optional[Dict[str, str]] = None,
+    sample_rates: Optional[Dict[str, float]] = None,
+):
+    """
+    Route the backend's loggers through a queue to a background thread that
+    writes JSON lines to stdout. Calling it again has no effect.
+
+    Parameters
+    ----------
+    level : Optional[str]
+        Default level. Defaults to the LOG_LEVEL environment variable or INFO.
+    levels : Optional[Dict[str, str]]
+        Per-module levels. Defaults to the LOG_LEVELS environment variable
+        (ie; 'db=DEBUG,scraper=WARNING').
+    sample_rates : Optional[Dict[str, float]]
+        Fraction of debug and info records kept per module. Defaults to the
+        LOG_SAMPLE_RATES environment variable (ie; 'db=0.01').
+    """
+    global _LISTENER
+    if _LISTENER is not None:
+        return
+    level = level or os.environ.get("LOG_LEVEL", "INFO")
+    levels = levels or parse_levels(os.environ.get("LOG_LEVELS", ""))
+    sample_rates = sample_rates or {
+        module: float(rate)
+        for module, rate in parse_levels(
+            os.environ.get("LOG_SAMPLE_RATES", "")
+        ).items()
+    }
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    _LISTENER = logging.handlers.QueueListener(
+        queue.SimpleQueue(), handler, respect_handler_level=True
+    )
+    queue_handler = _QueueHandler(_LISTENER.queue)
+    queue_handler.addFilter(SamplingFilter(sample_rates))
+
+    root = logging.getLogger("dogsports")
+    root.setLevel(level.upper())
+    root.handlers = [queue_handler]
+    root.propagate = False
+    for module, module_level in levels.items():
+        get_logger(module).setLevel(module_level.upper())
+    _LISTENER.start()
+
+
+def shutdown_logging():
+    """
+    Flush queued records and stop the background writer.
+    """
+    global _LISTENER
+    if _LISTENER is not None:
+        _LISTENER.stop()
+        _LISTENER = None
+
+
+def get_logger(module: str) -> logging.Logger:
+    """
+    Return the logger for a backend module.
+
+    Parameters
+    ----------
+    module : str
+        The module name (ie; 'db')
+
+    Returns
+    -------
+    logging.Logger
+        A child of the 'dogsports' logger.
+    """
+    return logging.getLogger(f"dogsports.{module}")
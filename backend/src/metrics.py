@@ -0,0 +1,486 @@
+"""
+This file contains a minimal Prometheus instrumentation layer: counters,
+latency histograms and exported stats, rendered in the Prometheus text
+exposition format for the /metrics endpoint.
+"""
+
+import abc
+import functools
+import inspect
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+# Latency buckets in seconds, from a cached lookup up to a slow scrape
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+
+
+def outcome_of(exc: Optional[BaseException]) -> str:
+    """
+    Name the outcome of an operation for the 'outcome' label.
+
+    Parameters
+    ----------
+    exc : Optional[BaseException]
+        The exception the operation raised, if any.
+
+    Returns
+    -------
+    str
+        'ok', the HTTP status of an HTTPException, or the exception class
+        name (ie; 'TimeoutError').
+    """
+    if exc is None:
+        return "ok"
+    status_code = getattr(exc, "status_code", None)
+    if status_code is not None:
+        return str(status_code)
+    return type(exc).__name__
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class _Metric(abc.ABC):
+    """
+    Base class of the labelled metrics.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        """
+        Constructor for the metric classes.
+
+        Parameters
+        ----------
+        name : str
+            The metric name (ie; 'dogsports_db_query_seconds')
+        help : str
+            One line description shown by Prometheus.
+        labelnames : Sequence[str]
+            Names of the labels every observation must supply.
+        """
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abc.abstractmethod
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """
+        Return the metric's current samples.
+
+        Returns
+        -------
+        List[Tuple[str, str, float]]
+            (sample name, formatted labels, value) triples.
+        """
+
+    def render(self) -> List[str]:
+        """
+        Render the metric in the Prometheus text format.
+
+        Returns
+        -------
+        List[str]
+            The HELP, TYPE and sample lines.
+        """
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    """
+    A monotonically increasing count per label set.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        """
+        Add to the count for a label set.
+
+        Parameters
+        ----------
+        amount : float
+            How much to add.
+        **labels
+            A value for each label name.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            values = dict(self._values)
+        return [
+            (self.name, _format_labels(self.labelnames, key), value)
+            for key, value in values.items()
+        ]
+
+
+class Histogram(_Metric):
+    """
+    A distribution of observed values, usually durations in seconds, per
+    label set.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (per-bucket counts, sum, count)
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels):
+        """
+        Record one observation.
+
+        Parameters
+        ----------
+        value : float
+            The observed value.
+        **labels
+            A value for each label name.
+        """
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(
+                key, ([0] * len(self.buckets), 0.0, 0)
+            )
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def time(self, **labels) -> "_Timer":
+        """
+        Time a block or a function.
+
+        If the histogram has an 'outcome' label it is filled in from how the
+        block ended; see outcome_of.
+
+        Parameters
+        ----------
+        **labels
+            A value for each label name other than 'outcome'.
+
+        Returns
+        -------
+        _Timer
+            Usable as a context manager or as a decorator of plain and async
+            functions.
+        """
+        return _Timer(self, labels)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            values = {
+                key: (list(counts), total, count)
+                for key, (counts, total, count) in self._values.items()
+            }
+        samples: List[Tuple[str, str, float]] = []
+        names = self.labelnames + ("le",)
+        for key, (counts, total, count) in values.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                samples.append(
+                    (
+                        f"{self.name}_bucket",
+                        _format_labels(names, key + (repr(float(bound)),)),
+                        bucket_count,
+                    )
+                )
+            samples.append(
+                (
+                    f"{self.name}_bucket",
+                    _format_labels(names, key + ("+Inf",)),
+                    count,
+                )
+            )
+            labels = _format_labels(self.labelnames, key)
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+class _Timer:
+    """
+    Observes the wall time of a block or function on a histogram.
+    """
+
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def _observe(self, start: float, exc: Optional[BaseException]):
+        labels = dict(self.labels)
+        if "outcome" in self.histogram.labelnames:
+            labels["outcome"] = outcome_of(exc)
+        self.histogram.observe(time.perf_counter() - start, **labels)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._observe(self._start, exc)
+        return False
+
+    def __call__(self, fn: Callable) -> Callable:
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    result = await fn(*args, **kwargs)
+                except BaseException as e:
+                    self._observe(start, e)
+                    raise
+                self._observe(start, None)
+                return result
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                self._observe(start, e)
+                raise
+            self._observe(start, None)
+            return result
+
+        return wrapper
+
+
+class Stats:
+    """
+    Exports the numeric values of a component's stats() dictionary as
+    gauges named <prefix>_<key>.
+    """
+
+    def __init__(self, prefix: str, help: str, stats: Callable[[], dict]):
+        """
+        Constructor for the Stats class.
+
+        Parameters
+        ----------
+        prefix : str
+            Prefix of the gauge names (ie; 'dogsports_db_pool')
+        help : str
+            One line description of the component.
+        stats : Callable[[], dict]
+            Returns the component's current stats.
+        """
+        self.prefix = prefix
+        self.help = help
+        self.stats = stats
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, value in self.stats().items():
+            if isinstance(value, (list, tuple)):
+                value = sum(value)
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = f"{self.prefix}_{key}"
+            lines += [
+                f"# HELP {name} {self.help}: {key}",
+                f"# TYPE {name} gauge",
+                f"{name} {value}",
+            ]
+        return lines
+
+
+class Registry:
+    """
+    The set of metrics rendered by /metrics.
+    """
+
+    def __init__(self):
+        self._metrics: list = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """
+        Add a metric to the registry.
+
+        Parameters
+        ----------
+        metric : Counter, Histogram or Stats
+            The metric to expose.
+
+        Returns
+        -------
+        Counter, Histogram or Stats
+            The metric, so a definition can be registered in one line.
+        """
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Render every registered metric.
+
+        Returns
+        -------
+        str
+            The Prometheus text exposition.
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Media type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+VENUE_QUERY_SECONDS = REGISTRY.register(
+    Histogram(
+        "dogsports_venue_query_seconds",
+        "Time to answer a venue query, from the cache or by scraping",
+        ["venue", "outcome"],
+    )
+)
+SCRAPE_STAGE_SECONDS = REGISTRY.register(
+    Histogram(
+        "dogsports_scrape_stage_seconds",
+        "Time spent in each stage of a venue scrape",
+        ["venue", "stage", "outcome"],
+    )
+)
+DB_QUERY_SECONDS = REGISTRY.register(
+    Histogram(
+        "dogsports_db_query_seconds",
+        "Time spent in each Database method",
+        ["method", "outcome"],
+    )
+)
+AUTH_REQUEST_SECONDS = REGISTRY.register(
+    Histogram(
+        "dogsports_auth_request_seconds",
+        "Time to serve each authentication endpoint",
+        ["endpoint", "outcome"],
+    )
+)
+CACHE_LOOKUPS_TOTAL = REGISTRY.register(
+    Counter(
+        "dogsports_member_info_cache_lookups_total",
+        "Member info cache lookups by result (hit, stale or miss)",
+        ["venue", "result"],
+    )
+)
+SCRAPE_FALLBACKS_TOTAL = REGISTRY.register(
+    Counter(
+        "dogsports_scrape_fallbacks_total",
+        "Scrapes the lightweight HTTP engine handed over to the browser",
+        ["venue"],
+    )
+)
+SCRAPE_REQUESTS_TOTAL = REGISTRY.register(
+    Counter(
+        "dogsports_scrape_requests_total",
+        "Browser requests of scrapes by interception action",
+        ["venue", "action"],
+    )
+)
+SCRAPE_BYTES_TOTAL = REGISTRY.register(
+    Counter(
+        "dogsports_scrape_bytes_total",
+        "Asset bytes of scrapes served from the disk cache or the network",
+        ["venue", "source"],
+    )
+)
+SCRAPE_FLIGHTS_TOTAL = REGISTRY.register(
+    Counter(
+        "dogsports_scrape_flights_total",
+        "Scrape requests that ran a scrape (executed) or joined one already "
+        + "in flight for the same user and venue (coalesced)",
+        ["venue", "result"],
+    )
+)
+SCRAPE_QUEUE_WAIT_SECONDS = REGISTRY.register(
+    Histogram(
+        "dogsports_scrape_queue_wait_seconds",
+        "Time browser scrapes waited for admission, apart from scrape time",
+        ["venue", "outcome"],
+    )
+)
+SCRAPE_ADMISSIONS_TOTAL = REGISTRY.register(
+    Counter(
+        "dogsports_scrape_admissions_total",
+        "Browser scrapes admitted, rejected on a full queue, or expired in it",
+        ["venue", "result"],
+    )
+)
+CONDITIONAL_RESPONSES_TOTAL = REGISTRY.register(
+    Counter(
+        "dogsports_conditional_responses_total",
+        "Responses answered 304 because the client's ETag still matched "
+        + "(not_modified), or sent in full (modified)",
+        ["endpoint", "result"],
+    )
+)
+MEMBER_CHANGES_TOTAL = REGISTRY.register(
+    Counter(
+        "dogsports_member_changes_total",
+        "Changes to member information found between scrapes",
+        ["venue", "change"],
+    )
+)
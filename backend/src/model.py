@@ -1,8 +1,8 @@
-from datetime import date
+from datetime import date, datetime
 from typing import List, Optional
 
-from pydantic import BaseModel
-from enum import Enum
+from pydantic import BaseModel, PrivateAttr
+
 
 class DogInfo(BaseModel):
     dog_member_id: str
@@ -22,10 +22,62 @@ class MemberInfo(BaseModel):
     phone: str
     email: str
     dog_info: List[DogInfo]
+    from_cache: bool = False
+    cache_age: float = 0.0
+    # Content digest for ETags; see conditional.member_info_digest
+    _digest: Optional[str] = PrivateAttr(default=None)
+
+
+class VenueStatus(BaseModel):
+    venue: str
+    status: str
+    elapsed: float
+    error: Optional[str] = None
+
+
+class UserInfoResponse(BaseModel):
+    member_info: List[MemberInfo]
+    venue_status: List[VenueStatus]
+
+
+class UserInfoEvent(BaseModel):
+    # 'venue' as each venue is ready, then one 'summary'
+    event: str
+    member_info: Optional[MemberInfo] = None
+    venue_status: List[VenueStatus]
+    elapsed: float = 0.0
+
+
+class MemberChange(BaseModel):
+    venue: str
+    # 'added', 'removed' or 'changed'
+    change: str
+    # None for handler fields
+    dog_member_id: Optional[str] = None
+    # None when a whole dog is added or removed; old/new then hold its JSON.
+    # With dog_member_id also None, 'removed' drops all of the venue's data.
+    field: Optional[str] = None
+    old: Optional[str] = None
+    new: Optional[str] = None
+    version: int = 0
+    changed_at: Optional[datetime] = None
+
+
+class MemberChangesResponse(BaseModel):
+    # The user's latest version, to pass as since on the next call
+    version: int
+    changes: List[MemberChange]
+
+
+class ChangesQuery(BaseModel):
+    user_id: str
+    since: int = 0
 
 
 class InfoQuery(BaseModel):
     user_id: str
+    force_refresh: bool = False
+
 
 class VenueQuery(BaseModel):
     user_id: str
@@ -36,7 +88,7 @@ class VenueUsersTable(BaseModel):
     user_id: str
     venue: str
     venue_user_id: Optional[str] = None
-    venue_password:Optional[str] = None
+    venue_password: Optional[str] = None
 
 
 class VenuesTable(BaseModel):
@@ -46,6 +98,11 @@ class VenuesTable(BaseModel):
     description: str
 
 
+class UserVenue(BaseModel):
+    venue_info: VenuesTable
+    user_info: Optional[VenueUsersTable] = None
+
+
 class UserInDB(BaseModel):
     username: str
     hashed_password: str
@@ -54,12 +111,3 @@ class UserInDB(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
-
-
-class ChainType(Enum):
-    """
-    Enumeration of graph chain types.
-    """
-
-    CPE_DATA = 1
-    BHA_DATA = 2
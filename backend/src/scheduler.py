@@ -0,0 +1,256 @@
+"""
+This file contains the background scheduler that keeps the member snapshot
+tables up to date, so dashboard requests do not have to scrape the venues.
+"""
+
+import asyncio
+import os
+import random
+import time
+from datetime import timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from common import parse_venue_values
+from db import Database
+from fastapi.concurrency import run_in_threadpool
+from log import get_logger
+
+SnapshotKey = Tuple[str, str]
+
+logger = get_logger("scheduler")
+
+
+class RefreshScheduler:
+    """
+    Periodically re-scrapes every (user_id, venue) in the venue_users table.
+
+    Each venue has its own refresh interval, and every refresh is pushed back
+    by a random jitter so the scrapes of a venue are spread out instead of
+    arriving at its site all at once. At most `concurrency` refreshes run at
+    the same time.
+    """
+
+    def __init__(
+        self,
+        refresh: Callable[[str, str], Awaitable[None]],
+        concurrency: Optional[int] = None,
+        default_interval: Optional[float] = None,
+        intervals: Optional[Dict[str, float]] = None,
+        jitter: Optional[float] = None,
+        tick: Optional[float] = None,
+    ):
+        """
+        Constructor for the RefreshScheduler class.
+
+        Parameters
+        ----------
+        refresh : Callable[[str, str], Awaitable[None]]
+            Called as refresh(user_id, venue) to scrape and store a snapshot.
+        concurrency : Optional[int]
+            Maximum refreshes in flight. Defaults to the
+            SNAPSHOT_REFRESH_CONCURRENCY environment variable or 2.
+        default_interval : Optional[float]
+            Seconds between refreshes of a venue without its own interval.
+            Defaults to the SNAPSHOT_REFRESH_INTERVAL environment variable or
+            21600.
+        intervals : Optional[Dict[str, float]]
+            Per-venue refresh intervals. Defaults to the
+            SNAPSHOT_REFRESH_INTERVALS environment variable (ie;
+            'CPE=21600,BHA=43200').
+        jitter : Optional[float]
+            Fraction of the interval added at random to each refresh time.
+            Defaults to the SNAPSHOT_REFRESH_JITTER environment variable or 0.1.
+        tick : Optional[float]
+            Seconds between checks for due refreshes. Defaults to the
+            SNAPSHOT_REFRESH_TICK environment variable or 60.
+        """
+        self.refresh = refresh
+        self.concurrency = concurrency or int(
+            os.environ.get("SNAPSHOT_REFRESH_CONCURRENCY", "2")
+        )
+        self.default_interval = default_interval or float(
+            os.environ.get("SNAPSHOT_REFRESH_INTERVAL", "21600")
+        )
+        self.intervals = intervals or parse_venue_values(
+            os.environ.get("SNAPSHOT_REFRESH_INTERVALS", "")
+        )
+        self.jitter = (
+            jitter
+            if jitter is not None
+            else float(os.environ.get("SNAPSHOT_REFRESH_JITTER", "0.1"))
+        )
+        self.tick = tick or float(os.environ.get("SNAPSHOT_REFRESH_TICK", "60"))
+        self._due: Dict[SnapshotKey, float] = {}
+        self._in_flight: Set[SnapshotKey] = set()
+        # Refresh tasks still running; the event loop only keeps weak
+        # references to tasks
+        self._tasks: Set["asyncio.Task[None]"] = set()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def interval(self, venue: str) -> float:
+        """
+        Return the seconds between refreshes of a venue.
+
+        Parameters
+        ----------
+        venue : str
+            The venue (ie; 'CPE')
+
+        Returns
+        -------
+        float
+            The venue's own interval, or the default one.
+        """
+        return self.intervals.get(venue, self.default_interval)
+
+    def max_age(self, venue: str) -> float:
+        """
+        Return how old a snapshot of a venue may get before the scheduler is
+        late refreshing it: the interval, its largest jitter and one tick.
+
+        Parameters
+        ----------
+        venue : str
+            The venue (ie; 'CPE')
+
+        Returns
+        -------
+        float
+            The age in seconds.
+        """
+        interval = self.interval(venue)
+        return interval * (1 + self.jitter) + self.tick
+
+    def refreshed(self, user_id: str, venue: str):
+        """
+        Push back the next refresh of a snapshot that was just stored from a
+        live scrape, so the scheduler does not scrape the venue again.
+
+        Parameters
+        ----------
+        user_id : str
+            The sso user id.
+        venue : str
+            The venue (ie; 'CPE')
+        """
+        key = (user_id, venue)
+        if key not in self._in_flight:
+            self._due[key] = self._next_due(venue, time.time())
+
+    def _next_due(self, venue: str, since: float) -> float:
+        """
+        Work out when a venue should next be refreshed.
+
+        Parameters
+        ----------
+        venue : str
+            The venue (ie; 'CPE')
+        since : float
+            Epoch seconds of the last refresh.
+
+        Returns
+        -------
+        float
+            Epoch seconds of the next refresh, including jitter.
+        """
+        interval = self.interval(venue)
+        return since + interval + random.uniform(0, interval * self.jitter)
+
+    def _load(self) -> Tuple[List[SnapshotKey], Dict[SnapshotKey, float]]:
+        """
+        Load the venue users and the age of their snapshots.
+
+        Returns
+        -------
+        Tuple[List[SnapshotKey], Dict[SnapshotKey, float]]
+            The (user_id, venue) keys and the epoch seconds each existing
+            snapshot was taken.
+        """
+        db = Database()
+        keys = db.get_all_venue_users()
+        times = {
+            key: refreshed_at.replace(tzinfo=timezone.utc).timestamp()
+            for key, refreshed_at in db.get_snapshot_times().items()
+        }
+        return keys, times
+
+    async def _refresh(self, key: SnapshotKey):
+        """
+        Refresh one snapshot and schedule the next refresh for it.
+
+        Parameters
+        ----------
+        key : SnapshotKey
+            The (user_id, venue) pair.
+        """
+        user_id, venue = key
+        assert self._slots is not None, "the scheduler has not started"
+        try:
+            async with self._slots:
+                await self.refresh(user_id, venue)
+        except Exception as e:
+            logger.error(
+                "snapshot refresh failed",
+                extra={"user_id": user_id, "venue": venue, "error": str(e)},
+            )
+        finally:
+            self._due[key] = self._next_due(venue, time.time())
+            self._in_flight.discard(key)
+
+    async def run_once(self):
+        """
+        Start a refresh for every snapshot that is due.
+        """
+        keys, times = await run_in_threadpool(self._load)
+        now = time.time()
+        for key in set(self._due) - set(keys):
+            del self._due[key]
+        for key in keys:
+            if key not in self._due:
+                if key in times:
+                    self._due[key] = self._next_due(key[1], times[key])
+                else:
+                    # Never scraped; stagger the first refreshes
+                    interval = self.interval(key[1])
+                    self._due[key] = now + random.uniform(
+                        0, interval * self.jitter
+                    )
+            if self._due[key] <= now and key not in self._in_flight:
+                self._in_flight.add(key)
+                task = asyncio.create_task(self._refresh(key))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _run(self):
+        """
+        Main loop of the scheduler.
+        """
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(
+                    "snapshot scheduling failed", extra={"error": str(e)}
+                )
+            await asyncio.sleep(self.tick)
+
+    def start(self):
+        """
+        Start the scheduler on the running event loop.
+        """
+        if self._task is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop scheduling refreshes and cancel the refreshes in flight.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
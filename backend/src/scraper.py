@@ -0,0 +1,320 @@
+"""
+This file contains the asyncio Playwright scrapers for the supported venues.
+"""
+
+import re
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional
+
+from fastapi import HTTPException
+from http_scraper import BHA_PROFILE_FIELDS, build_bha_member_info
+from log import get_logger
+from metrics import SCRAPE_STAGE_SECONDS
+from model import DogInfo, MemberInfo, VenuesTable, VenueUsersTable
+
+# Playwright is imported on first use so the API starts without it
+if TYPE_CHECKING:
+    from playwright.async_api import BrowserContext, Page
+
+logger = get_logger("scraper")
+
+# Runs in the page: the cell texts of each row matched by a selector
+_READ_ROWS_JS = """
+rows => rows.map(
+    row => Array.from(row.querySelectorAll("td"), td => td.innerText)
+)
+"""
+
+# Runs in the page: the value attribute of each named input, or the current
+# value of each named select, keyed by name; null when there is no element
+_READ_FIELDS_JS = """
+names => Object.fromEntries(names.map(name => {
+    const element = document.querySelector(`[name="${name}"]`);
+    if (element === null) return [name, null];
+    return [
+        name,
+        element.tagName === "SELECT"
+            ? element.value
+            : element.getAttribute("value"),
+    ];
+}))
+"""
+
+
+async def read_table(page: "Page", selector: str) -> List[List[str]]:
+    """
+    Read the cell texts of every row inside the elements matched by a
+    selector in a single round trip to the browser.
+
+    Parameters
+    ----------
+    page : Page
+        The page holding the table.
+    selector : str
+        Selector of the table or its container (ie; '#DogList')
+
+    Returns
+    -------
+    List[List[str]]
+        The inner text of each td, one list per tr, in document order. Empty
+        if nothing matches.
+    """
+    return await page.locator(f"{selector} tr").evaluate_all(_READ_ROWS_JS)
+
+
+async def read_fields(
+    page: "Page", names: Iterable[str]
+) -> Dict[str, Optional[str]]:
+    """
+    Read a set of named form fields in a single round trip to the browser.
+
+    Parameters
+    ----------
+    page : Page
+        The page holding the form.
+    names : Iterable[str]
+        The name attributes of the inputs and selects to read.
+
+    Returns
+    -------
+    Dict[str, Optional[str]]
+        The value attribute of each input and the selected value of each
+        select, keyed by name. None for names not found on the page.
+    """
+    return await page.evaluate(_READ_FIELDS_JS, list(names))
+
+
+async def resume_session(page: "Page", url: str, login_selector: str) -> bool:
+    """
+    Open a members-only page using the session the context was created with.
+
+    Parameters
+    ----------
+    page : Page
+        A page in a context created from a stored session.
+    url : str
+        A page that is only reachable while logged in.
+    login_selector : str
+        Selector of an input that only appears on the login form.
+
+    Returns
+    -------
+    bool
+        True if the page loaded as a logged in member, False if the venue
+        redirected to, or showed, its login form instead.
+    """
+    from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+
+    try:
+        await page.goto(url)
+    except PlaywrightTimeoutError:
+        return False
+    if page.url.split("?")[0] != url.split("?")[0]:
+        return False
+    return await page.locator(login_selector).count() == 0
+
+
+async def scrape_cpe_info(
+    context: "BrowserContext",
+    user_info: VenueUsersTable,
+    venue_info: VenuesTable,
+    resume: bool = False,
+) -> MemberInfo:
+    """
+    Log in to CPE and scrape the member and dog records.
+
+    Parameters
+    ----------
+    context : BrowserContext
+        A fresh browser context handed out by the browser pool.
+    user_info : VenueUsersTable
+        The user's CPE credentials.
+    venue_info : VenuesTable
+        The CPE row from the venues table.
+    resume : bool
+        True if the context was created from a stored session, in which case
+        the login form is skipped unless CPE rejects the session.
+
+    Returns
+    -------
+    MemberInfo
+        The handler and dog information found on CPE.
+    """
+    from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+
+    venue = venue_info.venue
+    page = await context.new_page()
+    records_url = f"{venue_info.url}/Member/Records?isViewingActiveDogs=True"
+
+    try:
+        with SCRAPE_STAGE_SECONDS.time(venue=venue, stage="navigation"):
+            resumed = resume and await resume_session(
+                page, records_url, "input[name='PasswordInput']"
+            )
+            if not resumed:
+                await page.goto(venue_info.url)
+        if not resumed:
+            with SCRAPE_STAGE_SECONDS.time(venue=venue, stage="login"):
+                await page.fill(
+                    "input[name='MemberIdOrEmailInput']",
+                    user_info.venue_user_id,
+                )
+                await page.fill(
+                    "input[name='PasswordInput']", user_info.venue_password
+                )
+                await page.locator('input[type="submit"]').click()
+                await page.wait_for_url(records_url)
+    except PlaywrightTimeoutError:
+        detail = (
+            "Processing error for venue=CPE and "
+            + f"user={user_info.venue_user_id}"
+        )
+        raise HTTPException(status_code=500, detail=detail)
+
+    with SCRAPE_STAGE_SECONDS.time(venue=venue, stage="profile"):
+        handler, handler_member_id, address, phone, email = (
+            None,
+            None,
+            None,
+            None,
+            None,
+        )
+        address_div_locator = page.locator("#MemberInformation .address")
+        address_pattern = re.compile(
+            r"Member ID:(\d+)\n"  # member_id
+            r"Primary:(.+)\n"  # handler
+            r"Secondary:(.*)\n"  # secondary
+            r"Address:\n"  # address
+            r"(.*)",
+            re.DOTALL,
+        )
+        match = address_pattern.match(await address_div_locator.inner_text())
+        if match:
+            handler_member_id, handler, _, address = match.groups()
+        contact_div_locator = page.locator(
+            "#MemberInformation .contact-information"
+        )
+        contact_pattern = re.compile(
+            r"Dues Paid Through:(.+)\n"  # info
+            r"Phone [#]{1}1:(.+)\n"  # phone_1
+            r"Phone [#]{1}2:(.+)\n"
+            r"Email:(.+)"
+        )
+        match = contact_pattern.match(await contact_div_locator.inner_text())
+        if match:
+            _, phone, _, email = match.groups()
+
+    with SCRAPE_STAGE_SECONDS.time(venue=venue, stage="table"):
+        table_data = []
+        for row_data in await read_table(page, "#DogList"):
+            if len(row_data) >= 5:
+                table_data.append(
+                    (
+                        handler_member_id,
+                        row_data[0],
+                        row_data[1],
+                        row_data[2],
+                        row_data[3],
+                        row_data[4],
+                    )
+                )
+
+    with SCRAPE_STAGE_SECONDS.time(venue=venue, stage="model"):
+        dog_info_list = [
+            DogInfo(
+                dog_member_id=item[1],
+                call_name=item[2],
+                breed=item[3],
+                jump_height=int(
+                    item[4] if item[4] != "Needs Measurement" else "-1"
+                ),
+                dob=datetime.strptime(item[5], "%m/%d/%Y"),
+            )
+            for item in table_data
+        ]
+        member_info = MemberInfo(
+            venue=venue_info.venue,
+            icon=venue_info.icon,
+            description=venue_info.description,
+            handler_member_id=handler_member_id,
+            handler=handler,
+            phone=phone,
+            email=email,
+            address=address,
+            dog_info=dog_info_list,
+        )
+    return member_info
+
+
+async def scrape_bha_info(
+    context: "BrowserContext",
+    user_info: VenueUsersTable,
+    venue_info: VenuesTable,
+    resume: bool = False,
+) -> MemberInfo:
+    """
+    Log in to BHA and scrape the member profile and dog records.
+
+    Parameters
+    ----------
+    context : BrowserContext
+        A fresh browser context handed out by the browser pool.
+    user_info : VenueUsersTable
+        The user's BHA credentials.
+    venue_info : VenuesTable
+        The BHA row from the venues table.
+    resume : bool
+        True if the context was created from a stored session, in which case
+        the login form is skipped unless BHA rejects the session.
+
+    Returns
+    -------
+    MemberInfo
+        The handler and dog information found on BHA.
+    """
+    from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+
+    venue = venue_info.venue
+    page = await context.new_page()
+    profile_url = f"{venue_info.url}/register/your_profile.php"
+
+    try:
+        with SCRAPE_STAGE_SECONDS.time(venue=venue, stage="navigation"):
+            resumed = resume and await resume_session(
+                page, profile_url, "input[name='pass']"
+            )
+            if not resumed:
+                await page.goto(f"{venue_info.url}/register/login.php")
+        if not resumed:
+            with SCRAPE_STAGE_SECONDS.time(venue=venue, stage="login"):
+                await page.fill("input[name='user']", user_info.venue_user_id)
+                await page.fill("input[name='pass']", user_info.venue_password)
+                await page.locator('input[type="submit"]').click()
+                await page.wait_for_url(
+                    f"{venue_info.url}/register/barn_hunt_dog_register.php"
+                )
+
+        with SCRAPE_STAGE_SECONDS.time(venue=venue, stage="profile"):
+            if not resumed:
+                await page.goto(profile_url)
+
+            profile = await read_fields(page, BHA_PROFILE_FIELDS)
+
+        with SCRAPE_STAGE_SECONDS.time(venue=venue, stage="table"):
+            await page.goto(f"{venue_info.url}/register/your_dogs.php")
+            table_data = await read_table(page, "table.data")
+
+        with SCRAPE_STAGE_SECONDS.time(venue=venue, stage="model"):
+            member_info = build_bha_member_info(venue_info, profile, table_data)
+        logger.debug(
+            "scraped venue",
+            extra={"venue": venue, "dogs": len(member_info.dog_info)},
+        )
+        return member_info
+
+    except PlaywrightTimeoutError:
+        detail = (
+            "Processing error for venue=BHA and "
+            + f"user={user_info.venue_user_id}"
+        )
+        raise HTTPException(status_code=500, detail=detail)
@@ -0,0 +1,284 @@
+"""
+This file contains the production entry point of the backend: a preforking
+supervisor that imports the app once, binds the listening socket, and forks
+uvicorn workers that share it. Worker count and per-worker pool sizes are
+derived from the cores and memory available to the container, and each
+worker is replaced after serving a bounded number of requests.
+
+Usage:
+
+    python src/serve.py
+"""
+
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from typing import Dict, Optional
+
+# Resident memory of a worker without its browsers
+WORKER_BASE_MEMORY_MB = int(os.environ.get("WORKER_BASE_MEMORY_MB", "150"))
+
+# Resident memory of one pooled Chromium with its contexts
+BROWSER_MEMORY_MB = int(os.environ.get("BROWSER_MEMORY_MB", "300"))
+
+# Database connections shared by all workers (MySQL defaults to 151)
+DB_MAX_CONNECTIONS = int(os.environ.get("DB_MAX_CONNECTIONS", "100"))
+
+# Requests a worker serves before it is replaced, plus up to JITTER more so
+# workers do not all restart at once. 0 disables restarts.
+MAX_REQUESTS = int(os.environ.get("MAX_REQUESTS", "1000"))
+MAX_REQUESTS_JITTER = int(os.environ.get("MAX_REQUESTS_JITTER", "100"))
+
+# Seconds a stopping worker may spend finishing in-flight requests
+GRACEFUL_TIMEOUT = int(os.environ.get("GRACEFUL_TIMEOUT", "30"))
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def available_cpus() -> int:
+    """
+    Return the number of cores the process may use, honoring the cgroup CPU
+    quota of a container.
+
+    Returns
+    -------
+    int
+        At least 1.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = _read("/sys/fs/cgroup/cpu.max")  # cgroup v2: '<quota> <period>'
+    if quota and not quota.startswith("max"):
+        limit, period = quota.split()
+        cpus = min(cpus, int(limit) // int(period) or 1)
+    return max(1, cpus)
+
+
+def available_memory_mb() -> int:
+    """
+    Return the memory the process may use in MB, honoring the cgroup memory
+    limit of a container.
+
+    Returns
+    -------
+    int
+        The memory limit, or the physical memory if there is none.
+    """
+    memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    for path in (
+        "/sys/fs/cgroup/memory.max",  # cgroup v2
+        "/sys/fs/cgroup/memory/memory.limit_in_bytes",  # cgroup v1
+    ):
+        limit = _read(path)
+        if limit and limit.isdigit():
+            memory = min(memory, int(limit))
+            break
+    return memory // 2**20
+
+
+def plan_workers(cpus: int, memory_mb: int) -> Dict[str, int]:
+    """
+    Size the workers and their pools for a host.
+
+    One worker per core, as long as each can hold its base memory and one
+    browser. The rest of a worker's share of memory goes to more browsers,
+    up to 4. Database connections and password hashing processes are split
+    between the workers.
+
+    Parameters
+    ----------
+    cpus : int
+        Cores available.
+    memory_mb : int
+        Memory available in MB.
+
+    Returns
+    -------
+    Dict[str, int]
+        The WEB_CONCURRENCY, BROWSER_POOL_SIZE, DB_POOL_SIZE and
+        PASSWORD_HASH_WORKERS to use.
+    """
+    workers = int(
+        os.environ.get(
+            "WEB_CONCURRENCY",
+            max(
+                1,
+                min(
+                    cpus,
+                    memory_mb // (WORKER_BASE_MEMORY_MB + BROWSER_MEMORY_MB),
+                ),
+            ),
+        )
+    )
+    share_mb = memory_mb // workers - WORKER_BASE_MEMORY_MB
+    return {
+        "WEB_CONCURRENCY": workers,
+        "BROWSER_POOL_SIZE": max(1, min(4, share_mb // BROWSER_MEMORY_MB)),
+        "DB_POOL_SIZE": max(2, min(10, DB_MAX_CONNECTIONS // workers)),
+        "PASSWORD_HASH_WORKERS": max(1, cpus // workers),
+    }
+
+
+class Supervisor:
+    """
+    Forks the workers, replaces any that exit, and stops them all on SIGTERM
+    or SIGINT.
+    """
+
+    def __init__(self, app, sock: socket.socket, workers: int):
+        """
+        Constructor for the Supervisor class.
+
+        Parameters
+        ----------
+        app : FastAPI
+            The imported app, inherited by every worker.
+        sock : socket.socket
+            The bound listening socket, shared by every worker.
+        workers : int
+            Number of workers to keep running.
+        """
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        # pid -> worker index
+        self.children: Dict[int, int] = {}
+        self.stopping = False
+
+    def spawn(self, index: int):
+        """
+        Fork worker number index. Only worker 0 runs the snapshot refresh
+        scheduler, so each snapshot is refreshed once.
+        """
+        from log import configure_logging, get_logger, shutdown_logging
+
+        # Fork without the logging thread, which the child would not inherit
+        shutdown_logging()
+        pid = os.fork()
+        configure_logging()
+        if pid:
+            self.children[pid] = index
+            return
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        exit_code = 1
+        try:
+            self.run_worker(index)
+            exit_code = 0
+        except Exception:
+            get_logger("serve").exception("worker failed", extra={"index": index})
+        finally:
+            shutdown_logging()
+            os._exit(exit_code)
+
+    def run_worker(self, index: int):
+        import endpoint
+        import uvicorn
+
+        if index != 0:
+            endpoint.SNAPSHOT_REFRESH_ENABLED = False
+        limit = None
+        if MAX_REQUESTS:
+            limit = MAX_REQUESTS + random.randint(0, MAX_REQUESTS_JITTER)
+        config = uvicorn.Config(
+            self.app,
+            limit_max_requests=limit,
+            timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+            log_level=os.environ.get("UVICORN_LOG_LEVEL", "warning"),
+        )
+        uvicorn.Server(config).run(sockets=[self.sock])
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        """
+        Keep the workers running until a stop signal, then wait for them to
+        finish their in-flight requests.
+        """
+        from log import get_logger
+
+        logger = get_logger("serve")
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.workers):
+            self.spawn(index)
+        started = {index: time.monotonic() for index in range(self.workers)}
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            index = self.children.pop(pid, None)
+            if index is None or self.stopping:
+                continue
+            logger.info(
+                "replacing worker",
+                extra={
+                    "index": index,
+                    "pid": pid,
+                    "exit_code": os.waitstatus_to_exitcode(status),
+                },
+            )
+            # Do not spin on a worker that dies as soon as it starts
+            if time.monotonic() - started[index] < 1:
+                time.sleep(1)
+            started[index] = time.monotonic()
+            self.spawn(index)
+
+
+def main():
+    cpus = available_cpus()
+    memory_mb = available_memory_mb()
+    plan = plan_workers(cpus, memory_mb)
+    # Explicit settings win; the rest are read when endpoint is imported
+    for name, value in plan.items():
+        os.environ.setdefault(name, str(value))
+
+    import endpoint
+    from log import get_logger
+
+    logger = get_logger("serve")
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    host = os.environ.get("HOST", "0.0.0.0")
+    sock.bind((host, int(os.environ.get("PORT", "8001"))))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    workers = int(os.environ["WEB_CONCURRENCY"])
+    logger.info(
+        "starting workers",
+        extra={
+            "cpus": cpus,
+            "memory_mb": memory_mb,
+            "address": "%s:%d" % sock.getsockname()[:2],
+            **{name: os.environ[name] for name in plan},
+        },
+    )
+    Supervisor(endpoint.app, sock, workers).run()
+    sock.close()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
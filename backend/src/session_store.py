@@ -0,0 +1,174 @@
+"""
+This file contains an in-process store of authenticated venue sessions, so
+scrapes can skip the venue login form while a session is still valid.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, FrozenSet, Optional
+
+if TYPE_CHECKING:
+    from playwright.async_api import StorageState
+
+
+def _parse_cookie_names(value: str) -> Dict[str, FrozenSet[str]]:
+    """
+    Parse per-venue cookie names, ie; 'CPE=.ASPXAUTH|ASP.NET_SessionId'.
+    """
+    names = {}
+    for item in value.split(","):
+        if "=" in item:
+            venue, cookies = item.split("=", 1)
+            names[venue.strip()] = frozenset(
+                name.strip() for name in cookies.split("|") if name.strip()
+            )
+    return names
+
+
+class SessionStore:
+    """
+    Playwright storage state (cookies and localStorage) keyed by
+    (user_id, venue).
+
+    A session expires after a fixed TTL or as soon as its earliest
+    expiring authentication cookie does, whichever comes first; a short
+    lived tracking cookie does not end it. Scrapers invalidate a session
+    when the venue rejects it.
+    """
+
+    def __init__(
+        self,
+        ttl: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        auth_cookies: Optional[Dict[str, FrozenSet[str]]] = None,
+    ):
+        """
+        Constructor for the SessionStore class.
+
+        Parameters
+        ----------
+        ttl : Optional[float]
+            Seconds a session is reused for. Defaults to the VENUE_SESSION_TTL
+            environment variable or 1800.
+        max_entries : Optional[int]
+            Number of sessions kept before the least recently used one is
+            dropped. Defaults to the VENUE_SESSION_MAX_ENTRIES environment
+            variable or 1000.
+        auth_cookies : Optional[Dict[str, FrozenSet[str]]]
+            Names of the cookies that hold each venue's login. Defaults to
+            the VENUE_SESSION_COOKIES environment variable (ie;
+            'CPE=.ASPXAUTH|ASP.NET_SessionId,BHA=PHPSESSID'). For venues not
+            listed, the HttpOnly cookies are taken to be the login, since
+            tracking scripts cannot set those.
+        """
+        self.ttl = ttl or float(os.environ.get("VENUE_SESSION_TTL", "1800"))
+        self.max_entries = max_entries or int(
+            os.environ.get("VENUE_SESSION_MAX_ENTRIES", "1000")
+        )
+        self.auth_cookies = auth_cookies or _parse_cookie_names(
+            os.environ.get("VENUE_SESSION_COOKIES", "")
+        )
+        # (user_id, venue) -> (expires_at, storage_state)
+        self._sessions: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expires_at(self, venue: str, storage_state: "StorageState") -> float:
+        """
+        Work out when a session stops being usable.
+
+        Parameters
+        ----------
+        venue : str
+            The venue the session belongs to (ie; 'CPE')
+        storage_state : StorageState
+            Storage state as returned by BrowserContext.storage_state().
+
+        Returns
+        -------
+        float
+            Epoch seconds after which the session is treated as expired.
+        """
+        cookies = storage_state.get("cookies", [])
+        names = self.auth_cookies.get(venue)
+        if names:
+            auth = [cookie for cookie in cookies if cookie.get("name") in names]
+        else:
+            auth = [cookie for cookie in cookies if cookie.get("httpOnly")]
+        expires_at = time.time() + self.ttl
+        # Without a recognisable login cookie, any cookie may be the login
+        for cookie in auth or cookies:
+            # Session cookies report an expiry of -1
+            expires = cookie.get("expires", -1)
+            if expires > 0:
+                expires_at = min(expires_at, expires)
+        return expires_at
+
+    def get(self, user_id: str, venue: str) -> Optional["StorageState"]:
+        """
+        Return the stored session for a user and venue.
+
+        Parameters
+        ----------
+        user_id : str
+            The sso user id.
+        venue : str
+            The venue the session belongs to (ie; 'CPE')
+
+        Returns
+        -------
+        Optional[StorageState]
+            The storage state, or None if there is no unexpired session.
+        """
+        key = (user_id, venue)
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None:
+                return None
+            expires_at, storage_state = entry
+            if expires_at <= time.time():
+                del self._sessions[key]
+                return None
+            self._sessions.move_to_end(key)
+            return storage_state
+
+    def put(self, user_id: str, venue: str, storage_state: "StorageState"):
+        """
+        Store the session for a user and venue.
+
+        Parameters
+        ----------
+        user_id : str
+            The sso user id.
+        venue : str
+            The venue the session belongs to (ie; 'CPE')
+        storage_state : StorageState
+            Storage state as returned by BrowserContext.storage_state().
+        """
+        key = (user_id, venue)
+        with self._lock:
+            self._sessions[key] = (
+                self._expires_at(venue, storage_state),
+                storage_state,
+            )
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+
+    def invalidate(self, user_id: str, venue: str):
+        """
+        Forget the session for a user and venue.
+
+        Parameters
+        ----------
+        user_id : str
+            The sso user id.
+        venue : str
+            The venue the session belongs to (ie; 'CPE')
+        """
+        with self._lock:
+            self._sessions.pop((user_id, venue), None)
+
+
+SESSION_STORE = SessionStore()
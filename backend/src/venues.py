@@ -0,0 +1,189 @@
+"""
+This file contains the registry of venue adapters, keyed by the venue column
+of the venues table. An adapter tells the backend how to scrape one venue:
+the Playwright scraper that logs in, extracts and parses the member pages,
+an optional browserless engine tried first, how many of its browser scrapes
+may run at once and how fast scrapes may start against its servers. Those
+limits are for the whole host and are split between the server's worker
+processes.
+
+Adding a venue means writing its scraper and registering an adapter here.
+"""
+
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from admission import SCRAPE_ADMISSION
+from common import parse_venue_values, worker_count, worker_share
+from http_scraper import scrape_bha_info_http
+from log import get_logger
+from model import MemberInfo
+from scraper import scrape_bha_info, scrape_cpe_info
+
+logger = get_logger("venues")
+
+# Per-venue scrape start rates, overriding the adapters' (ie; 'CPE=0.5')
+SCRAPE_VENUE_RATES = parse_venue_values(os.environ.get("SCRAPE_VENUE_RATES", ""))
+
+# Try the browserless BHA engine before the browser
+BHA_HTTP_ENGINE = os.environ.get("BHA_HTTP_ENGINE", "true").lower() == "true"
+
+
+class TokenBucket:
+    """
+    Lets up to burst scrapes start at once and rate per second after that.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        """
+        Constructor for the TokenBucket class.
+
+        Parameters
+        ----------
+        rate : float
+            Tokens added per second.
+        burst : int
+            Most tokens the bucket holds.
+
+        Raises
+        ------
+        ValueError
+            If rate is not positive or burst is less than 1; no scrape
+            could ever start.
+        """
+        if rate <= 0:
+            raise ValueError(f"Token bucket rate must be positive: {rate}")
+        if burst < 1:
+            raise ValueError(f"Token bucket burst must be at least 1: {burst}")
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    async def acquire(self) -> float:
+        """
+        Take a token, waiting for one if the bucket is empty. Waiters are
+        served in arrival order.
+
+        Returns
+        -------
+        float
+            Seconds spent waiting.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        start = time.monotonic()
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+        return time.monotonic() - start
+
+
+class VenueAdapter:
+    """
+    How to scrape one venue.
+    """
+
+    def __init__(
+        self,
+        venue: str,
+        browser_scraper: Callable[..., Awaitable[MemberInfo]],
+        http_scraper: Optional[Callable[..., MemberInfo]] = None,
+        concurrency: int = 4,
+        rate: float = 1.0,
+        burst: int = 4,
+    ):
+        """
+        Constructor for the VenueAdapter class.
+
+        Parameters
+        ----------
+        venue : str
+            The venue column of the venues table (ie; 'CPE')
+        browser_scraper : Callable[..., Awaitable[MemberInfo]]
+            Logs in and scrapes the member pages in a browser context (ie;
+            scrape_cpe_info)
+        http_scraper : Optional[Callable[..., MemberInfo]]
+            A blocking browserless scraper tried first (ie;
+            scrape_bha_info_http). It scrapes with an http_scraper.HttpSession
+            and raises http_scraper.ExtractionError to fall back to the
+            browser.
+        concurrency : int
+            Browser scrapes of the venue that may run at once on the host,
+            unless SCRAPE_VENUE_LIMITS sets it.
+        rate : float
+            Scrapes per second that may start against the venue's servers
+            from the host, unless SCRAPE_VENUE_RATES sets it.
+        burst : int
+            Scrapes that may start at once after a quiet period.
+        """
+        self.venue = venue
+        self.browser_scraper = browser_scraper
+        self.http_scraper = http_scraper
+        # Each worker process enforces its share of the host's limits
+        self.concurrency = worker_share(concurrency)
+        self.rate = SCRAPE_VENUE_RATES.get(venue, rate) / worker_count()
+        self.bucket = TokenBucket(self.rate, worker_share(burst))
+
+    async def throttle(self):
+        """
+        Wait until the venue's rate limit lets another scrape start.
+        """
+        waited = await self.bucket.acquire()
+        if waited > 0.001:
+            logger.debug(
+                "scrape throttled",
+                extra={"venue": self.venue, "waited": round(waited, 3)},
+            )
+
+
+# Adapters keyed by venue; venues without one are reported as unsupported
+VENUE_ADAPTERS: Dict[str, VenueAdapter] = {}
+
+
+def register_venue(adapter: VenueAdapter) -> VenueAdapter:
+    """
+    Add a venue adapter to the registry and apply its concurrency cap to
+    browser scrape admission.
+
+    Parameters
+    ----------
+    adapter : VenueAdapter
+        The adapter.
+
+    Returns
+    -------
+    VenueAdapter
+        The adapter.
+    """
+    VENUE_ADAPTERS[adapter.venue] = adapter
+    SCRAPE_ADMISSION.venue_limits.setdefault(adapter.venue, adapter.concurrency)
+    return adapter
+
+
+register_venue(
+    VenueAdapter("CPE", scrape_cpe_info, concurrency=4, rate=1.0, burst=4)
+)
+register_venue(
+    VenueAdapter(
+        "BHA",
+        scrape_bha_info,
+        http_scraper=scrape_bha_info_http if BHA_HTTP_ENGINE else None,
+        concurrency=4,
+        rate=2.0,
+        burst=8,
+    )
+)